@@ -0,0 +1,70 @@
+"""Benchmark the `money` template filter.
+
+Compares the per-call cost of the current implementation to the previous one, which
+compiled its HTML snippet and looked up currency data on every call.
+
+Run from the repository root::
+
+    PYTHONPATH=src python benchmarks/money.py
+
+"""
+from collections import namedtuple
+from decimal import Decimal
+from timeit import Timer
+
+import click
+from babel import numbers
+from jinja2 import Environment, BaseLoader
+from jinja2.nodes import EvalContext
+from markupsafe import Markup, escape
+
+from gnucash_web.utils.jinja import money
+
+Commodity = namedtuple("Commodity", ["mnemonic"])
+
+
+def money_uncached(eval_ctx, amount, commodity):
+    """Previous implementation of `gnucash_web.utils.jinja.money`, for reference."""
+    if numbers.get_currency_symbol(commodity.mnemonic) != commodity.mnemonic:
+        value = numbers.format_currency(amount, commodity.mnemonic)
+    else:
+        value = f"{amount} {commodity.mnemonic}"
+
+    if eval_ctx.autoescape:
+        value = escape(value)
+
+    return Markup(
+        Environment(loader=BaseLoader())
+        .from_string(
+            """
+      <span class="text-{% if amount >= 0 %}secondary{% else %}danger{% endif %}">
+        {{ value }}
+      </span>
+    """
+        )
+        .render(amount=amount, value=value)
+    )
+
+
+@click.command()
+@click.option("--number", default=2000, help="Calls per measurement")
+@click.option("--repeat", default=5, help="Number of measurements")
+def main(number, repeat):
+    """Print the best per-call cost of both implementations."""
+    eval_ctx = EvalContext(Environment(autoescape=True))
+    args = [
+        (Decimal("-1234.56"), Commodity("EUR")),
+        (Decimal("42.5"), Commodity("AAPL")),
+    ]
+
+    for name, func in [("before", money_uncached), ("after", money)]:
+        assert all(func(eval_ctx, *a) == money(eval_ctx, *a) for a in args)
+
+        for amount, commodity in args:
+            timer = Timer(lambda: func(eval_ctx, amount, commodity))
+            best = min(timer.repeat(repeat=repeat, number=number)) / number
+            print(f"{name:>6} {commodity.mnemonic:>5}: {best * 1e6:8.1f} µs/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""Benchmark GnuCash Web end to end on a synthetic book.
+
+Drives the app through the Flask test client and records latency percentiles, the
+number of SQL statements and the peak memory allocated by each scenario. Results are
+written as JSON, so runs on different commits can be compared.
+
+Run from the repository root::
+
+    PYTHONPATH=src python benchmarks/suite.py run --transactions 100000 -o before.json
+    git checkout other-branch
+    PYTHONPATH=src python benchmarks/suite.py run --transactions 100000 -o after.json
+    PYTHONPATH=src python benchmarks/suite.py compare before.json after.json
+
+Logging in with passthrough authentication needs a database server, since SQLite
+books have no users. Pass the URI of a book on a server, including credentials, as
+`--auth-uri` to benchmark it too. That book is only read.
+
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from itertools import chain
+from statistics import quantiles
+
+import click
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+
+from gnucash_web import create_app
+from gnucash_web.utils.accounts import account_index
+from gnucash_web.utils.gnucash import open_book
+from gnucash_web.utils.jinja import account_url
+from gnucash_web.utils.writes import get_transaction, transaction_version
+from synthetic import generate_book
+
+# Number of SQL statements executed since the start of the benchmark
+_statements = 0
+
+
+def _count_statement(*args):
+    global _statements
+    _statements += 1
+
+
+def measure(func, repeat):
+    """Call a function repeatedly and measure it.
+
+    The first call is a warm-up and only used to measure the peak memory and number
+    of SQL statements.
+
+    :param func: Function without arguments
+    :param repeat: Number of timed calls, at least 2
+    :returns: Dictionary of measurements, with latencies in milliseconds
+
+    """
+    tracemalloc.start()
+    statements = _statements
+    func()
+    statements = _statements - statements
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    latencies.sort()
+    percentiles = quantiles(latencies, n=100, method="inclusive")
+    return {
+        "calls": repeat,
+        "p50_ms": round(percentiles[49], 3),
+        "p90_ms": round(percentiles[89], 3),
+        "p99_ms": round(percentiles[98], 3),
+        "max_ms": round(latencies[-1], 3),
+        "sql_statements": statements,
+        "peak_memory_kib": peak // 1024,
+    }
+
+
+def scenarios(app, book_path, repeat):
+    """Define all scenarios.
+
+    :param app: The Flask app, configured for the book
+    :param book_path: Path of the SQLite book, for looking up test data
+    :param repeat: Number of calls per scenario
+    :returns: Iterable of scenario name and function, functions are called `repeat`
+      times, plus one warm-up
+
+    """
+    client = app.test_client()
+    database = create_engine(f"sqlite:///{book_path}")
+
+    def get(url):
+        def func():
+            response = client.get(url)
+            assert response.status_code == 200, (url, response.status_code)
+
+        return func
+
+    def post(url, data):
+        response = client.post(url, data=data)
+        assert response.status_code == 302, (url, response.status_code)
+
+    with database.connect() as connection:
+        account_guid, = connection.execute(
+            text(
+                "SELECT account_guid FROM splits"
+                " GROUP BY account_guid ORDER BY count(*) DESC"
+            )
+        ).first()
+        num_splits, = connection.execute(
+            text("SELECT count(*) FROM splits WHERE account_guid = :guid"),
+            {"guid": account_guid},
+        ).first()
+        contra_guid, = connection.execute(
+            text(
+                "SELECT guid FROM accounts WHERE commodity_guid = ("
+                "SELECT commodity_guid FROM accounts WHERE guid = :guid)"
+                " AND guid != :guid AND NOT placeholder AND parent_guid IS NOT NULL"
+                " AND account_type != 'ROOT'"
+            ),
+            {"guid": account_guid},
+        ).first()
+
+    with app.test_request_context():
+        with open_book(app.config.DB_URI(), open_if_lock=True) as book:
+            index = account_index(book)
+            account, contra = index[account_guid], index[contra_guid]
+            account_path = account_url(account)
+
+    pages = max(1, -(-num_splits // app.config.TRANSACTION_PAGE_LENGTH))
+
+    yield "root_tree", get("/book/accounts/")
+    yield "ledger_first_page", get(account_path)
+    yield "ledger_middle_page", get(f"{account_path}?page={max(1, pages // 2)}")
+    yield "ledger_last_page", get(f"{account_path}?page={pages}")
+
+    # Writes: Each call adds a transaction, then each of them is edited and deleted
+    form = {
+        "account_name": account.fullname,
+        "contra_account_name": contra.fullname,
+        "date": "2020-01-01",
+        "value": "12.34",
+        "sign": "-1",
+    }
+    added = iter(range(repeat + 1))
+    yield "add_transaction", lambda: post(
+        "/book/add_transaction", dict(form, description=f"Benchmark {next(added)}")
+    )
+
+    with database.connect() as connection:
+        guids = [
+            guid
+            for guid, in connection.execute(
+                text("SELECT guid FROM transactions WHERE description LIKE 'Benchmark %'")
+            )
+        ]
+
+    def versions():
+        """Get the current versions of the added transactions, as sent by forms."""
+        with app.test_request_context():
+            with open_book(app.config.DB_URI(), open_if_lock=True) as book:
+                return {
+                    guid: transaction_version(get_transaction(book, guid))
+                    for guid in guids
+                }
+
+    edited, current = iter(guids), versions()
+    yield "edit_transaction", lambda: post(
+        "/book/edit_transaction",
+        dict(
+            form,
+            guid=(guid := next(edited)),
+            version=current[guid],
+            description="Edited",
+            value="43.21",
+        ),
+    )
+
+    deleted, current = iter(guids), versions()
+    yield "del_transaction", lambda: post(
+        "/book/del_transaction",
+        {
+            "guid": (guid := next(deleted)),
+            "version": current[guid],
+            "account_name": account.fullname,
+        },
+    )
+
+    runner = app.test_cli_runner()
+
+    def list_commodities():
+        result = runner.invoke(args=["commodities", "list"])
+        assert result.exit_code == 0, result.output
+
+    yield "commodities_list", list_commodities
+
+    # Each call fetches and stores today's price of every stock, like a daily job. The
+    # prices stored by the previous call are deleted first, or there was nothing new.
+    with database.begin() as connection:
+        connection.execute(
+            text("UPDATE commodities SET quote_flag = 1 WHERE namespace != 'CURRENCY'")
+        )
+
+    def update_prices():
+        with database.begin() as connection:
+            connection.execute(text("DELETE FROM prices WHERE source = 'stub'"))
+        result = runner.invoke(
+            args=[
+                "commodities",
+                "update_prices",
+                "--provider",
+                "gnucash_web.utils.prices.StubQuoteProvider",
+            ]
+        )
+        assert result.exit_code == 0, result.output
+
+    yield "commodities_update_prices", update_prices
+
+
+def auth_scenarios(uri):
+    """Define scenarios of passthrough authentication.
+
+    :param uri: URI of a book on a database server, including user name and password
+    :returns: Iterable of scenario name and function, see `scenarios`
+
+    """
+    url = make_url(uri)
+    host = f"{url.host}:{url.port}" if url.port else url.host
+    app = create_app(
+        {
+            "DB_DRIVER": url.drivername,
+            "DB_HOST": host,
+            "DB_NAME": url.database,
+            "AUTH_MECHANISM": "passthrough",
+            # Check the credentials with the database on every login
+            "AUTH_CACHE_TTL": 0,
+        }
+    )
+    credentials = {"username": url.username, "password": url.password}
+    client = app.test_client()
+
+    def login():
+        response = client.post("/auth/login", data=credentials)
+        assert response.status_code == 302, response.status_code
+
+    login()
+    response = client.get("/book/accounts/")
+    if response.status_code != 200:
+        raise click.ClickException(f"Could not log in to {url!r}")
+
+    def root_tree():
+        response = client.get("/book/accounts/")
+        assert response.status_code == 200, response.status_code
+
+    yield "auth_login", login
+    yield "auth_root_tree", root_tree
+
+
+@click.group()
+def cli():
+    """Benchmark GnuCash Web."""
+
+
+@cli.command()
+@click.option("--book", help="Use existing SQLite book instead of generating one")
+@click.option("--accounts", default=200, help="Number of accounts in generated book")
+@click.option("--depth", default=4, help="Depth of account tree in generated book")
+@click.option("--transactions", default=100000, help="Transactions in generated book")
+@click.option("--commodities", default=10, help="Number of stocks in generated book")
+@click.option("--prices", default=365, help="Prices per stock in generated book")
+@click.option(
+    "--repeat", default=20, type=click.IntRange(min=2), help="Calls per scenario"
+)
+@click.option(
+    "--auth-uri", help="Book on a database server to benchmark authentication with"
+)
+@click.option("-o", "--output", type=click.File("w"), default="-", help="JSON output")
+def run(book, repeat, auth_uri, output, **book_options):
+    """Run all scenarios and write results as JSON.
+
+    Writes modify the book, so a copy is used when passing `--book`. Authentication
+    is only benchmarked when passing `--auth-uri`, see the module docstring.
+
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "book.sqlite")
+        if book:
+            with open(book, "rb") as source, open(path, "wb") as target:
+                target.write(source.read())
+            book_options = {"book": book}
+        else:
+            click.echo(f"Generating book {book_options}", err=True)
+            book_options = generate_book(path, **book_options)
+
+        app = create_app(
+            {"DB_DRIVER": "sqlite", "DB_NAME": path, "PRICE_FETCH_RATE": 0}
+        )
+        event.listen(Engine, "after_cursor_execute", _count_statement)
+
+        all_scenarios = scenarios(app, path, repeat)
+        if auth_uri:
+            all_scenarios = chain(all_scenarios, auth_scenarios(auth_uri))
+
+        results = {}
+        for name, func in all_scenarios:
+            click.echo(f"Running {name}", err=True)
+            results[name] = measure(func, repeat)
+
+    json.dump(
+        {
+            "commit": _commit(),
+            "python": platform.python_version(),
+            "book": book_options,
+            "scenarios": results,
+        },
+        output,
+        indent=2,
+    )
+    output.write("\n")
+
+
+@cli.command()
+@click.argument("baseline", type=click.File())
+@click.argument("current", type=click.File())
+@click.option("--metric", default="p50_ms", help="Measurement to compare")
+@click.option("--threshold", default=1.2, help="Ratio considered a regression")
+def compare(baseline, current, metric, threshold):
+    """Compare two results of `run`, fail if any scenario regressed."""
+    baseline, current = json.load(baseline), json.load(current)
+    regressed = False
+
+    click.echo(f"{'scenario':<26} {'baseline':>10} {'current':>10} {'ratio':>6}")
+    for name, result in current["scenarios"].items():
+        if name not in baseline["scenarios"]:
+            continue
+        before, after = baseline["scenarios"][name][metric], result[metric]
+        ratio = after / before if before else 1
+        flag = " !" if ratio > threshold else ""
+        regressed = regressed or bool(flag)
+        click.echo(f"{name:<26} {before:>10} {after:>10} {ratio:>6.2f}{flag}")
+
+    sys.exit(1 if regressed else 0)
+
+
+def _commit():
+    """Get the current git commit, if any."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+if __name__ == "__main__":
+    cli()
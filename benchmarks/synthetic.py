@@ -0,0 +1,217 @@
+"""Generate synthetic GnuCash books for benchmarks.
+
+The book structure (accounts, commodities and prices) is created with piecash.
+Transactions are bulk inserted directly into the tables, so books with millions of
+splits can be generated in reasonable time.
+
+Run from the repository root::
+
+    PYTHONPATH=src python benchmarks/synthetic.py /tmp/large.sqlite --transactions 1000000
+
+"""
+import random
+import uuid
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import click
+import piecash
+from piecash import Account, Commodity, Price
+from sqlalchemy import create_engine
+from sqlalchemy.sql import column, table
+
+# Top level accounts, with their type and the type of their subaccounts
+TOP_LEVEL = {
+    "Assets": ("ASSET", "BANK"),
+    "Liabilities": ("LIABILITY", "CREDIT"),
+    "Income": ("INCOME", "INCOME"),
+    "Expenses": ("EXPENSE", "EXPENSE"),
+}
+
+# Plain tables, so rows are inserted as they are stored by GnuCash
+TRANSACTIONS = table(
+    "transactions",
+    *map(column, ["guid", "currency_guid", "num", "post_date", "enter_date", "description"]),
+)
+SPLITS = table(
+    "splits",
+    *map(
+        column,
+        [
+            "guid",
+            "tx_guid",
+            "account_guid",
+            "memo",
+            "action",
+            "reconcile_state",
+            "reconcile_date",
+            "value_num",
+            "value_denom",
+            "quantity_num",
+            "quantity_denom",
+            "lot_guid",
+        ],
+    ),
+)
+
+
+def generate_book(
+    path,
+    accounts=50,
+    depth=3,
+    transactions=10000,
+    commodities=5,
+    prices=100,
+    seed=1,
+    chunk_size=10000,
+):
+    """Create a synthetic SQLite book, replacing an existing file.
+
+    Accounts are spread over the top level accounts in `TOP_LEVEL`, nested up to
+    `depth` levels. Each stock gets its own account below *Assets:Investments* and a
+    daily series of prices. Transactions move random amounts between two random leaf
+    accounts in the default currency, or buy stock from an asset account. They are
+    spread over the ten years before today.
+
+    :param path: Path of the SQLite file
+    :param accounts: Number of accounts in the default currency
+    :param depth: Maximum nesting level of these accounts
+    :param transactions: Number of transactions (each with two splits)
+    :param commodities: Number of stocks
+    :param prices: Number of prices per stock
+    :param seed: Seed for the random generator, equal seeds generate equal books
+      (except for GUIDs)
+    :param chunk_size: Number of rows inserted at once
+    :returns: Dictionary of book statistics
+
+    """
+    rng = random.Random(seed)
+
+    with piecash.create_book(sqlite_file=path, currency="EUR", overwrite=True) as book:
+        currency = book.default_currency
+
+        parents = {
+            name: Account(name, type, currency, parent=book.root_account, placeholder=True)
+            for name, (type, _) in TOP_LEVEL.items()
+        }
+        leaves = []
+        nodes = [(account, TOP_LEVEL[name][1], 1) for name, account in parents.items()]
+        for i in range(accounts):
+            parent, type, level = rng.choice(nodes)
+            account = Account(f"Account {i}", type, currency, parent=parent)
+            leaves.append(account)
+            if level < depth:
+                nodes.append((account, type, level + 1))
+
+        investments = Account(
+            "Investments", "ASSET", currency, parent=parents["Assets"], placeholder=True
+        )
+        stocks = []
+        for i in range(commodities):
+            stock = Commodity("NASDAQ", f"STK{i}", f"Stock {i}", fraction=1000, book=book)
+            stocks.append(Account(f"Stock {i}", "STOCK", stock, parent=investments))
+
+            value = Decimal(rng.randint(1000, 50000)) / 100
+            for day in range(prices):
+                value = max(Decimal("0.01"), value + Decimal(rng.randint(-100, 100)) / 100)
+                Price(
+                    stock,
+                    currency,
+                    date.today() - timedelta(days=prices - day),
+                    value,
+                    source="user:price",
+                )
+
+        book.save()
+
+        currency_guid = currency.guid
+        leaf_guids = [account.guid for account in leaves]
+        bank_guids = [account.guid for account in leaves if account.type == "BANK"]
+        stock_guids = [account.guid for account in stocks]
+
+    engine = create_engine(f"sqlite:///{path}")
+    start = datetime.combine(date.today() - timedelta(days=3650), datetime.min.time())
+    enter_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    with engine.begin() as connection:
+        for offset in range(0, transactions, chunk_size):
+            transaction_rows, split_rows = [], []
+            for i in range(offset, min(offset + chunk_size, transactions)):
+                guid = uuid.uuid4().hex
+                post_date = start + timedelta(days=i * 3650 // max(transactions, 1))
+                transaction_rows.append(
+                    {
+                        "guid": guid,
+                        "currency_guid": currency_guid,
+                        "num": "",
+                        "post_date": post_date.strftime("%Y-%m-%d 10:59:00"),
+                        "enter_date": enter_date,
+                        "description": f"Transaction {i}",
+                    }
+                )
+
+                # Values in cents, stock quantities in thousandths
+                value = rng.randint(1, 100000)
+                if stock_guids and bank_guids and rng.random() < 0.05:
+                    account, contra = rng.choice(stock_guids), rng.choice(bank_guids)
+                    quantity = (rng.randint(1, 10000), 1000)
+                else:
+                    account, contra = rng.sample(leaf_guids, 2)
+                    quantity = (value, 100)
+                split_rows.append(_split(guid, account, value, quantity))
+                split_rows.append(_split(guid, contra, -value, (-value, 100)))
+
+            connection.execute(TRANSACTIONS.insert(), transaction_rows)
+            connection.execute(SPLITS.insert(), split_rows)
+
+    return {
+        "accounts": accounts + commodities,
+        "transactions": transactions,
+        "splits": 2 * transactions,
+        "commodities": commodities,
+        "prices": commodities * prices,
+    }
+
+
+def _split(transaction_guid, account_guid, value, quantity):
+    """Build row of the splits table.
+
+    :param transaction_guid: GUID of the transaction
+    :param account_guid: GUID of the account
+    :param value: Value in cents
+    :param quantity: Tuple of numerator and denominator of the quantity
+    :returns: Dictionary of column values
+
+    """
+    return {
+        "guid": uuid.uuid4().hex,
+        "tx_guid": transaction_guid,
+        "account_guid": account_guid,
+        "memo": "",
+        "action": "",
+        "reconcile_state": "n",
+        "reconcile_date": None,
+        "value_num": value,
+        "value_denom": 100,
+        "quantity_num": quantity[0],
+        "quantity_denom": quantity[1],
+        "lot_guid": None,
+    }
+
+
+@click.command()
+@click.argument("path")
+@click.option("--accounts", default=50, help="Number of accounts")
+@click.option("--depth", default=3, help="Maximum depth of the account tree")
+@click.option("--transactions", default=10000, help="Number of transactions")
+@click.option("--commodities", default=5, help="Number of stocks")
+@click.option("--prices", default=100, help="Number of prices per stock")
+@click.option("--seed", default=1, help="Seed for the random generator")
+def main(path, **kwargs):
+    """Generate a synthetic book at PATH."""
+    stats = generate_book(path, **kwargs)
+    print(", ".join(f"{value} {name}" for name, value in stats.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,8 +6,11 @@ from flask import Flask, redirect, url_for
 from flask.cli import FlaskGroup
 import click
 
-from . import auth, book, commodities
+from . import api, auth, book, commodities, instrumentation, reports
 from .utils import jinja as jinja_utils
+from .utils.changes import feed as change_feed
+from .utils.pool import engines
+from .utils.replicas import replicas
 from .config import GnuCashWebConfig
 
 from encrypted_session import EncryptedSessionInterface
@@ -39,12 +42,25 @@ def create_app(test_config=None):
         # load the test config if passed in
         app.config.from_mapping(test_config)
 
+    engines.configure(app.config.DB_POOL_SIZE, app.config.DB_POOL_IDLE_TIMEOUT)
+    replicas.configure(app.config.DB_REPLICA_RETRY, app.config.DB_REPLICA_LAG)
+
     # ensure the instance folder exists
     try:
         os.makedirs(app.instance_path)
     except OSError:
         pass
 
+    # All processes of this installation share the instance folder
+    change_feed_file = app.config.CHANGE_FEED_FILE
+    if change_feed_file is None and os.access(app.instance_path, os.W_OK):
+        change_feed_file = os.path.join(app.instance_path, 'changes')
+    change_feed.configure(
+        change_feed_file,
+        app.config.CHANGE_POLL_INTERVAL,
+        app.config.CHANGE_CHECKSUM_INTERVAL,
+    )
+
     app.jinja_env.autoescape = True
     app.jinja_env.filters['display'] = jinja_utils.safe_display_string
     app.jinja_env.filters['cssescape'] = jinja_utils.css_escape
@@ -52,7 +68,7 @@ def create_app(test_config=None):
     app.jinja_env.filters['money'] = jinja_utils.money
     app.jinja_env.filters['accounturl'] = jinja_utils.account_url
     app.jinja_env.filters['full_account_names'] = jinja_utils.full_account_names
-    app.jinja_env.filters['contrasplits'] = jinja_utils.contra_splits
+    app.jinja_env.filters['contraaccounts'] = jinja_utils.contra_accounts
     app.jinja_env.filters['nth'] = jinja_utils.nth
     app.jinja_env.globals['is_authenticated'] = auth.is_authenticated
 
@@ -62,6 +78,10 @@ def create_app(test_config=None):
     app.register_blueprint(auth.bp)
     app.register_blueprint(book.bp)
     app.register_blueprint(commodities.bp)
+    app.register_blueprint(api.bp)
+    app.register_blueprint(reports.bp)
+
+    instrumentation.init_app(app)
 
     @app.route('/')
     def index():
@@ -0,0 +1,203 @@
+"""JSON API for reading accounts and ledgers."""
+import json
+
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from flask import current_app as app
+from piecash import Commodity, Split
+from werkzeug.exceptions import BadRequest, HTTPException
+
+from .auth import requires_auth, get_db_credentials
+from .utils.accounts import account_index, account_name_from_path
+from .utils.balance import account_balances
+from .utils.gnucash import AccountNotFound, open_book, get_account
+from .utils.ledger import ledger_splits
+
+bp = Blueprint("api", __name__, url_prefix="/api")
+
+# Maximum number of splits returned at once by `list_splits`
+MAX_LIMIT = 1000
+
+# Number of splits loaded at once by `export_splits`
+EXPORT_BATCH_SIZE = 500
+
+
+@bp.errorhandler(AccountNotFound)
+@bp.errorhandler(HTTPException)
+def handle_http_exception(e: HTTPException):
+    """Report errors as JSON instead of the HTML error pages of the app.
+
+    :param e: The underlying HTTPException
+    :returns: JSON object with `error`, the description of the error
+
+    """
+    if isinstance(e, AccountNotFound):
+        description = f"Account {e.account_name} not found"
+    else:
+        description = e.description
+    return jsonify({"error": description}), e.code
+
+
+def split_to_json(split, index):
+    """Convert split to JSON-serialisable dictionary.
+
+    :param split: The split, with its transaction and the transactions splits loaded
+    :param index: Account index of the book
+    :returns: Dictionary
+
+    """
+    transaction = split.transaction
+    return {
+        "guid": split.guid,
+        "transaction_guid": transaction.guid,
+        "post_date": transaction.post_date.isoformat(),
+        "num": transaction.num,
+        "description": transaction.description,
+        "currency": transaction.currency.mnemonic,
+        "value": str(split.value),
+        "quantity": str(split.quantity),
+        "memo": split.memo,
+        "splits": [
+            {
+                "guid": other_split.guid,
+                "account": index[other_split.account_guid].fullname,
+                "value": str(other_split.value),
+                "quantity": str(other_split.quantity),
+                "memo": other_split.memo,
+            }
+            for other_split in transaction.splits
+        ],
+    }
+
+
+@bp.route("/accounts")
+@requires_auth
+def list_accounts():
+    """List all accounts, including their balance.
+
+    :returns: JSON list of accounts
+
+    """
+    with open_book(
+        uri_conn=app.config.DB_URI(*get_db_credentials()),
+        open_if_lock=True,
+        readonly=True,
+    ) as book:
+        index = account_index(book)
+        balances = account_balances(book.root_account)
+        mnemonics = dict(book.session.query(Commodity.guid, Commodity.mnemonic))
+
+        return jsonify(
+            [
+                {
+                    "guid": entry.guid,
+                    "name": entry.name,
+                    "fullname": entry.fullname,
+                    "parent_guid": entry.parent_guid,
+                    "type": entry.type,
+                    "commodity": mnemonics.get(entry.commodity_guid),
+                    "placeholder": entry.placeholder,
+                    "balance": str(balances[entry.guid]),
+                }
+                for entry in index.subtree(book.root_account.guid)
+                if entry.parent_guid is not None
+            ]
+        )
+
+
+@bp.route("/accounts/<path:account_name>/splits")
+@requires_auth
+def list_splits(account_name):
+    """List splits in the ledger of an account, newest first.
+
+    Uses cursor-based pagination: The response contains a `next_cursor`, which is
+    passed as `cursor` query parameter to get the next page.
+
+    :param account_name: Name of the account, with / as account name separator. Each
+      componnent of the account name must be urlencoded.
+    :param cursor: Cursor returned by the previous page, read from `request.args`
+    :param limit: Maximum number of splits, read from `request.args`
+    :returns: JSON object with `splits` and `next_cursor`, which is `null` on the last
+      page
+    :raises BadRequest: If the cursor is not a split in the account
+
+    """
+    cursor = request.args.get("cursor")
+    try:
+        account_name = account_name_from_path(account_name)
+        limit = int(request.args.get("limit", app.config.TRANSACTION_PAGE_LENGTH))
+    except ValueError as e:
+        raise BadRequest(f"Invalid query parameter: {e}") from e
+
+    if not 0 < limit <= MAX_LIMIT:
+        raise BadRequest(f"Invalid query parameter: limit must be in 1..{MAX_LIMIT}")
+
+    with open_book(
+        uri_conn=app.config.DB_URI(*get_db_credentials()),
+        open_if_lock=True,
+        readonly=True,
+    ) as book:
+        account = get_account(book, fullname=account_name)
+        index = account_index(book)
+
+        # The keyset query would silently return nothing for an unknown split
+        if cursor is not None and not (
+            book.session.query(Split.guid)
+            .filter(Split.guid == cursor, Split.account_guid == account.guid)
+            .first()
+        ):
+            raise BadRequest(f"Invalid query parameter: unknown cursor {cursor}")
+
+        splits = ledger_splits(account, after=cursor, limit=limit)
+
+        return jsonify(
+            {
+                "splits": [split_to_json(split, index) for split in splits],
+                "next_cursor": splits[-1].guid if len(splits) == limit else None,
+            }
+        )
+
+
+@bp.route("/accounts/<path:account_name>/splits.ndjson")
+@requires_auth
+def export_splits(account_name):
+    """Export all splits in the ledger of an account as newline-delimited JSON.
+
+    The response is streamed, and splits are loaded in batches and discarded after
+    being sent, so memory usage does not depend on the size of the ledger.
+
+    :param account_name: Name of the account, with / as account name separator. Each
+      componnent of the account name must be urlencoded.
+    :returns: Streamed HTTP response, one JSON object (see `list_splits`) per line
+
+    """
+    uri = app.config.DB_URI(*get_db_credentials())
+    try:
+        account_name = account_name_from_path(account_name)
+    except ValueError as e:
+        raise BadRequest(f"Invalid account name: {e}") from e
+
+    # Fail before starting the response if the account does not exist
+    with open_book(uri_conn=uri, open_if_lock=True, readonly=True) as book:
+        get_account(book, fullname=account_name)
+
+    @stream_with_context
+    def generate():
+        with open_book(uri_conn=uri, open_if_lock=True, readonly=True) as book:
+            account = get_account(book, fullname=account_name)
+            index = account_index(book)
+
+            cursor = None
+            while True:
+                splits = ledger_splits(account, after=cursor, limit=EXPORT_BATCH_SIZE)
+                for split in splits:
+                    yield json.dumps(split_to_json(split, index)) + "\n"
+
+                if len(splits) < EXPORT_BATCH_SIZE:
+                    break
+                cursor = splits[-1].guid
+
+                # Transactions cascade to their splits
+                for transaction in {split.transaction for split in splits}:
+                    book.session.expunge(transaction)
+
+    return Response(generate(), mimetype="application/x-ndjson")
@@ -0,0 +1,240 @@
+"""ASGI Entry point for Flask app.
+
+Serves the same app as `.wsgi`, but from an event loop: Connections are handled
+asynchronously, and each request is run in a bounded pool of threads. A slow ledger
+query then only occupies one of these threads, while any number of further clients
+can connect and wait for their turn, so many concurrent clients can be served by a
+single process, e.g.::
+
+    uvicorn gnucash_web.asgi:app
+
+Read requests (GET, HEAD and OPTIONS, i.e. all account views, the JSON API and search)
+are run in a pool of `ASGI_THREADS` threads (by default `DB_POOL_SIZE`). Everything
+else (e.g. adding transactions, logging in) is run in a separate small pool, so writes
+are not queued behind long reads.
+
+Request bodies are limited to `MAX_CONTENT_LENGTH` bytes (by default
+`MAX_BODY_SIZE`), since they are received completely before the app is called.
+"""
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from . import create_app
+
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# Writes to a database are serialised anyway, see `.utils.writes.writable_book`
+WRITE_THREADS = 2
+
+# Maximum size of request bodies in bytes, unless `MAX_CONTENT_LENGTH` is configured
+MAX_BODY_SIZE = 16 * 1024 * 1024
+
+
+class WsgiToAsgi:
+    """ASGI application running a WSGI application in thread pools."""
+
+    def __init__(
+        self,
+        wsgi_app,
+        read_threads,
+        write_threads=WRITE_THREADS,
+        max_body_size=MAX_BODY_SIZE,
+    ):
+        """Create ASGI application.
+
+        :param wsgi_app: The WSGI application
+        :param read_threads: Number of threads serving read requests
+        :param write_threads: Number of threads serving all other requests
+        :param max_body_size: Maximum size of request bodies in bytes, larger requests
+          are answered with 413 Payload Too Large
+        :returns: New ASGI application
+
+        """
+        self.wsgi_app = wsgi_app
+        self.max_body_size = max_body_size
+        self.readers = ThreadPoolExecutor(read_threads, thread_name_prefix="asgi-read")
+        self.writers = ThreadPoolExecutor(
+            write_threads, thread_name_prefix="asgi-write"
+        )
+
+    async def __call__(self, scope, receive, send):
+        """Handle an ASGI connection."""
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.http(scope, receive, send)
+        elif scope["type"] == "websocket":
+            # Not supported, reject the connection
+            message = await receive()
+            if message["type"] == "websocket.connect":
+                await send({"type": "websocket.close"})
+
+    async def lifespan(self, receive, send):
+        """Handle startup and shutdown of the server."""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                shutdown(self.readers)
+                shutdown(self.writers)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def http(self, scope, receive, send):
+        """Handle an HTTP request.
+
+        The request body is received completely before the WSGI application is called,
+        up to `max_body_size` bytes. The WSGI application and the iteration over its
+        response both run in a single thread of a pool, since streamed responses (such
+        as the split export) keep a database session open while being iterated. Each
+        chunk of the response is sent before the next one is produced.
+
+        """
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit():
+                if int(value) > self.max_body_size:
+                    return await self.too_large(send)
+
+        body = bytearray()
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            if len(body) > self.max_body_size:
+                return await self.too_large(send)
+            more_body = message.get("more_body", False)
+
+        loop = asyncio.get_running_loop()
+        executor = self.readers if scope["method"] in READ_METHODS else self.writers
+        await loop.run_in_executor(
+            executor, self.run_wsgi, loop, environ(scope, bytes(body)), send
+        )
+
+    async def too_large(self, send):
+        """Answer a request whose body exceeds `max_body_size`."""
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 413,
+                "headers": [(b"content-type", b"text/plain; charset=utf-8")],
+            }
+        )
+        await send({"type": "http.response.body", "body": b"Payload Too Large"})
+
+    def run_wsgi(self, loop, environ, send):
+        """Call WSGI application and send its response, from a worker thread.
+
+        :param loop: Event loop of the connection
+        :param environ: WSGI environment
+        :param send: ASGI send function, called in `loop`
+
+        """
+
+        def call(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get("started"):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response["start"] = {
+                "type": "http.response.start",
+                "status": int(status.split(" ", 1)[0]),
+                "headers": [
+                    (name.lower().encode("latin-1"), value.encode("latin-1"))
+                    for name, value in headers
+                ],
+            }
+
+        def start():
+            if not response.get("started"):
+                call(response["start"])
+                response["started"] = True
+
+        iterable = self.wsgi_app(environ, start_response)
+        try:
+            for chunk in iterable:
+                if chunk:
+                    start()
+                    call(
+                        {"type": "http.response.body", "body": chunk, "more_body": True}
+                    )
+            start()
+            call({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+
+
+def shutdown(executor):
+    """Stop a thread pool without waiting for it, dropping requests not started yet.
+
+    Pending requests can only be cancelled on Python 3.9 and later, before that they
+    are still run.
+
+    :param executor: Thread pool
+
+    """
+    if sys.version_info >= (3, 9):
+        executor.shutdown(wait=False, cancel_futures=True)
+    else:
+        executor.shutdown(wait=False)
+
+
+def environ(scope, body):
+    """Build WSGI environment of an ASGI HTTP request.
+
+    :param scope: ASGI connection scope
+    :param body: Complete request body
+    :returns: WSGI environment
+
+    """
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_LENGTH":
+            # The body was received completely, its actual length is set below
+            continue
+        key = name if name == "CONTENT_TYPE" else f"HTTP_{name}"
+        if key in environ:
+            separator = "; " if key == "HTTP_COOKIE" else ","
+            value = f"{environ[key]}{separator}{value}"
+        environ[key] = value
+
+    environ["CONTENT_LENGTH"] = str(len(body))
+    return environ
+
+
+flask_app = create_app()
+app = WsgiToAsgi(
+    flask_app,
+    flask_app.config.ASGI_THREADS or flask_app.config.DB_POOL_SIZE,
+    max_body_size=flask_app.config.get("MAX_CONTENT_LENGTH") or MAX_BODY_SIZE,
+)
@@ -1,13 +1,25 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
 from functools import wraps
 
 from flask import Blueprint, render_template, url_for, request, redirect, session
 from flask import current_app as app
 from sqlalchemy.exc import OperationalError
 
-from .utils.gnucash import open_book, AccessDenied
+from .utils.gnucash import check_access, AccessDenied
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
+# Successfully verified credentials, mapped to the time until which they are trusted
+# without asking the database again. Credentials are only stored as keyed hash, with
+# a key that never leaves the process.
+_verified = {}
+_verified_lock = threading.Lock()
+_verified_key = os.urandom(32)
+
 @bp.app_errorhandler(AccessDenied)
 def handle_account_not_found(e: AccessDenied):
     end_session()
@@ -22,19 +34,69 @@ def get_db_credentials():
     else:
         raise NotImplementedError('Only passthrough auth is currently supported')
 
+
+def get_db_replica_uris():
+    """Get URIs of the read-only replicas to be used in the current request.
+
+    Replicas may lag behind the primary database, so they are not used for
+    `DB_REPLICA_LAG` seconds after the user changed the book (see `pin_primary`). This
+    way, users always see their own changes.
+
+    :returns: List of database URIs, see `GnuCashWebConfig.DB_REPLICA_URIS`
+
+    """
+    if session.get('primary_until', 0) > time.time():
+        return []
+    return app.config.DB_REPLICA_URIS(*get_db_credentials())
+
+
+def pin_primary():
+    """Read from the primary database for a while, see `get_db_replica_uris`."""
+    if app.config.DB_REPLICA_HOSTS:
+        session['primary_until'] = time.time() + app.config.DB_REPLICA_LAG
+
+
+def verify_credentials(username, password):
+    """Check whether the database accepts the credentials.
+
+    Successful checks are cached for `AUTH_CACHE_TTL` seconds, failed ones are not.
+
+    :param username: Database user name
+    :param password: Database password
+    :returns: `True` if the credentials are valid
+
+    """
+    uri = app.config.DB_URI(username, password)
+    key = hmac.new(_verified_key, uri.encode(), hashlib.sha256).digest()
+    now = time.monotonic()
+
+    with _verified_lock:
+        if _verified.get(key, 0) > now:
+            return True
+
+    try:
+        # Check authn by attempting to connect to database
+        check_access(uri)
+    except AccessDenied:
+        return False
+
+    with _verified_lock:
+        for expired in [k for k, until in _verified.items() if until <= now]:
+            del _verified[expired]
+        _verified[key] = now + app.config.AUTH_CACHE_TTL
+
+    return True
+
 def authenticate(username, password):
     if not app.config.AUTH_MECHANISM:
         return True
     elif app.config.AUTH_MECHANISM == 'passthrough':
-        try:
-            # Check authn by attempting to connect to database
-            with open_book(uri_conn=app.config.DB_URI(username, password),
-                           readonly=True, open_if_lock=True) as book:
-                app.logger.debug(f'Authentication succeeded for {username}')
-                session['username'] = username
-                session['password'] = password
-                return True
-        except AccessDenied:
+        if verify_credentials(username, password):
+            app.logger.debug(f'Authentication succeeded for {username}')
+            session['username'] = username
+            session['password'] = password
+            return True
+        else:
             app.logger.debug(f'Authentication failed for {username}')
             return False
     else:
@@ -1,20 +1,47 @@
 """Functions for interacting with a GnuCash book."""
+import hashlib
 from datetime import date
 from decimal import Decimal, InvalidOperation
-from urllib.parse import unquote_plus, urlencode
+from urllib.parse import urlencode
 from math import ceil
 
-from flask import render_template, request, redirect, Blueprint
+from flask import render_template, request, redirect, Blueprint, jsonify, make_response
 from flask import current_app as app
-from piecash import Transaction, Split
+import click
+from piecash import Commodity, Transaction, Split
+from sqlalchemy.orm import selectinload
 from werkzeug.exceptions import BadRequest
 
-from .auth import requires_auth, get_db_credentials
+from .auth import requires_auth, get_db_credentials, get_db_replica_uris, pin_primary
 from .utils.gnucash import open_book, get_account, AccountNotFound, DatabaseLocked
-from .utils.jinja import account_url
+from .utils.accounts import account_index, account_name_from_path, contra_account_choices
+from .utils.balance import account_balances, account_values, net_worth
+from .utils.cache import book_version, cached_page, last_modified
+from .utils.importer import MalformedImport, import_transactions, read_bytes, read_rows
+from .utils.jinja import account_url, safe_display_string
+from .utils.ledger import (
+    count_splits,
+    ledger_order,
+    ledger_page,
+    ledger_rows,
+    running_balances,
+)
+from .utils.search import (
+    create_search_index,
+    drop_search_index,
+    filter_args,
+    filter_transactions,
+    has_search_index,
+    parse_filter,
+    update_search_index,
+)
+from .utils import writes
 
 bp = Blueprint("book", __name__, url_prefix="/book")
 
+# Maximum number of transactions shown by `search`
+SEARCH_RESULT_LIMIT = 200
+
 
 @bp.app_errorhandler(AccountNotFound)
 def handle_account_not_found(e: AccountNotFound):
@@ -50,6 +77,19 @@ def handle_database_locked(e: DatabaseLocked):
     return body, e.code
 
 
+@bp.after_request
+def pin_primary_after_write(response):
+    """Let the user see their own changes, even if read replicas lag behind.
+
+    :param response: HTTP Response of a request to this blueprint
+    :returns: The response
+
+    """
+    if request.method == "POST" and response.status_code < 400:
+        pin_primary()
+    return response
+
+
 @bp.route("/accounts/<path:account_name>")
 @bp.route("/accounts/", defaults={"account_name": ""})
 @requires_auth
@@ -60,7 +100,12 @@ def show_account(account_name):
 
     Additionally, if the account is not a placeholder, a ledger listing all
     transaction in the account is rendered, including a HTML form to add a new
-    transaction.
+    transaction. The ledger can be filtered using the query parameters described in
+    `utils.search.SEARCH_ARGS`, where `account` is the contra account.
+
+    The response carries an ETag derived from the version of the book, so that
+    conditional requests are answered with 304 without rendering anything. Rendered
+    pages are additionally cached on the server if `PAGE_CACHE_SIZE` is set.
 
     :param account_name: Name of the account, with / as account name separator. Each
       componnent of the account name must be urlencoded.
@@ -68,16 +113,113 @@ def show_account(account_name):
 
     """
     try:
-        account_name = ":".join(unquote_plus(name) for name in account_name.split("/"))
+        account_name = account_name_from_path(account_name)
         page = int(request.args.get('page', 1))
+        search = parse_filter(request.args)
     except ValueError as e:
         raise BadRequest(f'Invalid query parameter: {e}') from e
 
     if page < 1:
         raise BadRequest(f'Invalid query parameter: page number must be positive integer: {page}')
 
+    username, password = get_db_credentials()
+    with open_book(
+        uri_conn=app.config.DB_URI(username, password),
+        replica_uris=get_db_replica_uris(),
+        open_if_lock=True,
+        readonly=True,
+    ) as book:
+        # Everything the rendered page depends on
+        key = (username, account_name, page, search, date.today())
+
+        etag = hashlib.sha1(
+            repr((app.jinja_env.globals['pkg_version'], key, book_version(book))).encode()
+        ).hexdigest()
+        if etag in request.if_none_match:
+            response = make_response('', 304)
+        else:
+            response = make_response(
+                cached_page(
+                    book,
+                    key,
+                    lambda: _render_account(book, account_name, page, search),
+                    app.config.PAGE_CACHE_SIZE,
+                )
+            )
+
+        # Browsers may store the page, but have to revalidate it every time
+        response.set_etag(etag)
+        response.last_modified = last_modified(book)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+
+
+def _render_account(book, account_name, page, search):
+    """Render the account page, see `show_account`.
+
+    :param book: The book containing the account
+    :param account_name: Full name of the account, empty for the root account
+    :param page: Page number of the ledger
+    :param search: `utils.search.SearchFilter` for the ledger
+    :returns: Rendered page
+
+    """
+    account = (
+        get_account(book, fullname=account_name)
+        if account_name
+        else book.root_account
+    )
+
+    page_length = app.config.TRANSACTION_PAGE_LENGTH
+    num_pages = max(1, ceil(count_splits(account, search) / page_length))
+    if page > num_pages:
+        raise BadRequest(f'Invalid query parameter: not enough pages: {page} > {num_pages}')
+
+    splits = ledger_page(account, page, page_length, search)
+
+    return render_template(
+        "account.j2",
+        account=account,
+        book=book,
+        today=date.today(),
+        net_worth=net_worth(book) if account.parent is None else None,
+        **_subaccounts_context(book, account),
+        # Running balances are meaningless if only some transactions are shown
+        rows=ledger_rows(
+            account,
+            splits,
+            None if any(search) else running_balances(account, page, page_length, splits),
+        ),
+        search=search,
+        search_args=filter_args(search),
+        num_pages=num_pages,
+        page=page,
+    )
+
+
+@bp.route("/subaccounts/<path:account_name>")
+@bp.route("/subaccounts/", defaults={"account_name": ""})
+@requires_auth
+def show_subaccounts(account_name):
+    """Render the direct subaccounts of an account as HTML fragment.
+
+    Account pages only render the first level of their subaccount tree, deeper levels
+    are loaded from here when expanded. Fragment URLs contain the version of the book
+    (query parameter `v`), so browsers may keep fragments of the current version.
+
+    :param account_name: Name of the account, as for `show_account`
+    :returns: Rendered HTTP Response
+
+    """
+    try:
+        account_name = account_name_from_path(account_name)
+    except ValueError as e:
+        raise BadRequest(f'Invalid query parameter: {e}') from e
+
     with open_book(
         uri_conn=app.config.DB_URI(*get_db_credentials()),
+        replica_uris=get_db_replica_uris(),
         open_if_lock=True,
         readonly=True,
     ) as book:
@@ -86,18 +228,120 @@ def show_account(account_name):
             if account_name
             else book.root_account
         )
+        context = _subaccounts_context(book, account)
+
+        if context['tree_version'] in request.if_none_match:
+            response = make_response('', 304)
+        else:
+            response = make_response(
+                render_template('subaccounts.j2', account=account, **context)
+            )
+
+        response.set_etag(context['tree_version'])
+        response.cache_control.private = True
+        if request.args.get('v') == context['tree_version']:
+            response.cache_control.max_age = 3600
+        else:
+            response.cache_control.no_cache = True
+        return response
+
+
+def _subaccounts_context(book, account):
+    """Get template variables for rendering the subaccounts of an account.
+
+    :param book: The book containing the account
+    :param account: GnuCash account
+    :returns: Dictionary of template variables, see *subaccounts.j2*
 
-        num_pages = max(1, ceil(len(account.splits) / app.config.TRANSACTION_PAGE_LENGTH))
-        if page > num_pages:
-            raise BadRequest(f'Invalid query parameter: not enough pages: {page} > {num_pages}')
+    """
+    index = account_index(book)
+    version = (
+        app.jinja_env.globals['pkg_version'],
+        get_db_credentials()[0],
+        book_version(book),
+    )
+    return {
+        'children': index.children[account.guid],
+        'index': index,
+        'balances': account_balances(account),
+        'values': account_values(account),
+        'commodities': {
+            commodity.guid: commodity for commodity in book.session.query(Commodity)
+        },
+        'currency': book.default_currency,
+        'tree_version': hashlib.sha1(repr(version).encode()).hexdigest()[:16],
+    }
+
+
+@bp.route("/search")
+@requires_auth
+def search():
+    """Search transactions in all accounts.
+
+    Transactions are filtered using the query parameters described in
+    `utils.search.SEARCH_ARGS`. Only the newest `SEARCH_RESULT_LIMIT` matches are shown.
+
+    :returns: Rendered HTTP Response
+
+    """
+    try:
+        search = parse_filter(request.args)
+    except ValueError as e:
+        raise BadRequest(f'Invalid query parameter: {e}') from e
+
+    with open_book(
+        uri_conn=app.config.DB_URI(*get_db_credentials()),
+        replica_uris=get_db_replica_uris(),
+        open_if_lock=True,
+        readonly=True,
+    ) as book:
+        transactions = []
+        if any(search):
+            transactions = (
+                filter_transactions(
+                    book.session.query(Transaction), search, account_index(book)
+                )
+                .options(selectinload(Transaction.splits).joinedload(Split.account))
+                .order_by(*ledger_order()[:3], Transaction.guid.desc())
+                .limit(SEARCH_RESULT_LIMIT + 1)
+                .all()
+            )
 
         return render_template(
-            "account.j2",
-            account=account,
-            book=book,
-            today=date.today(),
-            num_pages=num_pages,
-            page=page,
+            "search.j2",
+            search=search,
+            searched=any(search),
+            transactions=transactions[:SEARCH_RESULT_LIMIT],
+            more=len(transactions) > SEARCH_RESULT_LIMIT,
+        )
+
+
+@bp.route("/contra_accounts")
+@requires_auth
+def contra_accounts():
+    """List accounts that can be selected as contra account for the given account.
+
+    Used to lazily populate the contra account selection of transaction forms.
+
+    :param account_name: Full name of the account, read from `request.args`
+    :returns: JSON list of objects with `value` (full account name) and `text` (display
+      name)
+
+    """
+    account_name = request.args.get("account_name", "")
+
+    with open_book(
+        uri_conn=app.config.DB_URI(*get_db_credentials()),
+        open_if_lock=True,
+        readonly=True,
+    ) as book:
+        account = get_account(book, fullname=account_name)
+
+        return jsonify(
+            [
+                {"value": entry.fullname, "text": safe_display_string(entry.fullname)}
+                for entry in contra_account_choices(account)
+            ]
         )
 
 
@@ -132,49 +376,26 @@ def add_transaction():
         # TODO: Say which parameter the error is about
         raise BadRequest(f"Invalid form parameter: {e}") from e
 
-    with open_book(
-        uri_conn=app.config.DB_URI(*get_db_credentials()),
-        readonly=False,
-        do_backup=False,
+    if value < 0:
+        raise BadRequest(f"Value {value} must not be negative")
+
+    with writes.writable_book(
+        app.config.DB_URI(*get_db_credentials()),
+        timeout=app.config.WRITE_LOCK_TIMEOUT,
     ) as book:
         account = get_account(book, fullname=account_name)
-        contra_account = get_account(book, fullname=contra_account_name)
-
-        if account.placeholder:
-            raise BadRequest(f"{account.fullname} is a placeholder")
-
-        if contra_account.placeholder:
-            raise BadRequest(f"{contra_account.fullname} is a placeholder")
-
-        if value < 0:
-            raise BadRequest(f"Value {value} must not be negative")
-        value = sign*value
-
-        # TODO: Support accounts with different currencies
-        assert account.commodity == contra_account.commodity, (
-            f"Incompatible accounts: {account.commodity} != {contra_account.commodity}."
-            "Transaction form in account.j2 should not have allowed this."
+        # Before writing, since writes invalidate the cached account index
+        url = account_url(account)
+        writes.add_transaction(
+            book,
+            account,
+            get_account(book, fullname=contra_account_name),
+            description,
+            transaction_date,
+            sign * value,
         )
 
-        common_currency = account.commodity
-
-        # This can not fail, since currency is a valid commodity, description can be
-        # any string, post_date is a valid datetime.date, account and contra_account
-        # are valid non-placeholder accounts and value is a Decimal. Any other error
-        # should be considered a bug.
-        _ = Transaction(
-            currency=common_currency,
-            description=description,
-            post_date=transaction_date,
-            splits=[
-                Split(account=account, value=value),
-                Split(account=contra_account, value=-value),
-            ],
-        )
-
-        book.save()
-
-        return redirect(account_url(account))
+        return redirect(url)
 
 
 @bp.route("/edit_transaction", methods=["POST"])
@@ -193,6 +414,8 @@ def edit_transaction():
     :param value: The amount to be transferred
     :param contra_account_name: Name of the contra account
     :param sign: The transactions sign: `+1` for deposit, `-1` for withdrawl
+    :param version: Version of the transaction when the form was loaded, see
+      `utils.writes.transaction_version`
     """
     # TODO DRY: This function is very similar to add_transaction
     try:
@@ -203,48 +426,33 @@ def edit_transaction():
         value = Decimal(request.form["value"])
         contra_account_name = request.form["contra_account_name"]
         sign = int(request.form["sign"])
+        version = request.form["version"]
     except (InvalidOperation, ValueError) as e:
         # TODO: Say which parameter the error is about
         raise BadRequest(f"Invalid form parameter: {e}") from e
 
-    with open_book(
-        uri_conn=app.config.DB_URI(*get_db_credentials()),
-        readonly=False,
-        do_backup=False,
+    if value < 0:
+        raise BadRequest(f"Value {value} must not be negative")
+
+    with writes.writable_book(
+        app.config.DB_URI(*get_db_credentials()),
+        timeout=app.config.WRITE_LOCK_TIMEOUT,
     ) as book:
         account = get_account(book, fullname=account_name)
-        contra_account = get_account(book, fullname=contra_account_name)
-        transaction = book.transactions.get(guid=guid)
-
-        if account.placeholder:
-            raise BadRequest(f"{account.fullname} is a placeholder")
-
-        if contra_account.placeholder:
-            raise BadRequest(f"{contra_account.fullname} is a placeholder")
-
-        if len(transaction.splits) > 2:
-            raise BadRequest(f"Can not edit transactions with more than 2 splits.")
-
-        if value < 0:
-            raise BadRequest(f"Value {value} must not be negative")
-        value = sign*value
-
-        # TODO: Support accounts with different currencies
-        assert account.commodity == contra_account.commodity, (
-            f"Incompatible accounts: {account.commodity} != {contra_account.commodity}."
-            "Transaction form in account.j2 should not have allowed this."
+        # Before writing, since writes invalidate the cached account index
+        url = account_url(account)
+        writes.edit_transaction(
+            book,
+            guid,
+            account,
+            get_account(book, fullname=contra_account_name),
+            description,
+            transaction_date,
+            sign * value,
+            version,
         )
 
-        transaction.description = description
-        transaction.post_date = transaction_date
-        transaction.splits = [
-            Split(account=account, value=value),
-            Split(account=contra_account, value=-value),
-        ]
-
-        book.save()
-
-        return redirect(account_url(account))
+        return redirect(url)
 
 
 @bp.route("/del_transaction", methods=["POST"])
@@ -256,23 +464,147 @@ def del_transaction():
 
     :param guid: GUID of the transaction to be deleted
     :param account_name: The Account from which the deletion was initiated
+    :param version: Version of the transaction when the form was loaded, see
+      `utils.writes.transaction_version`
     """
     try:
         guid = request.form["guid"]
         account_name = request.form["account_name"]
+        version = request.form["version"]
     except (InvalidOperation, ValueError) as e:
         raise BadRequest(f"Invalid form parameter: {e}") from e
 
+    with writes.writable_book(
+        app.config.DB_URI(*get_db_credentials()),
+        timeout=app.config.WRITE_LOCK_TIMEOUT,
+    ) as book:
+        url = account_url(get_account(book, fullname=account_name))
+        writes.delete_transaction(book, guid, version)
+
+        return redirect(url)
+
+
+@bp.route("/import_transactions", methods=["POST"])
+@requires_auth
+def import_transactions_view():
+    """Import many transactions at once.
+
+    The transactions are read from the uploaded file `file` or, if there is none, from
+    the request body. See `utils.importer.FIELDS` for the expected columns. Either all
+    transactions are imported, committing them at once, or none of them, if any is
+    invalid.
+
+    :param format: `'csv'` or `'json'`, read from `request.args`. Defaults to `'json'`
+      if the request body is JSON, else to `'csv'`.
+    :returns: JSON list of results for each transaction, with HTTP status 400 if any
+      transaction is invalid
+
+    """
+    upload = request.files.get("file")
+    data = upload.read() if upload else request.get_data()
+    format = request.args.get("format", "json" if request.is_json else "csv")
+
+    try:
+        rows = read_bytes(data, format)
+    except MalformedImport as e:
+        raise BadRequest(str(e)) from e
+
+    with writes.writable_book(
+        app.config.DB_URI(*get_db_credentials()),
+        timeout=app.config.WRITE_LOCK_TIMEOUT,
+    ) as book:
+        results = import_transactions(book, rows, app.config.IMPORT_BATCH_SIZE)
+        ok = all(result.ok for result in results)
+
+        if ok:
+            book.save()
+
+        return jsonify([result._asdict() for result in results]), 200 if ok else 400
+
+
+@bp.cli.command("import")
+@click.argument("file", type=click.File("r", encoding="utf-8-sig"))
+@click.option(
+    "--format", type=click.Choice(["csv", "json"]), default="csv", help="File format"
+)
+@click.pass_context
+def import_transactions_command(ctx, file, format):
+    """Import many transactions from a CSV or JSON file at once.
+
+    Expected columns (or keys) are date, description, value, account, contra_account and
+    optionally num. Either all transactions are imported or none, if any is invalid.
+
+    :param ctx: Click application context
+    :param file: File to import
+    :param format: File format
+
+    """
+    opts = ctx.find_root().params
+
+    try:
+        rows = read_rows(file, format)
+    except MalformedImport as e:
+        raise click.ClickException(str(e)) from e
+
     with open_book(
-        uri_conn=app.config.DB_URI(*get_db_credentials()),
+        uri_conn=app.config.DB_URI(opts.get("username"), opts.get("password")),
         readonly=False,
         do_backup=False,
+        open_if_lock=False,
     ) as book:
-        account = get_account(book, fullname=account_name)
-        transaction = book.transactions.get(guid=guid)
+        results = import_transactions(book, rows, app.config.IMPORT_BATCH_SIZE)
+
+        for result in results:
+            if not result.ok:
+                print(f"Row {result.row}: {result.message}")
 
-        book.delete(transaction)
+        if not all(result.ok for result in results):
+            raise click.ClickException("Nothing imported, since some rows are invalid")
 
         book.save()
+        print(f"Imported {len(results)} transactions")
+
+
+@bp.cli.command("search_index")
+@click.option("--drop", is_flag=True, help="Remove the index instead of creating it")
+@click.option(
+    "--update",
+    is_flag=True,
+    help="Add changes by other programs to the index instead of rebuilding it",
+)
+@click.pass_context
+def search_index_command(ctx, drop, update):
+    """Create full-text index to speed up searching transaction descriptions.
+
+    Uses an FTS5 table for SQLite and a trigram index for PostgreSQL.
+
+    :param ctx: Click application context
+    :param drop: Remove the index instead
+    :param update: Update the existing index instead
 
-        return redirect(account_url(account))
+    """
+    opts = ctx.find_root().params
+
+    with open_book(
+        uri_conn=app.config.DB_URI(opts.get("username"), opts.get("password")),
+        readonly=False,
+        do_backup=False,
+        open_if_lock=False,
+    ) as book:
+        try:
+            if drop:
+                drop_search_index(book.session.connection())
+            elif update:
+                if not has_search_index(book.session):
+                    raise click.ClickException("There is no search index to update")
+                update_search_index(book.session.connection())
+            else:
+                create_search_index(book.session.connection())
+        except NotImplementedError as e:
+            raise click.ClickException(str(e)) from e
+
+        book.save()
+        if drop:
+            print("Search index removed")
+        else:
+            print("Search index updated" if update else "Search index created")
@@ -6,32 +6,23 @@ from flask import (
 import click
 from babel import numbers
 from piecash.core.commodity import Price
+from piecash.core.factories import create_currency_from_ISO
+from werkzeug.utils import import_string
 
 from .utils.gnucash import open_book
+from .utils.prices import fetch_quotes, price_index, quote_request
 
 bp = Blueprint("commodities", __name__, url_prefix="/commodities")
 
 
-def latest_price(commodity):
-    """Get latest known price for commodity.
-
-    :param commodity: The commodity in question. Must be different from the books
-      default currency
-
-    :returns: Latest known price of the commodity in the books default currency
-
-    """
-    return commodity.prices.order_by(Price.date.desc()).limit(1).first()
-
-
 def format_price(price):
     """Format price with currency according to current locale.
 
-    :param price: The price in question
+    :param price: The price in question, as `utils.prices.PricePoint`
     :returns: Human-readable string
 
     """
-    return numbers.format_currency(price.value, price.currency.mnemonic)
+    return numbers.format_currency(price.value, price.currency_mnemonic)
 
 
 @bp.cli.command("list")
@@ -45,9 +36,11 @@ def list_commodities(ctx, namespace):
 
     """
     opts = ctx.find_root().params
+    credentials = opts.get("username"), opts.get("password")
 
     with open_book(
-        uri_conn=app.config.DB_URI(opts.get("username"), opts.get("password")),
+        uri_conn=app.config.DB_URI(*credentials),
+        replica_uris=app.config.DB_REPLICA_URIS(*credentials),
         readonly=True,
         open_if_lock=True,
     ) as book:
@@ -56,6 +49,8 @@ def list_commodities(ctx, namespace):
         else:
             commodities = book.commodities
 
+        prices = price_index(book)
+
         for commodity in commodities:
             print(f"{commodity.namespace}:{commodity.mnemonic} ({commodity.cusip})")
             print(f"  Traded fraction: {1/commodity.fraction}")
@@ -63,7 +58,7 @@ def list_commodities(ctx, namespace):
             if commodity.quote_flag:
                 print(f"  Quote Source: {commodity.quote_source} (ignored)")
 
-            price = latest_price(commodity)
+            price = prices.latest(commodity.guid)
             if price:
                 print(
                     f"  Latest known price: {format_price(price)}"
@@ -72,14 +67,30 @@ def list_commodities(ctx, namespace):
 
 
 @bp.cli.command("update_prices")
+@click.option(
+    "--provider",
+    help="Quote provider, as import path of a QuoteProvider subclass"
+    " (default: PRICE_QUOTE_PROVIDER)",
+)
+@click.option(
+    "--workers",
+    type=int,
+    help="Maximum number of concurrent requests (default: PRICE_FETCH_WORKERS)",
+)
 @click.pass_context
-def update_prices(ctx):
+def update_prices(ctx, provider, workers):
     """Update prices for all commodities for which it is enabled.
 
+    Prices of all commodities are fetched concurrently first, then written to the
+    database at once.
+
     :param ctx: Click application context
+    :param provider: Import path of the `utils.prices.QuoteProvider` subclass to use
+    :param workers: Maximum number of concurrent requests
 
     """
     opts = ctx.find_root().params
+    provider = import_string(provider or app.config.PRICE_QUOTE_PROVIDER)()
 
     with open_book(
         uri_conn=app.config.DB_URI(opts.get("username"), opts.get("password")),
@@ -88,23 +99,61 @@ def update_prices(ctx):
         open_if_lock=False,
     ) as book:
 
-        old_prices = {}
+        old_prices = price_index(book)
 
-        # Update prices (relative to book.default_currency) of all relevant
+        # Fetch prices (relative to book.default_currency) of all relevant
         # commodities
-        for commodity in book.commodities:
-            old_prices[commodity] = latest_price(commodity)
-            if commodity.quote_flag and commodity != book.default_currency:
-                commodity.update_prices()
+        requests = {
+            commodity: quote_request(commodity, old_prices.latest(commodity.guid))
+            for commodity in book.commodities
+            if commodity.quote_flag and commodity != book.default_currency
+        }
+        results = fetch_quotes(
+            provider,
+            requests.values(),
+            max_workers=workers or app.config.PRICE_FETCH_WORKERS,
+            rate=app.config.PRICE_FETCH_RATE,
+        )
+
+        currencies = {currency.mnemonic: currency for currency in book.currencies}
+        for commodity, request in requests.items():
+            quotes = results[request]
+            if isinstance(quotes, Exception):
+                print(f"Could not fetch prices for {commodity.mnemonic}: {quotes}")
+                continue
+
+            for quote in quotes:
+                # Currencies missing in the book are added, as done by piecash
+                if quote.currency not in currencies:
+                    try:
+                        currency = create_currency_from_ISO(quote.currency)
+                    except ValueError:
+                        print(
+                            f"Ignoring price for {commodity.mnemonic}"
+                            f" in unknown currency {quote.currency}"
+                        )
+                        continue
+                    book.add(currency)
+                    currencies[quote.currency] = currency
+                    print(f"Added currency {quote.currency}")
+
+                Price(
+                    commodity=commodity,
+                    currency=currencies[quote.currency],
+                    date=quote.date,
+                    value=quote.value,
+                    type=quote.type,
+                )
 
         # Fetched prices are only visible after save, so we do it now and print the
         # changes later
         book.save()
 
         # Print price changes
+        new_prices = price_index(book)
         for commodity in book.commodities:
-            old_price = old_prices[commodity]
-            new_price = latest_price(commodity)
+            old_price = old_prices.latest(commodity.guid)
+            new_price = new_prices.latest(commodity.guid)
             if new_price:
                 if old_price and new_price.date > old_price.date:
                     print(
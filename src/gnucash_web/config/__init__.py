@@ -40,11 +40,12 @@ class GnuCashWebConfig(Config):
                 app.logger.debug(f"Reading config file {path}")
                 self.from_pyfile(path)
 
-    def DB_URI(self, user=None, password=None):
+    def DB_URI(self, user=None, password=None, host=None):
         """Get URI for the GnuCash database, possibly including credentials.
 
         :param user: Database username
         :param password: Database password
+        :param host: Database host, if not `DB_HOST`
         :returns: Database URI for `piecash.open_book`
         :raises ValueError: If `DB_DRIVER == "sqlite"` and `user` or `password` is
           not `None`
@@ -63,12 +64,29 @@ class GnuCashWebConfig(Config):
         else:
             auth = ":".join(elt for elt in [user, password] if elt)
             location = "/".join(
-                elt for elt in [self["DB_HOST"], self["DB_NAME"]] if elt
+                elt for elt in [host or self["DB_HOST"], self["DB_NAME"]] if elt
             )
             return "{DB_DRIVER}://{uri}".format(
                 **self, uri="@".join(elt for elt in [auth, location] if elt)
             )
 
+    def DB_REPLICA_URIS(self, user=None, password=None):
+        """Get URIs for the read-only replicas of the GnuCash database.
+
+        Replicas are accessed with the same driver, database name and credentials as
+        the primary database.
+
+        :param user: Database username
+        :param password: Database password
+        :returns: List of database URIs, empty for `DB_DRIVER == "sqlite"`
+
+        """
+        if self["DB_DRIVER"] == "sqlite":
+            return []
+        return [
+            self.DB_URI(user, password, host=host) for host in self["DB_REPLICA_HOSTS"]
+        ]
+
     @property
     def SESSION_CRYPTO_KEY(self):
         """Get key for EncryptedSession.
@@ -9,8 +9,37 @@ LOG_LEVEL = logging.getLevelName(os.getenv('LOG_LEVEL', 'WARN'))
 DB_DRIVER = os.getenv('DB_DRIVER', 'sqlite')
 DB_NAME = os.getenv('DB_NAME', 'db/gnucash.sqlite')
 DB_HOST = os.getenv('DB_HOST', 'localhost')
+DB_REPLICA_HOSTS = [
+    host for host in os.getenv('DB_REPLICA_HOSTS', '').split(',') if host
+]
+DB_REPLICA_RETRY = int(os.getenv('DB_REPLICA_RETRY', 30))
+DB_REPLICA_LAG = int(os.getenv('DB_REPLICA_LAG', 5))
 
 AUTH_MECHANISM = os.getenv('AUTH_MECHANISM')
+AUTH_CACHE_TTL = int(os.getenv('AUTH_CACHE_TTL', 300))
 
 TRANSACTION_PAGE_LENGTH = int(os.getenv('TRANSACTION_PAGE_LENGTH', 25))
 PRESELECTED_CONTRA_ACCOUNT = os.getenv('PRESELECTED_CONTRA_ACCOUNT')
+PAGE_CACHE_SIZE = int(os.getenv('PAGE_CACHE_SIZE', 0))
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 500))
+WRITE_LOCK_TIMEOUT = float(os.getenv('WRITE_LOCK_TIMEOUT', 5))
+
+PRICE_QUOTE_PROVIDER = os.getenv(
+    'PRICE_QUOTE_PROVIDER', 'gnucash_web.utils.prices.PiecashQuoteProvider'
+)
+PRICE_FETCH_WORKERS = int(os.getenv('PRICE_FETCH_WORKERS', 8))
+PRICE_FETCH_RATE = float(os.getenv('PRICE_FETCH_RATE', 2))
+
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 8))
+DB_POOL_IDLE_TIMEOUT = int(os.getenv('DB_POOL_IDLE_TIMEOUT', 600))
+
+ASGI_THREADS = int(os.getenv('ASGI_THREADS', 0)) or None
+
+CHANGE_FEED_FILE = os.getenv('CHANGE_FEED_FILE')
+CHANGE_POLL_INTERVAL = float(os.getenv('CHANGE_POLL_INTERVAL', 2))
+CHANGE_CHECKSUM_INTERVAL = float(os.getenv('CHANGE_CHECKSUM_INTERVAL', 0))
+
+INSTRUMENTATION = os.getenv('INSTRUMENTATION', 'false').lower() == 'true'
+METRICS_ENDPOINT = os.getenv('METRICS_ENDPOINT', 'false').lower() == 'true'
+PROFILE_DIR = os.getenv('PROFILE_DIR')
+PROFILE_ALL_REQUESTS = os.getenv('PROFILE_ALL_REQUESTS', 'false').lower() == 'true'
@@ -0,0 +1,143 @@
+"""Opt-in request instrumentation: timing headers, request log, profiles and metrics."""
+import cProfile
+import os
+import time
+
+from flask import Blueprint, Response, request
+from flask import current_app as app
+
+from .utils.metrics import (
+    Histogram,
+    TimedTemplate,
+    current_metrics,
+    instrument_sql,
+    start_request,
+)
+
+bp = Blueprint('metrics', __name__)
+
+request_latency = Histogram(
+    'gnucash_web_request_duration_seconds',
+    'Time spent handling requests.',
+    ('method', 'route', 'status'),
+)
+request_queries = Histogram(
+    'gnucash_web_request_sql_statements',
+    'Number of SQL statements executed per request.',
+    ('method', 'route'),
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+
+
+def init_app(app):
+    """Enable instrumentation as configured.
+
+    With `INSTRUMENTATION`, each request counts its SQL statements and the time spent
+    in them, opening the book and rendering templates. These are sent to the client
+    in a `Server-Timing` header and logged with level INFO. With `METRICS_ENDPOINT`,
+    request latencies are also collected per route and exposed at `/metrics`.
+
+    Requests are profiled with cProfile if `PROFILE_DIR` is set and either
+    `PROFILE_ALL_REQUESTS` is set or the request has the query parameter `profile`.
+
+    :param app: The Flask app
+
+    """
+    config = app.config
+    if not (config.INSTRUMENTATION or config.METRICS_ENDPOINT or config.PROFILE_DIR):
+        return
+
+    instrument_sql()
+    app.jinja_env.template_class = TimedTemplate
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+
+    if app.config.METRICS_ENDPOINT:
+        app.register_blueprint(bp)
+
+
+def _before_request():
+    start_request()
+
+    if app.config.PROFILE_DIR and (
+        app.config.PROFILE_ALL_REQUESTS or 'profile' in request.args
+    ):
+        profile = cProfile.Profile()
+        profile.enable()
+        current_metrics().profile = profile
+
+
+def _after_request(response):
+    metrics = current_metrics()
+    if metrics is None:
+        return response
+
+    if metrics.profile is not None:
+        metrics.profile.disable()
+        _dump_profile(metrics.profile)
+
+    elapsed = metrics.elapsed()
+    route = request.url_rule.rule if request.url_rule else '<unmatched>'
+
+    if app.config.METRICS_ENDPOINT and request.endpoint != 'metrics.metrics':
+        request_latency.observe((request.method, route, str(response.status_code)), elapsed)
+        request_queries.observe((request.method, route), metrics.sql_count)
+
+    if app.config.INSTRUMENTATION:
+        phases = [
+            ('total', elapsed, None),
+            ('sql', metrics.sql_time, f'{metrics.sql_count} queries'),
+        ]
+        phases.extend((name, duration, None) for name, duration in metrics.timings.items())
+        response.headers['Server-Timing'] = ', '.join(
+            f'{name};dur={duration * 1000:.1f}' + (f';desc="{desc}"' if desc else '')
+            for name, duration, desc in phases
+        )
+        fields = [
+            f'method={request.method}',
+            f'path={request.path}',
+            f'route={route}',
+            f'status={response.status_code}',
+            f'duration_ms={elapsed * 1000:.1f}',
+            f'sql_count={metrics.sql_count}',
+            f'sql_ms={metrics.sql_time * 1000:.1f}',
+        ]
+        fields.extend(
+            f'{name}_ms={duration * 1000:.1f}' for name, duration in metrics.timings.items()
+        )
+        app.logger.info('request ' + ' '.join(fields))
+
+    return response
+
+
+def _dump_profile(profile):
+    """Write profile of the current request to `PROFILE_DIR`.
+
+    The file name contains the time and endpoint, the file can be inspected with
+    `python -m pstats` or e.g. snakeviz.
+
+    :param profile: The `cProfile.Profile`
+
+    """
+    os.makedirs(app.config.PROFILE_DIR, exist_ok=True)
+    path = os.path.join(
+        app.config.PROFILE_DIR,
+        f'{time.strftime("%Y%m%d-%H%M%S")}-{time.time_ns() % 10**9:09d}'
+        f'-{request.endpoint or "unmatched"}.prof',
+    )
+    profile.dump_stats(path)
+    app.logger.info(f'Wrote profile {path}')
+
+
+@bp.route('/metrics')
+def metrics():
+    """Expose collected metrics in the Prometheus text format.
+
+    Metrics are collected per process, so with several workers each scrape only sees
+    the requests handled by one of them.
+
+    """
+    lines = request_latency.samples() + request_queries.samples()
+    return Response(
+        '\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4; charset=utf-8'
+    )
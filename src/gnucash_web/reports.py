@@ -0,0 +1,120 @@
+"""Periodic reports over the accounts of a GnuCash book."""
+import csv
+import io
+from datetime import date
+
+from flask import Blueprint, Response, jsonify, render_template, request
+from flask import current_app as app
+from werkzeug.exceptions import BadRequest, NotFound
+
+from .auth import requires_auth, get_db_credentials, get_db_replica_uris
+from .utils.gnucash import open_book
+from .utils.reports import PERIODS, REPORT_TYPES, period_report
+
+bp = Blueprint("reports", __name__, url_prefix="/reports")
+
+# Human-readable names of the supported reports
+TITLES = {"income": "Income Statement", "cashflow": "Cash Flow"}
+
+
+@bp.route("/<kind>")
+@requires_auth
+def show_report(kind):
+    """Show report of amounts per account and period.
+
+    :param kind: Either `'income'` or `'cashflow'`, see `utils.reports.period_report`
+    :param period: `'month'` (default) or `'year'`, read from `request.args`
+    :param start: First date to include, read from `request.args`. Defaults to the
+      beginning of the month a year ago for monthly reports.
+    :param end: Last date to include, read from `request.args`
+    :param format: `'html'` (default), `'csv'` or `'json'`, read from `request.args`
+    :returns: Rendered HTTP Response
+
+    """
+    if kind not in REPORT_TYPES:
+        raise NotFound(f"Unknown report: {kind}")
+
+    granularity = request.args.get("period", "month")
+    format = request.args.get("format", "html")
+    try:
+        start = request.args.get("start")
+        start = date.fromisoformat(start) if start else None
+        end = request.args.get("end")
+        end = date.fromisoformat(end) if end else None
+    except ValueError as e:
+        raise BadRequest(f"Invalid query parameter: {e}") from e
+
+    if granularity not in PERIODS:
+        raise BadRequest(f"Invalid query parameter: period must be one of {list(PERIODS)}")
+    if format not in ["html", "csv", "json"]:
+        raise BadRequest("Invalid query parameter: format must be html, csv or json")
+
+    if start is None and granularity == "month" and "start" not in request.args:
+        today = date.today()
+        start = date(today.year - 1, today.month, 1)
+
+    with open_book(
+        uri_conn=app.config.DB_URI(*get_db_credentials()),
+        replica_uris=get_db_replica_uris(),
+        open_if_lock=True,
+        readonly=True,
+    ) as book:
+        report = period_report(book, kind, granularity, start, end)
+        currency = book.default_currency
+
+        if format == "json":
+            return jsonify(
+                {
+                    "kind": report.kind,
+                    "period": report.granularity,
+                    "currency": currency.mnemonic,
+                    "periods": report.periods,
+                    "accounts": [
+                        {
+                            "fullname": row.account.fullname,
+                            "values": [_json_amount(value) for value in row.values],
+                            "total": _json_amount(row.total),
+                        }
+                        for row in report.rows
+                    ],
+                    "totals": [_json_amount(value) for value in report.totals],
+                    "total": _json_amount(report.total),
+                }
+            )
+
+        elif format == "csv":
+            output = io.StringIO()
+            writer = csv.writer(output)
+            writer.writerow(["account", *report.periods, "total"])
+            for row in report.rows:
+                writer.writerow([row.account.fullname, *row.values, row.total])
+            writer.writerow(["", *report.totals, report.total])
+
+            return Response(
+                output.getvalue(),
+                mimetype="text/csv",
+                headers={
+                    "Content-Disposition": f"attachment; filename={kind}-{granularity}.csv"
+                },
+            )
+
+        else:
+            return render_template(
+                "report.j2",
+                title=TITLES[kind],
+                kind=kind,
+                report=report,
+                currency=currency,
+                start=start,
+                end=end,
+            )
+
+
+def _json_amount(amount):
+    """Represent amount in JSON, as string to keep its precision.
+
+    :param amount: Decimal amount or `None` if unknown
+    :returns: String or `None`
+
+    """
+    return None if amount is None else str(amount)
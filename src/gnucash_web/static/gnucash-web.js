@@ -32,6 +32,8 @@ document.addEventListener("DOMContentLoaded", function(){
 
         $("input[form=edit_transaction][name=guid]")
             .attr("value", button.getAttribute('data-bs-transaction-guid'));
+        $("input[form=edit_transaction][name=version]")
+            .attr("value", button.getAttribute('data-bs-transaction-version'));
         $("input[form=edit_transaction][name=description]")
             .attr("value", button.getAttribute('data-bs-transaction-description'));
         $("input[form=edit_transaction][name=value]")
@@ -50,9 +52,14 @@ document.addEventListener("DOMContentLoaded", function(){
                 $("input#edit-transaction-sign-deposit").attr('checked', true);
             }
 
-            // Reset selectize
-            $("select[form=edit_transaction][name=contra_account_name]")[0]
-                .selectize.addItem(button.getAttribute('data-bs-transaction-contra-account'));
+            // Reset selectize. Its options are loaded lazily and may not be there yet,
+            // so the contra account is added as an option first (it is not added twice
+            // when the options arrive).
+            var contraAccount = button.getAttribute('data-bs-transaction-contra-account');
+            var selectize = $("select[form=edit_transaction][name=contra_account_name]")[0]
+                .selectize;
+            selectize.addOption({value: contraAccount, text: contraAccount});
+            selectize.addItem(contraAccount);
         };
 
         editTransactionModal.reset();
@@ -84,6 +91,13 @@ document.addEventListener("DOMContentLoaded", function(){
         this.classList.add('was-validated');
     });
 
+    // Subaccount trees are only loaded when expanded
+    $("#subaccounts").on("show.bs.collapse", ".gnc-account-group", function (event) {
+        if (event.target === this && this.hasAttribute("data-gnc-subtree-url")) {
+            load_subtree(this);
+        }
+    });
+
     // Enable tooltips everywhere
     var tooltipTriggerList = [].slice.call(document.querySelectorAll('[data-bs-toggle="tooltip"]'))
     var tooltipList = tooltipTriggerList.map(function (tooltipTriggerEl) {
@@ -96,3 +110,40 @@ function transaction_recycle(description, value, postDate, contraAccount) {
     $("input[form=new_transaction][name=value]")[0].value = value;
     $("select[form=new_transaction][name=contra_account_name]")[0].selectize.addItem(contraAccount);
 }
+
+/*
+ * Fill a collapsed account group with the subaccounts of the account.
+ *
+ * Fragments are cached for the session. Their URL contains the version of the book, so
+ * changed books are loaded again.
+ */
+function load_subtree(group) {
+    var url = group.getAttribute("data-gnc-subtree-url");
+    group.removeAttribute("data-gnc-subtree-url");
+
+    var cached = window.sessionStorage.getItem(url);
+    if (cached !== null) {
+        group.innerHTML = cached;
+        return;
+    }
+
+    fetch(url, {credentials: "same-origin"})
+        .then(function (response) {
+            if (!response.ok) {
+                throw new Error(response.statusText);
+            }
+            return response.text();
+        })
+        .then(function (html) {
+            group.innerHTML = html;
+            try {
+                window.sessionStorage.setItem(url, html);
+            } catch (e) {
+                // Storage is full or disabled, the browser's HTTP cache still applies
+            }
+        })
+        .catch(function () {
+            // Try again on next expansion
+            group.setAttribute("data-gnc-subtree-url", url);
+        });
+}
@@ -0,0 +1,203 @@
+"""In-memory index of the accounts in a GnuCash book."""
+from collections import defaultdict
+from urllib.parse import quote_plus, unquote_plus
+
+from piecash import Account, Split
+from sqlalchemy import func
+
+from .cache import cached
+
+
+class AccountEntry:
+    """Lightweight, read-only summary of an account."""
+
+    __slots__ = (
+        "guid",
+        "name",
+        "fullname",
+        "path",
+        "parent_guid",
+        "commodity_guid",
+        "placeholder",
+        "type",
+    )
+
+    def __init__(self, guid, name, parent_guid, commodity_guid, placeholder, type):
+        """Create entry, `fullname` and `path` are set by `AccountIndex`."""
+        self.guid = guid
+        self.name = name
+        self.parent_guid = parent_guid
+        self.commodity_guid = commodity_guid
+        self.placeholder = bool(placeholder)
+        self.type = type
+        self.fullname = ""
+        self.path = ""
+
+
+class AccountIndex:
+    """Index of all accounts in a book, built from a single query.
+
+    Provides lookups by GUID and full name, as well as the chain of parent accounts,
+    without loading any account objects.
+
+    """
+
+    def __init__(self, entries):
+        """Build index.
+
+        :param entries: Iterable of `AccountEntry`, one for each account in the book
+        :returns: New index
+
+        """
+        self.by_guid = {entry.guid: entry for entry in entries}
+        self.children = defaultdict(list)
+        for entry in self.by_guid.values():
+            self.children[entry.parent_guid].append(entry)
+
+        # Top-down, so parents are always done before their children
+        todo = list(self.children[None])
+        while todo:
+            entry = todo.pop()
+            parent = self.by_guid.get(entry.parent_guid)
+            if parent is not None:
+                entry.fullname = (
+                    f"{parent.fullname}:{entry.name}" if parent.fullname else entry.name
+                )
+                entry.path = "/".join(
+                    elt for elt in [parent.path, quote_plus(entry.name)] if elt
+                )
+            todo.extend(self.children[entry.guid])
+
+        # Same as `book.accounts`, which excludes the root accounts
+        self.by_fullname = {
+            entry.fullname: entry
+            for entry in self.by_guid.values()
+            if entry.parent_guid is not None
+        }
+
+    @classmethod
+    def load(cls, book):
+        """Build index of all accounts in the book.
+
+        :param book: GnuCash book
+        :returns: New index
+
+        """
+        return cls(
+            AccountEntry(*row)
+            for row in book.session.query(
+                Account.guid,
+                Account.name,
+                Account.parent_guid,
+                Account.commodity_guid,
+                Account._placeholder,
+                Account.type,
+            )
+        )
+
+    def __getitem__(self, guid):
+        """Get account entry by GUID.
+
+        :param guid: GUID of the account
+        :returns: Account entry
+        :raises KeyError: If there is no such account
+
+        """
+        return self.by_guid[guid]
+
+    def ancestors(self, guid):
+        """Get all parent accounts of an account, including itself.
+
+        :param guid: GUID of the account
+        :returns: List of account entries, starting at the root account
+
+        """
+        chain = []
+        entry = self.by_guid.get(guid)
+        while entry is not None:
+            chain.append(entry)
+            entry = self.by_guid.get(entry.parent_guid)
+        return chain[::-1]
+
+    def subtree(self, guid):
+        """Get all accounts below an account, including itself.
+
+        :param guid: GUID of the account
+        :returns: List of account entries, parents before their children
+
+        """
+        subtree, todo = [], [self.by_guid[guid]]
+        while todo:
+            entry = todo.pop()
+            subtree.append(entry)
+            todo.extend(self.children[entry.guid])
+        return subtree
+
+
+def account_index(book):
+    """Get the account index of the book.
+
+    The index is cached as long as the book does not change.
+
+    :param book: GnuCash book
+    :returns: Account index
+
+    """
+    return cached(book, "account_index", AccountIndex.load)
+
+
+def account_name_from_path(path):
+    """Get full account name from the path used in URLs.
+
+    Inverse of `AccountEntry.path`.
+
+    :param path: Account name with / as account name separator. Each component of the
+      account name must be urlencoded.
+    :returns: Full account name
+
+    """
+    return ":".join(unquote_plus(name) for name in path.split("/"))
+
+
+def contra_account_choices(account):
+    """Get accounts that can be used as contra account for the given account.
+
+    These are all other accounts of the same commodity, which are not placeholders.
+    Frequently used accounts, i.e. those with the most splits, come first. The choices for all
+    commodities are computed at once, using a single grouped query to count the splits,
+    and cached as long as the book does not change.
+
+    :param account: GnuCash account
+    :returns: List of `AccountEntry`
+
+    """
+    choices = cached(account.book, "contra_account_choices", _load_contra_account_choices)
+    return [
+        entry
+        for entry in choices.get(account.commodity_guid, [])
+        if entry.guid != account.guid
+    ]
+
+
+def _load_contra_account_choices(book):
+    """Get possible contra accounts for each commodity.
+
+    :param book: GnuCash book
+    :returns: Dictionary mapping commodity GUIDs to lists of `AccountEntry`
+
+    """
+    num_splits = dict(
+        book.session.query(Split.account_guid, func.count(Split.guid)).group_by(
+            Split.account_guid
+        )
+    )
+
+    choices = defaultdict(list)
+    for entry in account_index(book).by_fullname.values():
+        if not entry.placeholder:
+            choices[entry.commodity_guid].append(entry)
+
+    for entries in choices.values():
+        entries.sort(key=lambda entry: (-num_splits.get(entry.guid, 0), entry.fullname))
+
+    return dict(choices)
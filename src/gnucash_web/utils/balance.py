@@ -0,0 +1,203 @@
+"""Account balances and their value in other currencies."""
+from collections import defaultdict
+from decimal import Decimal
+
+from piecash import Split
+from piecash.core.account import assetliab_types, positive_types
+from sqlalchemy import func
+
+from .accounts import account_index
+from .cache import cached
+from .prices import price_index
+
+
+def account_balances(account):
+    """Get the balances of an account and all its subaccounts.
+
+    Equivalent to calling `account.get_balance()` for the account and every subaccount,
+    but the splits are summed up per account by a single grouped query (see
+    `account_amounts`) and then rolled up the account tree in memory.
+
+    As with `piecash.core.account.Account.get_balance`, balances of subaccounts in a
+    different commodity are converted using the latest known price (see
+    `.prices.PriceIndex.rate`), either directly or via the commodity of their parent
+    account. Amounts that can not be converted are considered as 0.
+
+    :param account: GnuCash account, e.g. `book.root_account`
+    :returns: Dictionary mapping account GUIDs to the balance of the account including
+      its subaccounts, in the commodity of the account and with natural sign
+
+    """
+    index = account_index(account.book)
+    subtree = {entry.guid for entry in index.subtree(account.guid)}
+    amounts = account_amounts(account.book)
+
+    factor = _conversion_factors(account.book)
+
+    totals = {guid: Decimal(0) for guid in subtree}
+    for guid in subtree:
+        amount = amounts.get(guid)
+        if not amount:
+            continue
+
+        entry = index[guid]
+        via = index.by_guid.get(entry.parent_guid)
+
+        ancestor = entry
+        while ancestor is not None and ancestor.guid in totals:
+            totals[ancestor.guid] += amount * factor(
+                entry.commodity_guid, ancestor.commodity_guid, via and via.commodity_guid
+            )
+            ancestor = index.by_guid.get(ancestor.parent_guid)
+
+    return {
+        guid: total if index[guid].type in positive_types else -total
+        for guid, total in totals.items()
+    }
+
+
+def account_values(account, currency=None):
+    """Get the value of an account and all its subaccounts in a single currency.
+
+    Each account's own amount is converted with the rate of its commodity, of which
+    there are usually few, so only one rate per commodity is looked up. The converted
+    amounts are then rolled up the account tree. Amounts that can not be converted (see
+    `valuation_rates`) are considered as 0.
+
+    :param account: GnuCash account, e.g. `book.root_account`
+    :param currency: Target currency, defaults to the default currency of the book
+    :returns: Dictionary mapping account GUIDs to the value of the account including its
+      subaccounts, in the target currency and with natural sign
+
+    """
+    book = account.book
+    index = account_index(book)
+    subtree = index.subtree(account.guid)
+    amounts = account_amounts(book)
+    rates = valuation_rates(
+        book,
+        {entry.commodity_guid for entry in subtree},
+        (currency or book.default_currency).guid,
+    )
+
+    totals = {entry.guid: Decimal(0) for entry in subtree}
+    for entry in subtree:
+        value = amounts.get(entry.guid, 0) * (rates[entry.commodity_guid] or 0)
+        if not value:
+            continue
+
+        ancestor = entry
+        while ancestor is not None and ancestor.guid in totals:
+            totals[ancestor.guid] += value
+            ancestor = index.by_guid.get(ancestor.parent_guid)
+
+    return {
+        guid: total if index[guid].type in positive_types else -total
+        for guid, total in totals.items()
+    }
+
+
+def net_worth(book, currency=None):
+    """Get the total value of all asset and liability accounts.
+
+    :param book: GnuCash book
+    :param currency: Target currency, defaults to the default currency of the book
+    :returns: Net worth in the target currency, see `account_values`
+
+    """
+    index = account_index(book)
+    amounts = account_amounts(book)
+    rates = valuation_rates(
+        book,
+        {entry.commodity_guid for entry in index.by_guid.values()},
+        (currency or book.default_currency).guid,
+    )
+
+    return sum(
+        (
+            amounts.get(entry.guid, 0) * (rates[entry.commodity_guid] or 0)
+            for entry in index.by_guid.values()
+            if entry.type in assetliab_types
+        ),
+        Decimal(0),
+    )
+
+
+def valuation_rates(book, commodities, currency, at=None):
+    """Get the factors to convert amounts of several commodities into a currency.
+
+    Uses the latest price of a commodity in the currency (or the inverse), or else its
+    latest price in any other currency, converted to the target currency.
+
+    :param book: GnuCash book
+    :param commodities: GUIDs of the commodities
+    :param currency: GUID of the target currency
+    :param at: Use the latest prices on or before this date, defaults to the latest
+      prices overall
+    :returns: Dictionary mapping commodity GUIDs to conversion factors, or `None` if
+      there is no suitable price
+
+    """
+    prices = price_index(book)
+
+    rates = {}
+    for commodity in commodities:
+        rate = prices.rate(commodity, currency, at)
+        if rate is None:
+            latest = prices.latest(commodity, at)
+            via = latest and prices.rate(latest.currency_guid, currency, at)
+            rate = latest.value * via if via is not None else None
+        rates[commodity] = rate
+
+    return rates
+
+
+def account_amounts(book):
+    """Get the amount of each account, not including subaccounts.
+
+    All splits are summed up per account by a single grouped query, which is cached as
+    long as the book does not change.
+
+    :param book: GnuCash book
+    :returns: Dictionary mapping account GUIDs to the sum of the quantities of their
+      splits (accounts without splits are missing)
+
+    """
+    return cached(book, "account_amounts", _load_account_amounts)
+
+
+def _load_account_amounts(book):
+    """Sum up splits per account, see `account_amounts`.
+
+    :param book: GnuCash book
+    :returns: Dictionary mapping account GUIDs to amounts
+
+    """
+    amounts = defaultdict(Decimal)
+    for guid, denom, num in book.session.query(
+        Split.account_guid, Split._quantity_denom, func.sum(Split._quantity_num)
+    ).group_by(Split.account_guid, Split._quantity_denom):
+        amounts[guid] += Decimal(num) / Decimal(denom)
+
+    return dict(amounts)
+
+
+def _conversion_factors(book):
+    """Get function to look up conversion factors between commodities.
+
+    :param book: GnuCash book
+    :returns: Function `factor(commodity, target, via)`, taking commodity GUIDs and
+      returning the factor to convert an amount in `commodity` to `target`, possibly
+      via an intermediate commodity `via`, or 0 if this is not possible
+
+    """
+    rate = price_index(book).rate
+
+    def factor(commodity, target, via):
+        result = rate(commodity, target)
+        if result is None:
+            first, second = rate(commodity, via), rate(via, target)
+            result = first * second if first is not None and second is not None else 0
+        return result
+
+    return factor
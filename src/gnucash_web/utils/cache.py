@@ -0,0 +1,339 @@
+"""Caches for data derived from a GnuCash book.
+
+Cached values are kept with the pooled engine of the book (see `.pool`), i.e. per
+database and set of credentials, and are recomputed whenever the version of the book
+changes.
+"""
+import threading
+import uuid
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from piecash import Account, Commodity, Price, Split, Transaction
+from sqlalchemy import BigInteger, String, cast, event, func, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+from .changes import feed
+from .pool import engines
+from .replicas import replicas
+
+VERSION_KEY = "gnucash_web.book_version"
+UNCACHED_KEY = "gnucash_web.uncached"
+
+_lru_lock = threading.Lock()
+
+
+def book_version(book):
+    """Get the version of the book.
+
+    The version consists of the number of changes made by this process, the latest
+    change announced by any GnuCash Web process and a fingerprint of the book's
+    contents (row counts of the main tables and the latest entry date), so that changes
+    made by other programs are noticed as well. Changes made in place by other
+    programs are only noticed by the optional checksum (see `_checksum`). See
+    `.changes.ChangeFeed.version`. It is only computed once per session.
+
+    A replica may not have caught up with a change yet, even though the version
+    includes the change. Shortly after a change, the version of a book opened on a
+    replica is therefore unique to the session, and nothing derived from it is cached.
+
+    :param book: GnuCash book
+    :returns: Hashable version identifier
+
+    """
+    info = book.session.info
+    if VERSION_KEY not in info:
+        entry = engines.find(book.session.bind)
+        version = feed.version(
+            entry,
+            lambda: book.session.execute(_fingerprint()).first(),
+            lambda: _checksum(entry),
+        )
+
+        age = feed.age()
+        if (
+            entry is not None
+            and replicas.is_replica(entry.uri)
+            and age is not None
+            and age < replicas.lag
+        ):
+            version += (uuid.uuid4().hex,)
+            info[UNCACHED_KEY] = True
+
+        info[VERSION_KEY] = version
+    return info[VERSION_KEY]
+
+
+def last_modified(book):
+    """Get an estimate of the time of the latest change to the book.
+
+    This is the latest entry date of all transactions or the time of the last commit by
+    this process, whichever is later. Changes by other processes which do not add
+    transactions are not noticed.
+
+    :param book: GnuCash book
+    :returns: Timezone aware datetime, or `None` if unknown
+
+    """
+    entry = engines.find(book.session.bind)
+    candidates = [book_version(book)[3], entry and entry.cache.get("modified")]
+    return max(filter(None, candidates), default=None)
+
+
+def _fingerprint():
+    """Build query for the fingerprint of the book's contents.
+
+    Only row counts and the latest entry date are used, which are cheap enough to be
+    polled often.
+
+    :returns: SQLAlchemy select statement
+
+    """
+
+    def scalar(expr, table):
+        return select([expr]).select_from(table).as_scalar()
+
+    return select(
+        [
+            scalar(func.count(), Transaction.__table__),
+            scalar(func.max(Transaction.enter_date), Transaction.__table__),
+            scalar(func.count(), Split.__table__),
+            scalar(func.count(), Account.__table__),
+            scalar(func.count(), Price.__table__),
+        ]
+    )
+
+
+def _checksum(entry):
+    """Compute a checksum over all rows of the main tables of a book.
+
+    Unlike the fingerprint, this notices changes made in place (e.g. a changed amount
+    or description), but reads every row. It is computed in a session of its own, see
+    `.changes.ChangeFeed.check`.
+
+    :param entry: `.pool.PooledEngine` of the book
+    :returns: Tuple of checksums
+
+    """
+    session = entry.session()
+    try:
+        connection = session.connection()
+        if connection.dialect.name == "sqlite":
+            # Only needed for this query, so it is not registered on every connection
+            connection.connection.create_function(
+                "gnc_crc32", 1, _crc32, deterministic=True
+            )
+        return tuple(session.execute(_checksum_query()).first())
+    finally:
+        session.close()
+
+
+def _checksum_query():
+    """Build query for `_checksum`, see `row_checksum`.
+
+    :returns: SQLAlchemy select statement
+
+    """
+
+    def checksum(table, *columns):
+        fields = [func.coalesce(cast(table.c[name], String), "") for name in columns]
+        row = fields[0]
+        for field in fields[1:]:
+            row = row + "," + field
+        return (
+            select([func.coalesce(func.sum(row_checksum(row)), 0)])
+            .select_from(table)
+            .as_scalar()
+        )
+
+    transactions, splits = Transaction.__table__, Split.__table__
+    accounts, prices = Account.__table__, Price.__table__
+    commodities = Commodity.__table__
+
+    return select(
+        [
+            checksum(
+                transactions, "guid", "currency_guid", "num", "post_date", "description"
+            ),
+            checksum(
+                splits,
+                "guid",
+                "tx_guid",
+                "account_guid",
+                "memo",
+                "action",
+                "reconcile_state",
+                "reconcile_date",
+                "value_num",
+                "value_denom",
+                "quantity_num",
+                "quantity_denom",
+            ),
+            checksum(
+                accounts,
+                "guid",
+                "name",
+                "account_type",
+                "commodity_guid",
+                "commodity_scu",
+                "parent_guid",
+                "code",
+                "description",
+                "hidden",
+                "placeholder",
+            ),
+            checksum(
+                prices,
+                "guid",
+                "commodity_guid",
+                "currency_guid",
+                "date",
+                "source",
+                "value_num",
+                "value_denom",
+            ),
+            checksum(
+                commodities, "guid", "namespace", "mnemonic", "fullname", "fraction"
+            ),
+        ]
+    )
+
+
+class row_checksum(FunctionElement):
+    """32 bit checksum of a string, computed by the database.
+
+    Neither of the supported databases has a common function for this, so it is
+    compiled to `crc32` on MySQL, a part of `md5` on PostgreSQL and a Python function
+    registered on the connection computing `_checksum` on SQLite.
+
+    """
+
+    type = BigInteger()
+    name = "row_checksum"
+
+
+@compiles(row_checksum)
+def _compile_checksum(element, compiler, **kwargs):
+    """Compile `row_checksum` for SQLite."""
+    return f"gnc_crc32({compiler.process(element.clauses, **kwargs)})"
+
+
+@compiles(row_checksum, "mysql")
+def _compile_checksum_mysql(element, compiler, **kwargs):
+    """Compile `row_checksum` for MySQL."""
+    return f"crc32({compiler.process(element.clauses, **kwargs)})"
+
+
+@compiles(row_checksum, "postgresql")
+def _compile_checksum_postgresql(element, compiler, **kwargs):
+    """Compile `row_checksum` for PostgreSQL, as signed integer."""
+    argument = compiler.process(element.clauses, **kwargs)
+    return f"('x' || substr(md5({argument}), 1, 8))::bit(32)::int"
+
+
+def _crc32(string):
+    """Compute CRC-32 of a string, see `row_checksum`."""
+    return zlib.crc32(string.encode()) if string is not None else 0
+
+
+def track_changes(session):
+    """Invalidate cached values whenever changes are committed in the session.
+
+    Changes are also announced to other processes, see `.changes.ChangeFeed.publish`.
+
+    :param session: SQLAlchemy session of a book opened in writable mode
+
+    """
+
+    @event.listens_for(session, "after_commit")
+    def after_commit(session):
+        session.info.pop(VERSION_KEY, None)
+        entry = engines.find(session.bind)
+        if entry:
+            entry.cache["generation"] = entry.cache.get("generation", 0) + 1
+            entry.cache["modified"] = datetime.now(timezone.utc)
+        feed.publish()
+
+
+def cached(book, key, factory):
+    """Get value derived from the book, computing it only if the book has changed.
+
+    :param book: GnuCash book
+    :param key: Name of the cached value
+    :param factory: Function computing the value from the book
+    :returns: Cached or newly computed value
+
+    """
+    entry = engines.find(book.session.bind)
+    version = book_version(book)
+    if entry is None or book.session.info.get(UNCACHED_KEY):
+        return factory(book)
+
+    hit = entry.cache.get(key)
+    if hit is None or hit[0] != version:
+        hit = entry.cache[key] = (version, factory(book))
+    return hit[1]
+
+
+def cached_page(book, key, render, max_size):
+    """Get rendered page, rendering it only if the book has changed.
+
+    The most recently used `max_size` pages are kept for each pooled engine, i.e. per
+    database and set of credentials, see `cached_lru`.
+
+    :param book: GnuCash book
+    :param key: Hashable key identifying the page and all of its inputs except the book
+    :param render: Function without arguments rendering the page
+    :param max_size: Maximum number of cached pages
+    :returns: Cached or newly rendered page
+
+    """
+    return cached_lru(book, "pages", key, lambda book: render(), max_size)
+
+
+def cached_lru(book, bucket, key, factory, max_size):
+    """Get one of many values derived from the book, computing it only if necessary.
+
+    Unlike `cached`, this is meant for values depending on arbitrary parameters (such
+    as the date range of a report): Only the most recently used `max_size` values of
+    each bucket are kept for each pooled engine, and all of them are dropped when the
+    book changes.
+
+    :param book: GnuCash book
+    :param bucket: Name of the group of values sharing the size limit
+    :param key: Hashable key identifying the value within the bucket
+    :param factory: Function computing the value from the book
+    :param max_size: Maximum number of values in the bucket
+    :returns: Cached or newly computed value
+
+    """
+    entry = engines.find(book.session.bind)
+    key = (key, book_version(book))
+    if entry is None or max_size <= 0 or book.session.info.get(UNCACHED_KEY):
+        return factory(book)
+
+    with _lru_lock:
+        values = entry.cache.setdefault("lru", {}).setdefault(bucket, OrderedDict())
+        if key in values:
+            values.move_to_end(key)
+            return values[key]
+
+    value = factory(book)
+
+    with _lru_lock:
+        values[key] = value
+        while len(values) > max_size:
+            values.popitem(last=False)
+
+    return value
+
+
+def _drop_lru(entry):
+    """Forget the values cached by `cached_lru` for a database, they are outdated."""
+    with _lru_lock:
+        entry.cache.pop("lru", None)
+
+
+feed.subscribe(_drop_lru)
@@ -0,0 +1,228 @@
+"""Noticing changes to the book, across all processes serving it.
+
+Changes made by GnuCash Web are announced through a shared file: Every commit replaces
+the file, and every process compares its identity (inode and modification time) before
+trusting its caches. This costs a single `stat` per request and works for any number of
+gunicorn workers (or CLI invocations) on the same host or shared file system.
+
+Changes made by other programs, such as GnuCash itself, are noticed by polling a
+fingerprint of the book (see `.cache.book_version`), at most every `poll_interval`
+seconds per database. The fingerprint only consists of cheap aggregates, such as row
+counts, so it misses changes made in place (e.g. an edited amount). These are noticed
+by an optional checksum over the contents of the book, which reads every row and is
+therefore only computed every `checksum_interval` seconds, in a background thread.
+
+There is a single feed for the whole installation, i.e. a change announced for one
+database (or set of credentials) invalidates the caches of all of them. GnuCash Web
+serves a single book, so this only matters for the different credentials of its users,
+which all see the same data.
+"""
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+# Fingerprint of a database, as polled at `polled` (monotonic time)
+PollState = namedtuple("PollState", ["polled", "fingerprint"])
+
+# Checksum of a database, as computed at `computed` (monotonic time)
+ChecksumState = namedtuple("ChecksumState", ["computed", "checksum"])
+
+STATE_KEY = "change_feed"
+POLLING_KEY = "change_feed_polling"
+CHECKSUM_KEY = "change_feed_checksum"
+CHECKSUMMING_KEY = "change_feed_checksumming"
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeFeed:
+    """Shared record of changes to the book, see module documentation."""
+
+    def __init__(self, path=None, poll_interval=0, checksum_interval=0):
+        """Create change feed.
+
+        :param path: Path of the shared file, or `None` to only notice changes of this
+          process
+        :param poll_interval: Seconds during which a polled fingerprint is trusted, 0 to
+          poll once per session
+        :param checksum_interval: Seconds between checksums of the contents, 0 to never
+          compute them
+        :returns: New change feed
+
+        """
+        self.path = path
+        self.poll_interval = poll_interval
+        self.checksum_interval = checksum_interval
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def configure(self, path, poll_interval, checksum_interval=0):
+        """Change shared file and intervals, see `__init__`."""
+        self.path = path
+        self.poll_interval = poll_interval
+        self.checksum_interval = checksum_interval
+
+    def subscribe(self, callback):
+        """Call a function whenever the version of a database changes.
+
+        Subscribers are called lazily, by the first request noticing the change.
+
+        :param callback: Function taking the `.pool.PooledEngine` of the database
+
+        """
+        self._subscribers.append(callback)
+
+    def publish(self):
+        """Announce a change to all processes.
+
+        This is called after the change has been committed, so failures are only
+        logged: Other processes then notice the change by polling, see `version`.
+
+        """
+        if not self.path:
+            return
+
+        # Replace the file atomically, so its identity changes even within the
+        # resolution of modification times
+        directory = os.path.dirname(os.path.abspath(self.path))
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix=".changes-")
+            with os.fdopen(fd, "w") as f:
+                f.write(uuid.uuid4().hex)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.error(f"Could not announce change in {self.path}: {e}")
+            if tmp is not None and os.path.exists(tmp):
+                os.unlink(tmp)
+
+    def token(self):
+        """Get identity of the latest announced change.
+
+        :returns: Hashable token, or `None` if nothing was announced yet
+
+        """
+        if not self.path:
+            return None
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def age(self):
+        """Get the number of seconds since the latest announced change.
+
+        :returns: Seconds, or `None` if nothing was announced yet
+
+        """
+        token = self.token()
+        if token is None:
+            return None
+        return max(0, time.time() - token[1] / 1e9)
+
+    def version(self, entry, fingerprint, checksum=None):
+        """Get the version of a database.
+
+        Only one thread at a time polls the fingerprint of a database, the others use
+        the previous one meanwhile.
+
+        :param entry: `.pool.PooledEngine` of the database, or `None` if not pooled
+        :param fingerprint: Function without arguments, returning a tuple describing the
+          contents of the database
+        :param checksum: Function without arguments, returning a checksum of the
+          contents of the database, see `check`
+        :returns: Tuple of the number of changes made by (or noticed by a checksum of)
+          this process, the token of the shared file and the fingerprint
+
+        """
+        token = self.token()
+        if entry is None:
+            return (0, token, *fingerprint())
+
+        # A new token changes the version by itself, so polling can wait. This way, not
+        # every process computes the fingerprint after every change.
+        now = time.monotonic()
+        with self._lock:
+            state = entry.cache.get(STATE_KEY)
+            poll = state is None or (
+                now - state.polled >= self.poll_interval
+                and not entry.cache.get(POLLING_KEY)
+            )
+            if poll:
+                entry.cache[POLLING_KEY] = True
+
+        if poll:
+            try:
+                state = PollState(now, tuple(fingerprint()))
+            finally:
+                with self._lock:
+                    entry.cache[POLLING_KEY] = False
+
+        if checksum is not None:
+            self.check(entry, checksum)
+
+        version = (entry.cache.get("generation", 0), token, *state.fingerprint)
+
+        with self._lock:
+            previous = entry.cache.get("version")
+            entry.cache[STATE_KEY] = state
+            entry.cache["version"] = version
+        if previous is not None and previous != version:
+            for callback in self._subscribers:
+                callback(entry)
+
+        return version
+
+    def check(self, entry, checksum):
+        """Compute checksum of a database in the background, if it is due.
+
+        The checksum is computed at most every `checksum_interval` seconds and never by
+        two threads at once. If it differs from the previous one, the database was
+        changed in place, which is counted as a change made by this process.
+
+        :param entry: `.pool.PooledEngine` of the database
+        :param checksum: Function without arguments, returning the checksum, called in
+          a thread of its own
+
+        """
+        if self.checksum_interval <= 0:
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            state = entry.cache.get(CHECKSUM_KEY)
+            if entry.cache.get(CHECKSUMMING_KEY) or (
+                state is not None and now - state.computed < self.checksum_interval
+            ):
+                return
+            entry.cache[CHECKSUMMING_KEY] = True
+
+        threading.Thread(
+            target=self._compute_checksum,
+            args=(entry, checksum),
+            name="change-feed-checksum",
+            daemon=True,
+        ).start()
+
+    def _compute_checksum(self, entry, checksum):
+        """Compute checksum of a database and compare it to the previous one."""
+        previous = entry.cache.get(CHECKSUM_KEY)
+        try:
+            value = checksum()
+        except Exception as e:
+            logger.error(f"Could not compute checksum of the book: {e}")
+            value = previous.checksum if previous else None
+
+        with self._lock:
+            entry.cache[CHECKSUMMING_KEY] = False
+            entry.cache[CHECKSUM_KEY] = ChecksumState(time.monotonic(), value)
+            if previous is not None and previous.checksum != value:
+                entry.cache["generation"] = entry.cache.get("generation", 0) + 1
+
+
+feed = ChangeFeed()
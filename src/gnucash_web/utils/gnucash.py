@@ -2,12 +2,22 @@
 
 Mostly wrappers around piecash functions.
 """
+import shutil
 from contextlib import contextmanager
+from datetime import datetime
 
 from werkzeug.exceptions import NotFound, Locked
-from flask import request
+from flask import current_app, request
 import piecash
 import sqlalchemy
+from piecash.core.session import adapt_session, gnclock
+
+from .accounts import account_index
+from .cache import track_changes
+from .metrics import timed
+from .pool import engines
+from .replicas import replicas
+from .search import track_search_index
 
 
 class AccessDenied(Exception):
@@ -43,14 +53,28 @@ class DatabaseLocked(Locked):
 
 
 @contextmanager
-def open_book(*args, **kwargs):
+def open_book(
+    uri_conn, readonly=True, open_if_lock=None, do_backup=True, replica_uris=()
+):
     """Open GnuCash book in the configured database.
 
     Should be used as context manager.
 
-    Wraps around `piecash.open_book`. Parameters are passed to that function.
+    Does the same as `piecash.open_book`, but reuses a pooled engine for the given
+    database URI, so the database is only validated once per process and each call
+    only creates a new session.
+
+    Books opened in read-only mode are opened on one of the given replicas if
+    possible. Replicas that can not be opened are skipped for a while (see
+    `.replicas.ReplicaSet`), and the primary database is used if none is left.
 
+    :param uri_conn: Database URI, as returned by `GnuCashWebConfig.DB_URI`
+    :param readonly: Open the book in read-only mode
     :param open_if_lock: If not provided explicitly, this is read from `request.args`
+    :param do_backup: Copy database file before opening it in writable mode (sqlite
+      only)
+    :param replica_uris: Database URIs of read-only replicas of the database, as
+      returned by `GnuCashWebConfig.DB_REPLICA_URIS`
     :returns: The book
     :raises DatabaseLocked: If the databased is being accessed by someone else and
       `open_if_lock` is not `True`
@@ -58,12 +82,28 @@ def open_book(*args, **kwargs):
 
     """
     try:
-        if "open_if_lock" not in kwargs:
-            kwargs["open_if_lock"] = request.args.get(
-                "open_if_lock", default=False, type=bool
-            )
-
-        with piecash.open_book(*args, **kwargs) as book:
+        if open_if_lock is None:
+            open_if_lock = request.args.get("open_if_lock", default=False, type=bool)
+
+        book = None
+        for uri in replicas.candidates(replica_uris) if readonly else []:
+            try:
+                book = _open_session(uri, readonly, open_if_lock, do_backup)
+            except (piecash.GnucashException, sqlalchemy.exc.DBAPIError) as e:
+                if "Lock on the file" in str(e) or "Access denied" in str(e):
+                    raise
+                current_app.logger.warning(
+                    f"Replica {sqlalchemy.engine.url.make_url(uri)!r} failed: {e}"
+                )
+                replicas.failed(uri)
+            else:
+                replicas.succeeded(uri)
+                break
+
+        if book is None:
+            book = _open_session(uri_conn, readonly, open_if_lock, do_backup)
+
+        with book:
             yield book
 
     except piecash.GnucashException as e:
@@ -79,16 +119,91 @@ def open_book(*args, **kwargs):
             raise e
 
 
+def _open_session(uri_conn, readonly, open_if_lock, do_backup):
+    """Open GnuCash book in a new session of the pooled engine, see `open_book`.
+
+    :returns: The book, to be used as context manager
+
+    """
+    with timed("open_book"):
+        engine = engines.get(uri_conn)
+
+        if not readonly and do_backup:
+            _backup(engine.engine)
+
+        session = engine.session()
+        try:
+            # Ensure the database is not locked by GnuCash itself
+            if session.execute(gnclock.select()).first() and not open_if_lock:
+                raise piecash.GnucashException("Lock on the file")
+
+            book = session.query(piecash.Book).one()
+            adapt_session(session, book=book, readonly=readonly)
+            if not readonly:
+                track_changes(session)
+                track_search_index(session)
+        except BaseException:
+            session.close()
+            raise
+
+    return book
+
+
+def check_access(uri_conn):
+    """Check that the database can be accessed, without opening the book.
+
+    Uses the pooled engine for the database URI and only runs a trivial query, instead
+    of loading the book as done by `open_book`.
+
+    :param uri_conn: Database URI, as returned by `GnuCashWebConfig.DB_URI`
+    :raises AccessDenied: If access to the database is denied by the SQL server.
+
+    """
+    try:
+        with engines.get(uri_conn).engine.connect() as connection:
+            connection.execute(sqlalchemy.select([sqlalchemy.literal(1)])).scalar()
+    except sqlalchemy.exc.OperationalError as e:
+        if "Access denied" in str(e):
+            raise AccessDenied from e
+        else:
+            raise e
+
+
+def _backup(engine):
+    """Copy the database file, as done by `piecash.open_book` with `do_backup=True`.
+
+    :param engine: SQLAlchemy engine of the book
+    :raises GnucashException: If the engine is not backed by a sqlite file
+
+    """
+    if engine.name != "sqlite":
+        raise piecash.GnucashException(
+            f"Cannot do a backup for engine '{engine.name}'."
+            " Do yourself a backup and then specify do_backup=False"
+        )
+
+    path = engine.url.database
+    shutil.copyfile(path, f"{path}.{datetime.now():%Y%m%d%H%M%S}.gnucash")
+
+
 def get_account(book, *args, **kwargs):
     """Get account in the book based on given filters.
 
-    Wraps around `piecash.core.book.Book.accounts.all`. All parameters are passed to
-    that function.
+    Accounts are looked up by their full name in the account index of the book. Other
+    filters are passed to `piecash.core.book.Book.accounts.get`.
 
     :param book: The book containing the account.
-    :returns:
+    :returns: The account
+    :raises AccountNotFound: If there is no such account
 
     """
+    if set(kwargs) == {"fullname"} and not args:
+        try:
+            guid = account_index(book).by_fullname[kwargs["fullname"]].guid
+        except KeyError:
+            raise AccountNotFound(*args, **kwargs)
+        return book.session.query(piecash.Account).get(guid)
+
     try:
         return book.accounts.get(*args, **kwargs)
     except KeyError:
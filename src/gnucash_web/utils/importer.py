@@ -0,0 +1,203 @@
+"""Bulk import of simple two-split transactions."""
+import csv
+import io
+import json
+from collections import namedtuple
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from piecash import Account, Commodity, Split, Transaction
+
+from .accounts import account_index
+
+# Columns of CSV files (or keys of JSON objects) describing transactions, an optional
+# "num" may be given as well. A positive value is transferred from the contra account to
+# the account, as in the web form.
+FIELDS = ["date", "description", "value", "account", "contra_account"]
+
+ImportRow = namedtuple(
+    "ImportRow", ["date", "num", "description", "value", "account", "contra_account"]
+)
+ImportResult = namedtuple("ImportResult", ["row", "ok", "message", "guid"])
+
+
+class MalformedImport(ValueError):
+    """The file to be imported is malformed."""
+
+    pass
+
+
+def read_rows(stream, format):
+    """Read transactions from file.
+
+    :param stream: Text stream
+    :param format: Either `'csv'` (with header line) or `'json'` (list of objects)
+    :returns: List of dictionaries, one per transaction
+    :raises MalformedImport: If the file can not be parsed
+
+    """
+    try:
+        if format == "csv":
+            rows = list(csv.DictReader(stream))
+        elif format == "json":
+            rows = json.load(stream)
+        else:
+            raise MalformedImport(f"Unsupported format: {format}")
+    except (csv.Error, ValueError) as e:
+        raise MalformedImport(f"Invalid {format} file: {e}") from e
+
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise MalformedImport("Expected a list of transactions")
+
+    return rows
+
+
+def read_bytes(data, format):
+    """Read transactions from UTF-8 encoded bytes, e.g. an uploaded file.
+
+    :param data: The file content
+    :param format: See `read_rows`
+    :returns: List of dictionaries, one per transaction
+    :raises MalformedImport: If the file can not be parsed
+
+    """
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError as e:
+        raise MalformedImport(f"File is not UTF-8 encoded: {e}") from e
+
+    return read_rows(io.StringIO(text, newline=""), format)
+
+
+def validate(book, rows):
+    """Validate transactions without changing the database.
+
+    Only the account index and the list of currencies are looked up.
+
+    :param book: The book the transactions are to be imported into
+    :param rows: List of dictionaries, as returned by `read_rows`
+    :returns: Tuple of list of `ImportRow` (`None` for invalid rows) and list of
+      `ImportResult`, one for each row, with `ok` being `False` for invalid rows
+
+    """
+    index = account_index(book)
+    currencies = {
+        guid
+        for guid, in book.session.query(Commodity.guid).filter(
+            Commodity.namespace == "CURRENCY"
+        )
+    }
+    parsed, results = [], []
+
+    for number, row in enumerate(rows, start=1):
+        try:
+            missing = [
+                field
+                for field in FIELDS
+                if row.get(field) in (None, "") and field != "description"
+            ]
+            if missing:
+                raise ValueError(f"Missing field(s): {', '.join(missing)}")
+
+            account = index.by_fullname.get(row["account"])
+            contra_account = index.by_fullname.get(row["contra_account"])
+
+            for name, entry in [
+                (row["account"], account),
+                (row["contra_account"], contra_account),
+            ]:
+                if entry is None:
+                    raise ValueError(f"Account {name} not found")
+                if entry.placeholder:
+                    raise ValueError(f"{name} is a placeholder")
+
+            if account.commodity_guid != contra_account.commodity_guid:
+                raise ValueError(
+                    f"Incompatible accounts: {account.fullname} and {contra_account.fullname}"
+                    " have different commodities"
+                )
+            # The commodity becomes the currency of the transaction
+            if account.commodity_guid not in currencies:
+                raise ValueError(
+                    f"{account.fullname} is not in a currency, only transfers between"
+                    " accounts in the same currency can be imported"
+                )
+
+            try:
+                value = Decimal(str(row["value"]))
+            except InvalidOperation:
+                raise ValueError(f"Invalid value: {row['value']}")
+            if not value.is_finite():
+                raise ValueError(f"Invalid value: {row['value']}")
+
+            parsed.append(
+                ImportRow(
+                    date=date.fromisoformat(str(row["date"])),
+                    num=str(row.get("num") or ""),
+                    description=str(row.get("description") or ""),
+                    value=value,
+                    account=account,
+                    contra_account=contra_account,
+                )
+            )
+            results.append(ImportResult(number, True, "", None))
+        except (ValueError, TypeError) as e:
+            parsed.append(None)
+            results.append(ImportResult(number, False, str(e), None))
+
+    return parsed, results
+
+
+def import_transactions(book, rows, batch_size=500):
+    """Import transactions into the book.
+
+    All transactions are validated first. Only if all of them are valid, they are added
+    to the session, which is flushed every `batch_size` transactions. The changes are
+    not saved, the caller has to call `book.save()`, committing all transactions at
+    once.
+
+    :param book: The book, opened in writable mode
+    :param rows: List of dictionaries, as returned by `read_rows`
+    :param batch_size: Number of transactions added to the session between flushes
+    :returns: List of `ImportResult`, one for each row, with the GUID of the new
+      transaction if all rows were valid
+
+    """
+    parsed, results = validate(book, rows)
+    if not all(result.ok for result in results):
+        return results
+
+    guids = {row.account.guid for row in parsed} | {row.contra_account.guid for row in parsed}
+    accounts = {
+        account.guid: account
+        for account in book.session.query(Account).filter(Account.guid.in_(guids))
+    }
+
+    transactions = []
+    for number, row in enumerate(parsed, start=1):
+        account = accounts[row.account.guid]
+        contra_account = accounts[row.contra_account.guid]
+
+        transactions.append(
+            Transaction(
+                currency=account.commodity,
+                description=row.description,
+                num=row.num,
+                post_date=row.date,
+                splits=[
+                    Split(account=account, value=row.value),
+                    Split(account=contra_account, value=-row.value),
+                ],
+            )
+        )
+
+        if number % batch_size == 0:
+            book.flush()
+
+    book.flush()
+
+    # GUIDs are only assigned when flushing
+    return [
+        result._replace(guid=transaction.guid)
+        for result, transaction in zip(results, transactions)
+    ]
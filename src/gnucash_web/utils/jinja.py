@@ -1,14 +1,15 @@
 """Utilities for templates."""
 import re
-from urllib.parse import quote_plus
 from itertools import islice, accumulate
-from math import copysign
+from functools import lru_cache, partial
 
 from flask import url_for
-from babel import numbers
+from babel import numbers, Locale
 from markupsafe import Markup, escape
 from jinja2 import Environment, BaseLoader, pass_eval_context
 
+from .accounts import AccountEntry, account_index, contra_account_choices
+
 
 def safe_display_string(string):
     """Process string for HTML display.
@@ -38,15 +39,47 @@ def css_escape(name):
 
 
 def parent_accounts(account):
-    """Generate all parent accounts of the given account.
+    """Get all parent accounts of the given account.
 
     :param account: GnuCash account
-    :returns: Parent accounts
+    :returns: Parent accounts as `AccountEntry`, starting at the root account and
+      including the account itself
 
     """
     if account:
-        yield from parent_accounts(account.parent)
-        yield account
+        return account_index(account.book).ancestors(account.guid)
+    else:
+        return []
+
+
+# Compiled once, since compiling is much more expensive than rendering
+MONEY_SNIPPET = Environment(loader=BaseLoader()).from_string(
+    """
+      <span class="text-{% if amount >= 0 %}secondary{% else %}danger{% endif %}">
+        {{ value }}
+      </span>
+    """
+)
+
+
+@lru_cache(maxsize=None)
+def currency_formatter(mnemonic, locale=None):
+    """Get function to format amounts of a commodity according to a locale.
+
+    The returned functions are cached, so that the locale data and currency symbol are
+    only looked up once per commodity and locale.
+
+    :param mnemonic: Mnemonic of the commodity, e.g. `'EUR'`
+    :param locale: Babel locale identifier, defaults to the current locale
+    :returns: Function taking an amount and returning it as formatted string
+
+    """
+    locale = Locale.parse(locale or numbers.LC_NUMERIC)
+
+    if numbers.get_currency_symbol(mnemonic, locale=locale) != mnemonic:
+        return partial(numbers.format_currency, currency=mnemonic, locale=locale)
+    else:
+        return lambda amount: f"{amount} {mnemonic}"
 
 
 @pass_eval_context
@@ -59,49 +92,30 @@ def money(eval_ctx, amount, commodity):
     :returns: HTML snippet
 
     """
-    if numbers.get_currency_symbol(commodity.mnemonic) != commodity.mnemonic:
-        value = numbers.format_currency(amount, commodity.mnemonic)
-    else:
-        value = f"{amount} {commodity.mnemonic}"
+    value = currency_formatter(commodity.mnemonic)(amount)
 
     if eval_ctx.autoescape:
         value = escape(value)
 
-    return Markup(
-        Environment(loader=BaseLoader())
-        .from_string(
-            """
-      <span class="text-{% if amount >= 0 %}secondary{% else %}danger{% endif %}">
-        {{ value }}
-      </span>
-    """
-        )
-        .render(amount=amount, value=value)
-    )
+    return Markup(MONEY_SNIPPET.render(amount=amount, value=value))
 
 
-def account_url(account, *args, **kwargs):
+def account_url(account, /, *args, **kwargs):
     """Get URL to view the given account.
 
     Percent-encodes each account name individually (important when account name contains
     slashes) and then joins the components with slashes.
 
-    :param account: The target account
+    :param account: The target account, either a GnuCash account or `AccountEntry`
+    :param kwargs: Query parameters (which may include `account`)
     :returns: URL suitable for redirection ore use as hyperlink
 
     """
+    if not isinstance(account, AccountEntry):
+        account = account_index(account.book)[account.guid]
+
     return Markup(
-        url_for(
-            "book.show_account",
-            account_name="/".join(
-                quote_plus(account.name)
-                for account in islice(
-                    parent_accounts(account), 1, None
-                )  # Skip root account
-            ),
-            *args,
-            **kwargs,
-        )
+        url_for("book.show_account", account_name=account.path, *args, **kwargs)
     )
 
 
@@ -119,15 +133,13 @@ def full_account_names(account_name):
     """
     return accumulate(account_name.split(":"), lambda sup, sub: sup + ":" + sub)
 
-def contra_splits(split):
-    """Return list of splits on the other side of the given split in the transaction.
-
-    In other words, return all splits whose value has the opposite sign.
+def contra_accounts(account):
+    """Return accounts that can be selected as contra account for the given account.
 
-    :param split: Split in question
-    :returns: List of contra splits
+    :param account: GnuCash account
+    :returns: List of `AccountEntry`
     """
-    return [contra_split for contra_split in split.transaction.splits if copysign(split.value, contra_split.value) == -float(split.value) ]
+    return contra_account_choices(account)
 
 def nth(iterable, n, default=None):
     "Returns the nth item or a default value"
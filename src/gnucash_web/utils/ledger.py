@@ -0,0 +1,387 @@
+"""Database queries for the transaction ledger of an account."""
+from collections import namedtuple
+from decimal import Decimal
+from functools import reduce
+from math import gcd
+
+from piecash import Split, Transaction
+from piecash.core.account import positive_types
+from sqlalchemy import and_, case, func, or_, select
+from sqlalchemy.orm import contains_eager, object_session
+
+from .accounts import account_index
+from .cache import cached
+from .search import filter_ledger
+from .writes import transaction_version
+
+LedgerRow = namedtuple(
+    "LedgerRow",
+    [
+        "guid",
+        "version",
+        "description",
+        "post_date",
+        "num",
+        "currency",
+        "value",
+        "sign",
+        "contra_accounts",
+        "splits",
+        "multi_split",
+        "converting",
+        "running_balance",
+    ],
+)
+LedgerRow.__doc__ = """View model of a split in the ledger, see `ledger_rows`.
+
+`guid`, `description`, `post_date`, `num` and `currency` are those of the transaction,
+`version` its fingerprint (see `.writes.transaction_version`),
+`value` the value of the split and `sign` its sign (1 or -1). `contra_accounts` are the
+`.accounts.AccountEntry` of the splits on the other side of the transaction, `splits`
+are `SplitRow` for all splits of the transaction. Transactions with more than two
+splits (`multi_split`) or a contra account in a different commodity (`converting`)
+can not be edited in the web interface.
+"""
+
+SplitRow = namedtuple("SplitRow", ["account", "value", "current"])
+SplitRow.__doc__ = """Split of a transaction in the ledger.
+
+`account` is an `.accounts.AccountEntry` and `current` tells whether this is the split
+in the account of the ledger.
+"""
+
+
+def ledger_order():
+    """Get the order of splits in the ledger, newest first.
+
+    The split GUID is only included to get a total, stable order.
+
+    :returns: Tuple of SQLAlchemy order by clauses
+
+    """
+    return (
+        Transaction._post_date.desc(),
+        Transaction.num.desc(),
+        Transaction.enter_date.desc(),
+        Split.guid.desc(),
+    )
+
+
+def count_splits(account, search=None):
+    """Count the splits in an account.
+
+    :param account: GnuCash account
+    :param search: Only count splits matching this `.search.SearchFilter`
+    :returns: Number of splits in the account (not including subaccounts)
+
+    """
+    query = (
+        object_session(account)
+        .query(func.count(Split.guid))
+        .filter(Split.account_guid == account.guid)
+    )
+
+    if search is not None and any(search):
+        query = filter_ledger(
+            query.join(Split.transaction), search, account_index(account.book)
+        )
+
+    return query.scalar()
+
+
+def ledger_page(account, page, page_length, search=None):
+    """Get a single page of splits in the ledger of an account.
+
+    Sorting, filtering and pagination is done by the database. Only the splits on the
+    requested page are loaded, together with their transaction, the other splits of
+    that transaction and their accounts.
+
+    :param account: GnuCash account
+    :param page: Page number, starting at 1
+    :param page_length: Number of splits per page
+    :param search: Only include splits matching this `.search.SearchFilter`
+    :returns: List of splits, newest first
+
+    """
+    session = object_session(account)
+
+    # Find splits on the page without loading any ORM objects first, so that large
+    # offsets only skip over index entries instead of fully loaded rows
+    query = (
+        session.query(Split.guid)
+        .join(Split.transaction)
+        .filter(Split.account_guid == account.guid)
+    )
+
+    if search is not None and any(search):
+        query = filter_ledger(query, search, account_index(account.book))
+
+    guids = [
+        guid
+        for guid, in query.order_by(*ledger_order())
+        .limit(page_length)
+        .offset((page - 1) * page_length)
+    ]
+
+    return _load_splits(session, guids)
+
+
+def ledger_splits(account, after=None, limit=None):
+    """Get splits in the ledger of an account, using keyset pagination.
+
+    Instead of an offset, the position in the ledger is given by the last split already
+    seen, so that the database can seek directly to the next split regardless of how
+    far into the ledger it is.
+
+    :param account: GnuCash account
+    :param after: GUID of the split after which to start, or `None` to start at the
+      newest split
+    :param limit: Maximum number of splits
+    :returns: List of splits, newest first
+
+    """
+    session = object_session(account)
+
+    query = (
+        session.query(Split.guid)
+        .join(Split.transaction)
+        .filter(Split.account_guid == account.guid)
+    )
+
+    if after is not None:
+        columns = (Transaction._post_date, Transaction.num, Transaction.enter_date, Split.guid)
+
+        # Compare to the values stored in the database, not to their Python
+        # representation, which may not round-trip exactly (e.g. post dates)
+        key = [
+            select([column])
+            .select_from(Split.__table__.join(Transaction.__table__))
+            .where(Split.guid == after)
+            .as_scalar()
+            for column in columns
+        ]
+
+        # Same as `tuple(columns) < tuple(key)`, which not all databases support
+        query = query.filter(
+            or_(
+                *(
+                    and_(
+                        *(column == value for column, value in zip(columns[:i], key)),
+                        columns[i] < key[i],
+                    )
+                    for i in range(len(columns))
+                )
+            )
+        )
+
+    query = query.order_by(*ledger_order()).limit(limit)
+
+    return _load_splits(session, [guid for guid, in query])
+
+
+def running_balances(account, page, page_length, splits):
+    """Get the balance of the account after each split on a ledger page.
+
+    The balance before the newest split on the page is taken from checkpoints, the sums
+    of the newest splits at every multiple of `page_length`. They are computed by the
+    database (see `_load_checkpoints`) and cached as long as the book does not change,
+    so that every page costs the same, no matter how far back in the ledger it is.
+
+    :param account: GnuCash account
+    :param page: Page number, starting at 1
+    :param page_length: Number of splits per page
+    :param splits: Splits on the page, as returned by `ledger_page`
+    :returns: List of balances with natural sign, one for each split
+
+    """
+    total, checkpoints = cached(
+        account.book,
+        f"ledger_checkpoints:{account.guid}:{page_length}",
+        lambda book: _load_checkpoints(account, page_length),
+    )
+    sign = 1 if account.type in positive_types else -1
+
+    balance = total - checkpoints[page - 1]
+    balances = []
+    for split in splits:
+        balances.append(sign * balance)
+        balance -= split.quantity
+    return balances
+
+
+def ledger_rows(account, splits, balances=None):
+    """Build view models for splits in the ledger of an account.
+
+    Everything the ledger template needs is computed once per split, so rendering does
+    not traverse any relationships. The splits should be loaded by `ledger_page` or
+    `ledger_splits`, which also load all other splits of their transactions.
+
+    :param account: GnuCash account of the ledger
+    :param splits: Splits in the account
+    :param balances: Running balances, one for each split, or `None`
+    :returns: List of `LedgerRow`
+
+    """
+    index = account_index(account.book)
+    if balances is None:
+        balances = [None] * len(splits)
+
+    rows = []
+    for split, balance in zip(splits, balances):
+        transaction = split.transaction
+        negative = split.value < 0
+
+        # The other side of the transaction are all splits with opposite sign
+        contra_accounts = [
+            index[other.account_guid]
+            for other in transaction.splits
+            if split.value == 0 or (other.value < 0) != negative
+        ]
+
+        rows.append(
+            LedgerRow(
+                guid=transaction.guid,
+                version=transaction_version(transaction),
+                description=transaction.description,
+                post_date=transaction.post_date,
+                num=transaction.num,
+                currency=transaction.currency,
+                value=split.value,
+                sign=-1 if negative else 1,
+                contra_accounts=contra_accounts,
+                splits=[
+                    SplitRow(index[other.account_guid], other.value, other is split)
+                    for other in transaction.splits
+                ],
+                multi_split=len(transaction.splits) > 2,
+                converting=bool(contra_accounts)
+                and contra_accounts[0].commodity_guid != account.commodity_guid,
+                running_balance=balance,
+            )
+        )
+
+    return rows
+
+
+def _load_checkpoints(account, page_length):
+    """Sum up the newest splits in the ledger at every multiple of `page_length`.
+
+    The sums are computed by the database, as a running sum over the ledger of which
+    only every `page_length`-th row is returned. To sum exactly, the quantities are
+    scaled to their least common denominator. Databases without window functions
+    (SQLite before 3.25, MySQL before 8 and MariaDB before 10.2) return all splits
+    instead, which are summed up here.
+
+    :param account: GnuCash account
+    :param page_length: Number of splits per page
+    :returns: Tuple of the total amount of the account and list of checkpoints, the
+      sum of the quantities of the newest `i * page_length` splits at index `i`
+
+    """
+    session = object_session(account)
+    if not _has_window_functions(session.bind.dialect):
+        return _sum_checkpoints(account, page_length)
+
+    # Usually, all splits of an account share the fraction of its commodity
+    sums = (
+        session.query(Split._quantity_denom, func.sum(Split._quantity_num))
+        .filter(Split.account_guid == account.guid)
+        .group_by(Split._quantity_denom)
+        .all()
+    )
+    if not sums:
+        return Decimal(0), [Decimal(0)]
+
+    denom = reduce(_lcm, (denom for denom, _ in sums))
+    total = sum(Decimal(num) * (denom // split_denom) for split_denom, num in sums)
+
+    scaled = Split._quantity_num * case(
+        {split_denom: denom // split_denom for split_denom, _ in sums},
+        value=Split._quantity_denom,
+    )
+    ledger = (
+        session.query(
+            func.row_number().over(order_by=ledger_order()).label("position"),
+            func.sum(scaled)
+            .over(order_by=ledger_order(), rows=(None, 0))
+            .label("running_sum"),
+        )
+        .join(Split.transaction)
+        .filter(Split.account_guid == account.guid)
+        .subquery()
+    )
+    query = (
+        session.query(ledger.c.running_sum)
+        .filter(ledger.c.position % page_length == 0)
+        .order_by(ledger.c.position)
+    )
+
+    checkpoints = [Decimal(0)] + [Decimal(num) / denom for num, in query]
+    return total / denom, checkpoints
+
+
+def _sum_checkpoints(account, page_length):
+    """Sum up the newest splits at every multiple of `page_length` while loading them.
+
+    Same as `_load_checkpoints`, for databases without window functions.
+
+    """
+    total, checkpoints = Decimal(0), [Decimal(0)]
+    query = (
+        object_session(account)
+        .query(Split._quantity_num, Split._quantity_denom)
+        .join(Split.transaction)
+        .filter(Split.account_guid == account.guid)
+        .order_by(*ledger_order())
+    )
+
+    for position, (num, denom) in enumerate(query, start=1):
+        total += Decimal(num) / Decimal(denom)
+        if position % page_length == 0:
+            checkpoints.append(total)
+
+    return total, checkpoints
+
+
+def _has_window_functions(dialect):
+    """Check whether the database supports window functions (`OVER`).
+
+    :param dialect: SQLAlchemy dialect of a connected engine
+    :returns: `True` if window functions are supported
+
+    """
+    version = dialect.server_version_info or ()
+    if dialect.name == "sqlite":
+        return version >= (3, 25)
+    elif dialect.name == "mysql":
+        return version >= ((10, 2) if dialect._is_mariadb else (8,))
+    return True
+
+
+def _lcm(a, b):
+    """Least common multiple of two positive integers."""
+    return a * b // gcd(a, b)
+
+
+def _load_splits(session, guids):
+    """Load splits, including their transaction, its currency and all its splits.
+
+    :param session: SQLAlchemy session of the book
+    :param guids: GUIDs of the splits
+    :returns: List of splits, in ledger order
+
+    """
+    if not guids:
+        return []
+
+    return (
+        session.query(Split)
+        .join(Split.transaction)
+        .filter(Split.guid.in_(guids))
+        .options(
+            contains_eager(Split.transaction).selectinload(Transaction.splits),
+            contains_eager(Split.transaction).joinedload(Transaction.currency),
+        )
+        .order_by(*ledger_order())
+        .all()
+    )
@@ -0,0 +1,187 @@
+"""Measuring where time goes in a request: SQL statements, named phases, latencies."""
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from flask import g, has_request_context
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class RequestMetrics:
+    """Measurements of a single request."""
+
+    __slots__ = ("start", "sql_count", "sql_time", "timings", "profile")
+
+    def __init__(self):
+        """Start measuring.
+
+        :returns: New measurements
+
+        """
+        self.start = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.timings = defaultdict(float)
+        self.profile = None
+
+    def elapsed(self):
+        """Get seconds since the start of the request."""
+        return time.perf_counter() - self.start
+
+
+def start_request():
+    """Start measuring the current request, see `current_metrics`.
+
+    :returns: `RequestMetrics`
+
+    """
+    g.metrics = RequestMetrics()
+    return g.metrics
+
+
+def current_metrics():
+    """Get measurements of the current request.
+
+    :returns: `RequestMetrics`, or `None` outside of requests or if instrumentation is
+      disabled
+
+    """
+    return g.get("metrics") if has_request_context() else None
+
+
+@contextmanager
+def timed(name):
+    """Add time spent in the block to a phase of the current request.
+
+    Does nothing if the request is not measured.
+
+    :param name: Name of the phase, e.g. `'render'`
+
+    """
+    metrics = current_metrics()
+    if metrics is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.timings[name] += time.perf_counter() - start
+
+
+class TimedTemplate(Template):
+    """Jinja template recording its rendering time as phase `render`.
+
+    Included templates are rendered as part of the including one, so they are not
+    counted separately.
+
+    """
+
+    def render(self, *args, **kwargs):
+        """Render template, see `jinja2.Template.render`."""
+        with timed("render"):
+            return super().render(*args, **kwargs)
+
+
+# The start time is kept on the execution context, which is discarded together with
+# statements that fail, instead of piling up on the pooled connection.
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._gnc_query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.sql_count += 1
+        start = getattr(context, "_gnc_query_start", None)
+        if start is not None:
+            metrics.sql_time += time.perf_counter() - start
+
+
+def instrument_sql():
+    """Count SQL statements and their duration for all engines.
+
+    Safe to be called more than once.
+
+    """
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class Histogram:
+    """Prometheus-style histogram of observed values per set of labels."""
+
+    def __init__(self, name, description, label_names, buckets=LATENCY_BUCKETS):
+        """Create empty histogram.
+
+        :param name: Metric name
+        :param description: Help text of the metric
+        :param label_names: Names of the labels, in order
+        :param buckets: Upper bounds of the buckets, ascending
+        :returns: New histogram
+
+        """
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        """Record a value.
+
+        :param labels: Tuple of label values, matching `label_names`
+        :param value: Observed value
+
+        """
+        with self._lock:
+            buckets, total, count = self._series.get(
+                labels, ([0] * len(self.buckets), 0.0, 0)
+            )
+            # Buckets are cumulative, as in the exposition format
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    buckets[i] += 1
+            self._series[labels] = (buckets, total + value, count + 1)
+
+    def samples(self):
+        """Get all samples in Prometheus text exposition format.
+
+        :returns: List of lines
+
+        """
+        with self._lock:
+            series = sorted(
+                (labels, list(buckets), total, count)
+                for labels, (buckets, total, count) in self._series.items()
+            )
+
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for labels, buckets, total, count in series:
+            label_text = ",".join(
+                f'{name}="{_escape_label(value)}"'
+                for name, value in zip(self.label_names, labels)
+            )
+            for bound, bucket in zip(self.buckets, buckets):
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {bucket}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {count}")
+        return lines
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,223 @@
+"""Process-wide pool of database engines.
+
+`piecash.open_book` creates a new SQLAlchemy engine, checks that the database exists
+and validates the GnuCash table versions every time it is called. None of this changes
+between requests, so we do it once per database URI (i.e. per set of credentials) and
+keep the engine around. Every request then only checks out a new session from the
+pooled engine.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from piecash import GnucashException
+from piecash.core.session import Version, version_supported
+from piecash.sa_extra import create_piecash_engine, Session
+from sqlalchemy_utils import database_exists
+
+
+class PooledEngine:
+    """A SQLAlchemy engine connected to a validated GnuCash database."""
+
+    def __init__(self, uri):
+        """Create engine and validate the GnuCash database behind it.
+
+        :param uri: Database URI, as returned by `GnuCashWebConfig.DB_URI`
+        :returns: New pooled engine
+        :raises GnucashException: If the database does not exist
+        :raises ValueError: If the table versions are not supported by piecash
+
+        """
+        if not database_exists(uri):
+            raise GnucashException(f"Database '{uri}' does not exist")
+
+        self.uri = uri
+        self.engine = create_piecash_engine(
+            uri, **({} if uri.startswith("sqlite") else {"pool_pre_ping": True})
+        )
+        self.last_used = time.monotonic()
+
+        # Arbitrary per-engine data, such as caches, that lives as long as the engine
+        self.cache = {}
+
+        try:
+            self._check_versions()
+        except Exception:
+            self.dispose()
+            raise
+
+    def session(self):
+        """Create a new session bound to this engine.
+
+        :returns: SQLAlchemy session, to be adapted with `piecash.core.session.adapt_session`
+
+        """
+        self.last_used = time.monotonic()
+        return Session(bind=self.engine)
+
+    def _check_versions(self):
+        """Make sure the table versions in the database are supported.
+
+        Same check as performed by `piecash.open_book`.
+
+        :raises ValueError: If the table versions are not supported by piecash
+
+        """
+        session = Session(bind=self.engine)
+        try:
+            version_book = {
+                v.table_name: v.table_version
+                for v in session.query(Version).all()
+                if "Gnucash" not in v.table_name
+            }
+        finally:
+            session.close()
+
+        for version, vt in version_supported.items():
+            if version_book == {k: v for k, v in vt.items() if "Gnucash" not in k}:
+                break
+        else:
+            raise ValueError("Unsupported table versions")
+
+        if version not in ("3.0", "3.7", "4.1"):
+            raise ValueError(f"Unsupported GnuCash version {version}")
+
+    def dispose(self):
+        """Close all connections of this engine."""
+        self.engine.dispose()
+
+
+class EnginePool:
+    """Bounded pool of `PooledEngine` objects, keyed by database URI.
+
+    Least recently used engines are disposed of when the pool is full, and engines not
+    used for some time are disposed of as well.
+
+    """
+
+    def __init__(self, max_size=8, idle_timeout=600):
+        """Create empty pool.
+
+        :param max_size: Maximum number of engines kept at the same time
+        :param idle_timeout: Seconds after which an unused engine is disposed of
+        :returns: New pool
+
+        """
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._pid = os.getpid()
+
+        # Engines inherited from a parent process. See `reset`.
+        self._orphans = []
+
+    def configure(self, max_size, idle_timeout):
+        """Change size limits of the pool.
+
+        :param max_size: Maximum number of engines kept at the same time
+        :param idle_timeout: Seconds after which an unused engine is disposed of
+
+        """
+        with self._lock:
+            self.max_size = max_size
+            self.idle_timeout = idle_timeout
+            self._evict()
+
+    def get(self, uri):
+        """Get engine for the database URI, creating it if necessary.
+
+        :param uri: Database URI
+        :returns: Pooled engine
+        :raises GnucashException: If the database does not exist
+        :raises sqlalchemy.exc.OperationalError: If the database can not be accessed
+
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self.reset()
+            self._evict()
+
+            entry = self._entries.get(uri)
+            if entry is not None:
+                self._entries.move_to_end(uri)
+                entry.last_used = time.monotonic()
+                return entry
+
+        # Connecting may take a while (or time out), so do not block other requests
+        new_entry = PooledEngine(uri)
+
+        with self._lock:
+            entry = self._entries.setdefault(uri, new_entry)
+            self._evict()
+
+        if entry is not new_entry:
+            # Someone else was faster
+            new_entry.dispose()
+
+        return entry
+
+    def find(self, engine):
+        """Get the pooled engine wrapping a SQLAlchemy engine.
+
+        :param engine: SQLAlchemy engine, e.g. `book.session.bind`
+        :returns: Pooled engine or `None`, if the engine is not (or no longer) pooled
+
+        """
+        with self._lock:
+            for entry in self._entries.values():
+                if entry.engine is engine:
+                    return entry
+
+    def discard(self, uri):
+        """Remove engine for the database URI from the pool, if it exists.
+
+        :param uri: Database URI
+
+        """
+        with self._lock:
+            entry = self._entries.pop(uri, None)
+        if entry is not None:
+            entry.dispose()
+
+    def dispose(self):
+        """Dispose of all engines in the pool."""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            entry.dispose()
+
+    def reset(self):
+        """Forget all engines after the process has been forked.
+
+        The connections of inherited engines belong to the parent process. Closing them
+        (even implicitly, by garbage collecting the engine) would close them for the
+        parent as well, so we keep a reference to them and never touch them again.
+
+        """
+        with self._lock:
+            self._orphans.extend(self._entries.values())
+            self._entries.clear()
+            self._pid = os.getpid()
+
+    def _evict(self):
+        """Dispose of idle engines and engines exceeding the pool size."""
+        now = time.monotonic()
+        evicted = [
+            uri
+            for uri, entry in self._entries.items()
+            if now - entry.last_used > self.idle_timeout
+        ]
+        evicted += list(self._entries)[: max(0, len(self._entries) - self.max_size)]
+
+        for uri in set(evicted):
+            self._entries.pop(uri).dispose()
+
+
+engines = EnginePool()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=engines.reset)
@@ -0,0 +1,347 @@
+"""Commodity prices: In-memory index of known prices and fetching of new ones."""
+import threading
+import time
+import zlib
+from bisect import bisect_right
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from piecash import Commodity, Price
+from piecash.core.commodity import download_quote, get_latest_quote, quandl_fx
+import pytz
+
+from .cache import cached
+
+# A commodity to fetch prices for. `base_currency` is the mnemonic of the currency
+# exchange rates are fetched in (only for currencies), prices are fetched starting at
+# `start_date`.
+QuoteRequest = namedtuple(
+    "QuoteRequest", ["namespace", "mnemonic", "base_currency", "start_date"]
+)
+
+# A fetched price, `currency` is the mnemonic of the currency the price is expressed in
+Quote = namedtuple("Quote", ["date", "value", "currency", "type"])
+
+# A known price, as stored in the book
+PricePoint = namedtuple(
+    "PricePoint",
+    [
+        "date",
+        "value",
+        "commodity_guid",
+        "currency_guid",
+        "currency_mnemonic",
+        "source",
+    ],
+)
+
+
+class PriceIndex:
+    """Index of all prices in a book, built from a single query.
+
+    Prices are kept in series sorted by date, both per commodity and per pair of
+    commodity and currency, so that the latest price or the price at a given date can be
+    found by binary search.
+
+    """
+
+    def __init__(self, prices):
+        """Build index.
+
+        :param prices: Iterable of `PricePoint`, sorted by date
+        :returns: New index
+
+        """
+        self._by_commodity = defaultdict(list)
+        self._by_pair = defaultdict(list)
+        for price in prices:
+            self._by_commodity[price.commodity_guid].append(price)
+            self._by_pair[price.commodity_guid, price.currency_guid].append(price)
+
+        self._dates = {
+            key: [price.date for price in series]
+            for series_by_key in (self._by_commodity, self._by_pair)
+            for key, series in series_by_key.items()
+        }
+
+    @classmethod
+    def load(cls, book):
+        """Build index of all prices in the book.
+
+        :param book: GnuCash book
+        :returns: New index
+
+        """
+        mnemonics = dict(book.session.query(Commodity.guid, Commodity.mnemonic))
+        return cls(
+            PricePoint(
+                date=price_date,
+                value=Decimal(num) / Decimal(denom),
+                commodity_guid=commodity,
+                currency_guid=currency,
+                currency_mnemonic=mnemonics.get(currency),
+                source=source,
+            )
+            for price_date, num, denom, commodity, currency, source in book.session.query(
+                Price.date,
+                Price._value_num,
+                Price._value_denom,
+                Price.commodity_guid,
+                Price.currency_guid,
+                Price.source,
+            ).order_by(Price.date)
+        )
+
+    def latest(self, commodity_guid, at=None):
+        """Get the latest price of a commodity, in any currency.
+
+        :param commodity_guid: GUID of the commodity
+        :param at: Get the latest price on or before this date, defaults to the latest
+          price overall
+        :returns: `PricePoint` or `None` if there is no price
+
+        """
+        series = self._by_commodity.get(commodity_guid)
+        if not series:
+            return None
+        if at is None:
+            return series[-1]
+
+        position = bisect_right(self._dates[commodity_guid], at)
+        return series[position - 1] if position else None
+
+    def price(self, commodity_guid, currency_guid, at=None):
+        """Get the price of a commodity in a currency.
+
+        :param commodity_guid: GUID of the commodity
+        :param currency_guid: GUID of the currency
+        :param at: Get the latest price on or before this date, defaults to the latest
+          price overall
+        :returns: `PricePoint` or `None` if there is no such price
+
+        """
+        series = self._by_pair.get((commodity_guid, currency_guid))
+        if not series:
+            return None
+        if at is None:
+            return series[-1]
+
+        position = bisect_right(self._dates[commodity_guid, currency_guid], at)
+        return series[position - 1] if position else None
+
+    def rate(self, commodity_guid, currency_guid, at=None):
+        """Get factor to convert an amount of a commodity to a currency.
+
+        Uses the price of the commodity in the currency, or the inverse of the price of
+        the currency in the commodity.
+
+        :param commodity_guid: GUID of the commodity
+        :param currency_guid: GUID of the currency
+        :param at: Use the latest prices on or before this date, defaults to the latest
+          prices overall
+        :returns: Conversion factor or `None` if there is no suitable price
+
+        """
+        if commodity_guid == currency_guid:
+            return Decimal(1)
+
+        price = self.price(commodity_guid, currency_guid, at)
+        if price is not None:
+            return price.value
+
+        inverse = self.price(currency_guid, commodity_guid, at)
+        if inverse is not None and inverse.value:
+            return 1 / inverse.value
+
+
+def price_index(book):
+    """Get the price index of the book.
+
+    The index is cached as long as the book does not change.
+
+    :param book: GnuCash book
+    :returns: Price index
+
+    """
+    return cached(book, "price_index", PriceIndex.load)
+
+
+class QuoteProvider:
+    """Source of online prices.
+
+    Subclasses implement `fetch` and may group requests by `source` for rate limiting.
+    Providers are used from multiple threads at once and must not access the book.
+
+    """
+
+    def source(self, request):
+        """Get name of the service used to answer a request.
+
+        :param request: The `QuoteRequest`
+        :returns: Name of the service
+
+        """
+        return type(self).__name__
+
+    def fetch(self, request):
+        """Fetch prices of a commodity.
+
+        :param request: The `QuoteRequest`
+        :returns: List of `Quote`
+
+        """
+        raise NotImplementedError
+
+
+class PiecashQuoteProvider(QuoteProvider):
+    """Fetch prices the same way as `piecash.core.commodity.Commodity.update_prices`.
+
+    Exchange rates are retrieved from Quandl, all other prices from Yahoo Finance.
+
+    """
+
+    def source(self, request):
+        """Get name of the service used to answer a request, see `QuoteProvider`."""
+        return "quandl" if request.namespace == "CURRENCY" else "yahoo"
+
+    def fetch(self, request):
+        """Fetch prices of a commodity, see `QuoteProvider`."""
+        if request.namespace == "CURRENCY":
+            return [
+                Quote(
+                    date=datetime.strptime(quote.date, "%Y-%m-%d").date(),
+                    value=Decimal(str(quote.rate)),
+                    currency=request.base_currency,
+                    type="unknown",
+                )
+                for quote in quandl_fx(
+                    request.mnemonic, request.base_currency, request.start_date
+                )
+            ]
+        else:
+            share = get_latest_quote(request.mnemonic)
+            return [
+                Quote(
+                    date=quote.date,
+                    value=quote.close,
+                    currency=share.currency,
+                    type="last",
+                )
+                for quote in download_quote(
+                    request.mnemonic,
+                    request.start_date,
+                    date.today(),
+                    pytz.timezone(share.timezone),
+                )
+            ]
+
+
+class StubQuoteProvider(QuoteProvider):
+    """Offline provider of made-up prices, for tests and benchmarks.
+
+    Every commodity gets one price per day from the requested start date until today.
+    Exchange rates are expressed in the base currency of the request, all other prices
+    in `currency`. Prices are derived from the mnemonic, so every run gets the same.
+
+    """
+
+    currency = "EUR"
+
+    def source(self, request):
+        """Get name of the service used to answer a request, see `QuoteProvider`."""
+        return "stub-fx" if request.namespace == "CURRENCY" else "stub"
+
+    def fetch(self, request):
+        """Fetch prices of a commodity, see `QuoteProvider`."""
+        base = Decimal(zlib.crc32(request.mnemonic.encode()) % 10000 + 100) / 100
+        days = (date.today() - request.start_date).days + 1
+        return [
+            Quote(
+                date=request.start_date + timedelta(days=day),
+                value=base + Decimal(day) / 100,
+                currency=request.base_currency or self.currency,
+                type="unknown" if request.namespace == "CURRENCY" else "last",
+            )
+            for day in range(max(days, 0))
+        ]
+
+
+class RateLimiter:
+    """Limit the rate of calls, shared between threads."""
+
+    def __init__(self, rate):
+        """Create rate limiter.
+
+        :param rate: Maximum number of calls per second, or 0 for no limit
+        :returns: New rate limiter
+
+        """
+        self.interval = 1 / rate if rate else 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until the next call is allowed."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        time.sleep(slot - now)
+
+
+def fetch_quotes(provider, requests, max_workers=8, rate=2):
+    """Fetch prices for many commodities concurrently.
+
+    :param provider: The `QuoteProvider`
+    :param requests: Iterable of `QuoteRequest`
+    :param max_workers: Maximum number of concurrent requests
+    :param rate: Maximum number of requests per second to each source, or 0 for no
+      limit
+    :returns: Dictionary mapping each request to either a list of `Quote` or the
+      exception raised while fetching it
+
+    """
+    limiters = {}
+
+    def fetch(request):
+        limiter = limiters.setdefault(provider.source(request), RateLimiter(rate))
+        limiter.wait()
+        try:
+            return provider.fetch(request)
+        except Exception as e:
+            return e
+
+    requests = list(requests)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(requests, executor.map(fetch, requests)))
+
+
+def quote_request(commodity, latest_price, start_date=None):
+    """Build request for new prices of a commodity.
+
+    As in `piecash.core.commodity.Commodity.update_prices`, prices are requested from
+    the day after the latest known price, but at most for the last week.
+
+    :param commodity: The commodity
+    :param latest_price: Latest known price of the commodity, or `None`
+    :param start_date: Request prices from this day on, defaults to a week ago
+    :returns: `QuoteRequest`
+
+    """
+    start_date = start_date or date.today() - timedelta(days=7)
+    if latest_price:
+        start_date = max(latest_price.date + timedelta(days=1), start_date)
+
+    return QuoteRequest(
+        namespace=commodity.namespace,
+        mnemonic=commodity.mnemonic,
+        base_currency=(
+            commodity.base_currency.mnemonic
+            if commodity.namespace == "CURRENCY"
+            else None
+        ),
+        start_date=start_date,
+    )
+
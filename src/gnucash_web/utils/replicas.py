@@ -0,0 +1,99 @@
+"""Health of read-only replicas of the GnuCash database.
+
+Read-only views may open the book on a replica instead of the primary database (see
+`.gnucash.open_book`). Replicas are used in turn, to spread the load. A replica that
+could not be opened is skipped for a while, after which a single request tries it
+again. If no replica can be used, the primary database is.
+
+Replicas may lag behind the primary database. For `lag` seconds after a change, data
+read from a replica is therefore not cached (see `.cache.book_version`).
+"""
+import itertools
+import threading
+import time
+
+
+class ReplicaSet:
+    """Process-wide record of failed replicas, keyed by database URI."""
+
+    def __init__(self, retry_after=30, lag=5):
+        """Create record without failures.
+
+        :param retry_after: Seconds for which a failed replica is skipped
+        :param lag: Seconds replicas may take to catch up with a change
+        :returns: New replica set
+
+        """
+        self.retry_after = retry_after
+        self.lag = lag
+
+        # All replicas used so far
+        self._uris = set()
+
+        # Failed replicas, mapped to the time until which they are skipped
+        self._down = {}
+        self._lock = threading.Lock()
+        self._turn = itertools.count()
+
+    def configure(self, retry_after, lag):
+        """Change time for which failed replicas are skipped and lag, see `__init__`."""
+        self.retry_after = retry_after
+        self.lag = lag
+
+    def is_replica(self, uri):
+        """Check whether a database URI belongs to a replica.
+
+        :param uri: Database URI
+        :returns: `True` if the URI was passed to `candidates` before
+
+        """
+        return uri in self._uris
+
+    def candidates(self, uris):
+        """Get the replicas to try for a request, in order.
+
+        Healthy replicas are rotated, so each of them comes first equally often. A
+        failed replica whose time is up comes before them, to check whether it works
+        again, but only for one request at a time.
+
+        :param uris: Database URIs of all replicas
+        :returns: List of database URIs
+
+        """
+        if not uris:
+            return []
+
+        now = time.monotonic()
+        with self._lock:
+            self._uris.update(uris)
+            healthy = [uri for uri in uris if uri not in self._down]
+            retry = [uri for uri in uris if self._down.get(uri, now) < now]
+            for uri in retry:
+                self._down[uri] = now + self.retry_after
+
+        if healthy:
+            turn = next(self._turn) % len(healthy)
+            healthy = healthy[turn:] + healthy[:turn]
+        return retry + healthy
+
+    def failed(self, uri):
+        """Skip a replica for `retry_after` seconds.
+
+        :param uri: Database URI of the replica
+
+        """
+        with self._lock:
+            self._down[uri] = time.monotonic() + self.retry_after
+
+    def succeeded(self, uri):
+        """Use a replica again.
+
+        :param uri: Database URI of the replica
+
+        """
+        if uri in self._down:
+            with self._lock:
+                self._down.pop(uri, None)
+
+
+replicas = ReplicaSet()
@@ -0,0 +1,263 @@
+"""Periodic reports, aggregated by the database."""
+from calendar import monthrange
+from collections import defaultdict, namedtuple
+from datetime import date
+from decimal import Decimal
+
+from piecash import Split, Transaction
+from piecash.core.account import assetliab_types, incexp_types, negative_types
+from sqlalchemy import func
+
+from .accounts import account_index
+from .balance import valuation_rates
+from .cache import cached_lru
+
+# Account types included in each kind of report
+REPORT_TYPES = {
+    "income": incexp_types,
+    "cashflow": assetliab_types,
+}
+
+# Format of period keys, for each granularity
+PERIODS = {"month": "%Y-%m", "year": "%Y"}
+
+# Number of reports (i.e. combinations of parameters) cached per database
+REPORT_CACHE_SIZE = 16
+
+ReportRow = namedtuple("ReportRow", ["account", "depth", "values", "total"])
+ReportRow.__doc__ = """Line of a report.
+
+`account` is an `.accounts.AccountEntry`, `depth` the nesting level below the top level
+accounts (starting at 0) and `values` the amounts for each period, including
+subaccounts.
+"""
+
+Report = namedtuple(
+    "Report", ["kind", "granularity", "periods", "rows", "totals", "total"]
+)
+Report.__doc__ = """Amounts per account and period.
+
+`periods` are keys such as `2024-01` (for months) or `2024` (for years), `rows` is a
+list of `ReportRow` in tree order, `totals` are the sums of the top level accounts for
+each period and `total` is the sum of these.
+
+Amounts that can not be converted to the default currency, since there is no price for
+their commodity, are `None`, as are all sums including them.
+"""
+
+
+def period_report(book, kind, granularity="month", start=None, end=None):
+    """Compute report of amounts per account and period.
+
+    For `kind == 'income'`, this is the income and expenses of each period, with income
+    as positive and expenses as negative amounts, such that the totals are the profit.
+    For `kind == 'cashflow'`, this is the change of each asset and liability account
+    in each period, with incoming money as positive amounts, such that the totals are
+    the change in net worth.
+
+    All splits are summed up per account and period by a single grouped query, then
+    converted to the default currency of the book at the prices in effect at the end of
+    each period (see `.balance.valuation_rates`), rolled up the account tree and rounded
+    to the currency's smallest unit. The most recently used `REPORT_CACHE_SIZE` reports
+    are cached as long as the book does not change.
+
+    :param book: GnuCash book
+    :param kind: Either `'income'` or `'cashflow'`
+    :param granularity: Either `'month'` or `'year'`
+    :param start: Only include transactions on or after this date
+    :param end: Only include transactions on or before this date
+    :returns: `Report`
+    :raises ValueError: If `kind` or `granularity` is not supported
+
+    """
+    if kind not in REPORT_TYPES:
+        raise ValueError(f"Unsupported report: {kind}")
+    if granularity not in PERIODS:
+        raise ValueError(f"Unsupported period: {granularity}")
+
+    return cached_lru(
+        book,
+        "reports",
+        (kind, granularity, start, end),
+        lambda book: _compute_report(book, kind, granularity, start, end),
+        REPORT_CACHE_SIZE,
+    )
+
+
+def _compute_report(book, kind, granularity, start, end):
+    """Compute report, see `period_report`.
+
+    :returns: `Report`
+
+    """
+    index = account_index(book)
+    accounts = {
+        guid: entry
+        for guid, entry in index.by_guid.items()
+        if entry.type in REPORT_TYPES[kind]
+    }
+
+    period = _period_expression(book.session.bind.dialect.name, granularity)
+    query = (
+        book.session.query(
+            Split.account_guid,
+            period,
+            Split._quantity_denom,
+            func.sum(Split._quantity_num),
+        )
+        .join(Split.transaction)
+        .filter(Split.account_guid.in_(accounts))
+        .group_by(Split.account_guid, period, Split._quantity_denom)
+    )
+    if start is not None:
+        query = query.filter(Transaction._post_date >= start)
+    if end is not None:
+        query = query.filter(Transaction._post_date <= end)
+
+    commodities = {entry.commodity_guid for entry in accounts.values()}
+    rates = {}
+
+    # Income and expenses are reported from the owner's point of view, so money coming
+    # in is positive. Asset and liability changes already are.
+    sign = -1 if kind == "income" else 1
+
+    amounts = defaultdict(lambda: defaultdict(Decimal))
+    for guid, key, denom, num in query:
+        # Value each period at the prices in effect at its end
+        if key not in rates:
+            at = _period_end(key, granularity)
+            rates[key] = valuation_rates(
+                book,
+                commodities,
+                book.default_currency.guid,
+                at=min(at, end) if end is not None else at,
+            )
+
+        entry = accounts[guid]
+        rate = rates[key][entry.commodity_guid]
+        value = None if rate is None else sign * Decimal(num) / Decimal(denom) * rate
+
+        # Roll up to all parents of the same kind, amounts without a price make the
+        # sums unknown
+        while entry is not None and entry.guid in accounts:
+            values = amounts[entry.guid]
+            values[key] = _add(values[key], value)
+            entry = index.by_guid.get(entry.parent_guid)
+
+    periods = _all_periods(
+        {key for values in amounts.values() for key in values}, granularity
+    )
+
+    # Round to the smallest unit of the currency
+    unit = Decimal(1) / book.default_currency.fraction
+    for values in amounts.values():
+        for key in values:
+            if values[key] is not None:
+                values[key] = values[key].quantize(unit)
+
+    rows = []
+    top_level = [
+        entry
+        for entry in accounts.values()
+        if entry.parent_guid not in accounts and entry.guid in amounts
+    ]
+    todo = [(entry, 0) for entry in sorted(top_level, key=_row_order, reverse=True)]
+    while todo:
+        entry, depth = todo.pop()
+        values = [amounts[entry.guid].get(key, Decimal(0)) for key in periods]
+        rows.append(ReportRow(entry, depth, values, _sum(values)))
+
+        children = [
+            child for child in index.children[entry.guid] if child.guid in amounts
+        ]
+        todo.extend(
+            (child, depth + 1)
+            for child in sorted(children, key=_row_order, reverse=True)
+        )
+
+    totals = [
+        _sum(amounts[entry.guid].get(key, Decimal(0)) for entry in top_level)
+        for key in periods
+    ]
+
+    return Report(kind, granularity, periods, rows, totals, _sum(totals))
+
+
+def _add(a, b):
+    """Add two amounts, either of which may be unknown (`None`)."""
+    return None if a is None or b is None else a + b
+
+
+def _sum(amounts):
+    """Sum up amounts, the sum is unknown (`None`) if any of them is."""
+    total = Decimal(0)
+    for amount in amounts:
+        total = _add(total, amount)
+    return total
+
+
+def _period_end(key, granularity):
+    """Get the last day of a period.
+
+    :param key: Period key, see `Report`
+    :param granularity: Either `'month'` or `'year'`
+    :returns: Date
+
+    """
+    if granularity == "year":
+        return date(int(key), 12, 31)
+
+    year, month = map(int, key.split("-"))
+    return date(year, month, monthrange(year, month)[1])
+
+
+def _row_order(entry):
+    """Get sort key for report rows: Income before expenses, then by name.
+
+    :param entry: `.accounts.AccountEntry`
+    :returns: Sort key
+
+    """
+    return (entry.type not in negative_types, entry.name)
+
+
+def _period_expression(dialect, granularity):
+    """Build SQL expression for the period of a transaction.
+
+    :param dialect: Name of the database dialect
+    :param granularity: Either `'month'` or `'year'`
+    :returns: SQL expression, evaluating to period keys as described in `Report`
+
+    """
+    post_date = Transaction.__table__.c.post_date
+    if dialect == "postgresql":
+        return func.to_char(
+            post_date, {"month": "YYYY-MM", "year": "YYYY"}[granularity]
+        )
+    elif dialect == "mysql":
+        return func.date_format(post_date, PERIODS[granularity])
+    else:
+        return func.strftime(PERIODS[granularity], post_date)
+
+
+def _all_periods(keys, granularity):
+    """Get all periods between the first and last of the given ones.
+
+    :param keys: Set of period keys
+    :param granularity: Either `'month'` or `'year'`
+    :returns: Sorted list of period keys without gaps
+
+    """
+    if not keys:
+        return []
+
+    first, last = min(keys), max(keys)
+    if granularity == "year":
+        return [str(year) for year in range(int(first), int(last) + 1)]
+
+    year, month = map(int, first.split("-"))
+    periods = []
+    while f"{year:04d}-{month:02d}" <= last:
+        periods.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return periods
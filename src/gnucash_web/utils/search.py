@@ -0,0 +1,411 @@
+"""Filtering transactions in the database.
+
+Filters compile to SQL predicates on indexed columns where possible. Text search over
+transaction descriptions uses a full-text index if one was created (see
+`create_search_index`), and a plain substring match otherwise.
+"""
+import re
+from collections import namedtuple
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from piecash import Split, Transaction
+from sqlalchemy import and_, bindparam, event, func, select, text
+from sqlalchemy.orm import aliased
+
+# Name of the SQLite table holding the indexed description of each transaction
+DOCUMENTS_TABLE = "gnucash_web_description_documents"
+
+# Name of the SQLite FTS5 table indexing `DOCUMENTS_TABLE`
+FTS_TABLE = "gnucash_web_description_fts"
+
+# Key of `Session.info` collecting the GUIDs of transactions changed in the session
+CHANGED_KEY = "gnucash_web.changed_transactions"
+
+# Maximum number of transactions updated by GUID, more are updated by comparing all
+MAX_UPDATED_GUIDS = 500
+
+# Name of the PostgreSQL trigram index on transaction descriptions
+TRGM_INDEX = "gnucash_web_description_trgm"
+
+SearchFilter = namedtuple(
+    "SearchFilter",
+    ["start", "end", "min_amount", "max_amount", "text", "account"],
+    defaults=[None] * 6,
+)
+SearchFilter.__doc__ = """Criteria for transactions.
+
+All criteria are optional. Amounts are compared to the absolute value of splits, `text`
+is searched in the description and `account` is the full name of an account involved in
+the transaction.
+"""
+
+# Largest integer the databases can store (64 bit signed)
+MAX_INTEGER = 2**63 - 1
+
+# Query parameters for each field of `SearchFilter`
+SEARCH_ARGS = {
+    "start": "start",
+    "end": "end",
+    "min_amount": "min",
+    "max_amount": "max",
+    "text": "q",
+    "account": "account",
+}
+
+
+def parse_filter(args):
+    """Read search filter from query parameters.
+
+    :param args: Query parameters, e.g. `request.args`, see `SEARCH_ARGS`
+    :returns: `SearchFilter`
+    :raises ValueError: If a parameter is malformed
+
+    """
+    values = {field: args.get(arg, "").strip() or None for field, arg in SEARCH_ARGS.items()}
+
+    for field in ["start", "end"]:
+        if values[field] is not None:
+            values[field] = date.fromisoformat(values[field])
+
+    for field in ["min_amount", "max_amount"]:
+        if values[field] is not None:
+            try:
+                amount = abs(Decimal(values[field]))
+            except InvalidOperation:
+                raise ValueError(f"Invalid amount: {values[field]}")
+            # Amounts are bound as numerator and denominator, see `_amount_predicates`
+            if not amount.is_finite() or max(amount.as_integer_ratio()) > MAX_INTEGER:
+                raise ValueError(f"Amount out of range: {values[field]}")
+            values[field] = amount
+
+    return SearchFilter(**values)
+
+
+def filter_args(search):
+    """Convert search filter back to query parameters.
+
+    :param search: `SearchFilter`
+    :returns: Dictionary of query parameters, without unset criteria
+
+    """
+    return {
+        SEARCH_ARGS[field]: str(value)
+        for field, value in search._asdict().items()
+        if value is not None
+    }
+
+
+def filter_ledger(query, search, index):
+    """Restrict query for the splits in a ledger.
+
+    Here, the `account` criterion refers to the contra account of the splits.
+
+    :param query: Query selecting splits, joined with their transaction
+    :param search: `SearchFilter`
+    :param index: Account index of the book
+    :returns: Filtered query
+
+    """
+    query = query.filter(*_transaction_predicates(query.session, search))
+    query = query.filter(*_amount_predicates(Split, search))
+
+    if search.account is not None:
+        other = aliased(Split)
+        query = query.filter(
+            Split.transaction_guid.in_(
+                select([other.transaction_guid]).where(
+                    other.account_guid == _account_guid(index, search.account)
+                )
+            )
+        )
+
+    return query
+
+
+def filter_transactions(query, search, index):
+    """Restrict query for transactions.
+
+    Transactions match the amount criteria if any of their splits does, and the
+    `account` criterion if any of their splits is in the account.
+
+    :param query: Query selecting transactions
+    :param search: `SearchFilter`
+    :param index: Account index of the book
+    :returns: Filtered query
+
+    """
+    query = query.filter(*_transaction_predicates(query.session, search))
+
+    split_predicates = _amount_predicates(Split, search)
+    if search.account is not None:
+        split_predicates.append(Split.account_guid == _account_guid(index, search.account))
+
+    if split_predicates:
+        query = query.filter(
+            Transaction.guid.in_(
+                select([Split.transaction_guid]).where(and_(*split_predicates))
+            )
+        )
+
+    return query
+
+
+def _account_guid(index, fullname):
+    """Get GUID of account by full name.
+
+    :param index: Account index of the book
+    :param fullname: Full name of the account
+    :returns: GUID, or `None` (matching nothing) if there is no such account
+
+    """
+    entry = index.by_fullname.get(fullname)
+    return entry.guid if entry else None
+
+
+def _transaction_predicates(session, search):
+    """Build predicates on the transactions table.
+
+    :param session: SQLAlchemy session of the book
+    :param search: `SearchFilter`
+    :returns: List of SQL expressions
+
+    """
+    predicates = []
+
+    # Posting dates are bound with the same neutral time as stored by GnuCash
+    if search.start is not None:
+        predicates.append(Transaction._post_date >= search.start)
+    if search.end is not None:
+        predicates.append(Transaction._post_date <= search.end)
+
+    if search.text is not None:
+        predicates.append(_text_predicate(session, search.text))
+
+    return predicates
+
+
+def _amount_predicates(split, search):
+    """Build predicates on the value of splits.
+
+    :param split: Split entity or alias
+    :param search: `SearchFilter`
+    :returns: List of SQL expressions
+
+    """
+    # Denominators are positive, so we can compare exactly without dividing
+    predicates = []
+    if search.min_amount is not None:
+        num, denom = search.min_amount.as_integer_ratio()
+        predicates.append(func.abs(split._value_num) * denom >= split._value_denom * num)
+    if search.max_amount is not None:
+        num, denom = search.max_amount.as_integer_ratio()
+        predicates.append(func.abs(split._value_num) * denom <= split._value_denom * num)
+    return predicates
+
+
+def _text_predicate(session, needle):
+    """Build predicate matching transaction descriptions.
+
+    With SQLite, the full-text index is used if it exists. It matches words starting
+    with the given words, in any order. Only transactions whose description is still
+    the indexed one match, so transactions changed by other programs since the index
+    was last updated (see `update_search_index`) are not found. Otherwise, the
+    description has to contain the search text, ignoring case. On PostgreSQL, this is
+    sped up by the trigram index.
+
+    :param session: SQLAlchemy session of the book
+    :param needle: Text to search for
+    :returns: SQL expression
+
+    """
+    if session.bind.dialect.name == "sqlite" and has_search_index(session):
+        words = re.findall(r"\w+", needle)
+        if words:
+            match = " ".join(f'"{word}"*' for word in words)
+            return text(
+                "(transactions.guid, transactions.description) IN"
+                f" (SELECT guid, description FROM {DOCUMENTS_TABLE}"
+                f" WHERE id IN (SELECT rowid FROM {FTS_TABLE}"
+                f" WHERE {FTS_TABLE} MATCH :match))"
+            ).bindparams(match=match)
+
+    pattern = "%{}%".format(
+        needle.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    )
+    return Transaction.description.ilike(pattern, escape="\\")
+
+
+def has_search_index(session):
+    """Check whether the full-text index exists.
+
+    :param session: SQLAlchemy session of the book
+    :returns: `True` if the index exists
+
+    """
+    dialect = session.bind.dialect.name
+    if dialect == "sqlite":
+        query = "SELECT 1 FROM sqlite_master WHERE name = :name"
+        name = FTS_TABLE
+    elif dialect == "postgresql":
+        query = "SELECT 1 FROM pg_indexes WHERE indexname = :name"
+        name = TRGM_INDEX
+    else:
+        return False
+
+    return session.execute(text(query), {"name": name}).first() is not None
+
+
+def create_search_index(connection):
+    """Create full-text index over transaction descriptions.
+
+    With SQLite, the descriptions are copied to a separate table, keyed by the GUID of
+    their transaction, which an FTS5 table indexes. GnuCash's own tables are left
+    untouched, so GnuCash does not need FTS5 support. The copies are updated whenever
+    GnuCash Web commits changes to transactions (see `track_search_index`), changes by
+    other programs are only picked up by `update_search_index`. An existing index is
+    rebuilt from scratch.
+
+    With PostgreSQL, this is a trigram index, which requires the `pg_trgm` extension.
+
+    :param connection: SQLAlchemy connection to the database, within a transaction
+    :raises NotImplementedError: For other databases
+
+    """
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        drop_search_index(connection)
+        statements = [
+            f"CREATE TABLE {DOCUMENTS_TABLE} (id INTEGER PRIMARY KEY,"
+            " guid TEXT NOT NULL UNIQUE, description TEXT NOT NULL)",
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(description,"
+            f" content='{DOCUMENTS_TABLE}', content_rowid='id')",
+        ]
+    elif dialect == "postgresql":
+        statements = [
+            "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+            f"CREATE INDEX IF NOT EXISTS {TRGM_INDEX}"
+            " ON transactions USING gin (description gin_trgm_ops)",
+        ]
+    else:
+        raise NotImplementedError(f"Search index is not supported for {dialect}")
+
+    for statement in statements:
+        connection.execute(text(statement))
+
+    if dialect == "sqlite":
+        update_search_index(connection)
+
+
+def update_search_index(connection, guids=None):
+    """Bring the SQLite full-text index up to date with the transactions.
+
+    Copies of descriptions whose transaction was deleted or changed are removed from
+    the index, and the current descriptions of changed or new transactions are added.
+    Transactions are matched by GUID. There is nothing to do for PostgreSQL, whose
+    index is maintained by the database.
+
+    :param connection: SQLAlchemy connection to the database, within a transaction
+    :param guids: GUIDs of the transactions to update, all if `None` (or if there are
+      more than `MAX_UPDATED_GUIDS`)
+
+    """
+    if connection.dialect.name != "sqlite":
+        return
+
+    params = {}
+    only_docs = only_transactions = ""
+    if guids is not None and len(guids) <= MAX_UPDATED_GUIDS:
+        if not guids:
+            return
+        params["guids"] = list(guids)
+        only_docs = f" AND {DOCUMENTS_TABLE}.guid IN :guids"
+        only_transactions = " AND transactions.guid IN :guids"
+
+    stale = (
+        f" WHERE NOT EXISTS (SELECT 1 FROM transactions"
+        f" WHERE transactions.guid = {DOCUMENTS_TABLE}.guid"
+        " AND coalesce(transactions.description, '')"
+        f" = {DOCUMENTS_TABLE}.description){only_docs}"
+    )
+
+    def execute(statement):
+        statement = text(statement)
+        if ":guids" in statement.text:
+            statement = statement.bindparams(bindparam("guids", expanding=True))
+        return connection.execute(statement, params)
+
+    # Removing from an external content index requires the removed values
+    execute(
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, description)"
+        f" SELECT 'delete', id, description FROM {DOCUMENTS_TABLE}{stale}"
+    )
+    execute(f"DELETE FROM {DOCUMENTS_TABLE}{stale}")
+
+    # Rows inserted now get larger ids than all remaining ones
+    params["last_id"] = execute(
+        f"SELECT coalesce(max(id), 0) FROM {DOCUMENTS_TABLE}"
+    ).scalar()
+    execute(
+        f"INSERT INTO {DOCUMENTS_TABLE}(guid, description)"
+        " SELECT guid, coalesce(description, '') FROM transactions"
+        f" WHERE guid NOT IN (SELECT guid FROM {DOCUMENTS_TABLE}){only_transactions}"
+    )
+    execute(
+        f"INSERT INTO {FTS_TABLE}(rowid, description)"
+        f" SELECT id, description FROM {DOCUMENTS_TABLE} WHERE id > :last_id"
+    )
+
+
+def track_search_index(session):
+    """Update the full-text index whenever transactions are committed in the session.
+
+    Only the changed transactions are updated, see `update_search_index`.
+
+    :param session: SQLAlchemy session of a book opened in writable mode
+
+    """
+
+    @event.listens_for(session, "after_flush")
+    def after_flush(session, flush_context):
+        changed = session.info.setdefault(CHANGED_KEY, set())
+        for instance in [*session.new, *session.dirty, *session.deleted]:
+            if isinstance(instance, Transaction):
+                changed.add(instance.guid)
+
+    @event.listens_for(session, "before_commit")
+    def before_commit(session):
+        # Pending changes are only flushed after this hook
+        session.flush()
+        changed = session.info.pop(CHANGED_KEY, set())
+        changed.discard(None)
+        if changed and session.bind.dialect.name == "sqlite" and has_search_index(
+            session
+        ):
+            update_search_index(session.connection(), changed)
+
+    @event.listens_for(session, "after_rollback")
+    def after_rollback(session):
+        session.info.pop(CHANGED_KEY, None)
+
+
+def drop_search_index(connection):
+    """Remove the full-text index, see `create_search_index`.
+
+    :param connection: SQLAlchemy connection to the database, within a transaction
+    :raises NotImplementedError: For databases other than SQLite and PostgreSQL
+
+    """
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        statements = [
+            f"DROP TABLE IF EXISTS {FTS_TABLE}",
+            f"DROP TABLE IF EXISTS {DOCUMENTS_TABLE}",
+        ]
+    elif dialect == "postgresql":
+        statements = [f"DROP INDEX IF EXISTS {TRGM_INDEX}"]
+    else:
+        raise NotImplementedError(f"Search index is not supported for {dialect}")
+
+    for statement in statements:
+        connection.execute(text(statement))
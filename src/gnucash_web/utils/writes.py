@@ -0,0 +1,296 @@
+"""Changes to transactions made through the web interface.
+
+All functions take a book opened by `writable_book` and commit their change right
+away. Transactions are loaded by primary key together with their splits, and edits
+update the existing split rows instead of replacing them, so each change only touches
+the rows involved.
+"""
+import hashlib
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+
+from piecash import Split, Transaction
+from sqlalchemy.orm import selectinload
+from werkzeug.exceptions import BadRequest, Conflict, NotFound
+
+from .gnucash import DatabaseLocked, open_book
+
+# One lock per database URI, serialising the writes of this process
+_write_locks = defaultdict(threading.Lock)
+_write_locks_lock = threading.Lock()
+
+
+class TransactionNotFound(NotFound):
+    """GnuCash Transaction was not found."""
+
+    def __init__(self, guid, *args, **kwargs):
+        """Create error.
+
+        :param guid: GUID of the non-existent transaction
+        :returns: New Exception
+
+        """
+        super().__init__(f"Transaction {guid} not found", *args, **kwargs)
+        self.guid = guid
+
+
+class TransactionChanged(Conflict):
+    """GnuCash Transaction was changed since it was loaded."""
+
+    def __init__(self, guid, *args, **kwargs):
+        """Create error.
+
+        :param guid: GUID of the changed transaction
+        :returns: New Exception
+
+        """
+        super().__init__(
+            "The transaction was changed by someone else in the meantime."
+            " Reload the page and try again.",
+            *args,
+            **kwargs,
+        )
+        self.guid = guid
+
+
+@contextmanager
+def writable_book(uri_conn, open_if_lock=None, timeout=5, backoff=0.05):
+    """Open GnuCash book for writing, waiting for other writers.
+
+    Should be used as context manager.
+
+    Writes of this process to the same database are queued, so only one of them has
+    the book open at a time. If the database is locked by someone else (e.g. GnuCash
+    itself), opening is retried with exponential backoff until `timeout`. Writes of
+    other processes are serialised by the database, and lost updates are detected by
+    `transaction_version`.
+
+    :param uri_conn: Database URI, as returned by `GnuCashWebConfig.DB_URI`
+    :param open_if_lock: See `.gnucash.open_book`, no retries are needed if `True`
+    :param timeout: Maximum number of seconds to wait
+    :param backoff: Seconds to wait before the first retry, doubled for every retry
+    :returns: The book
+    :raises DatabaseLocked: If the database is still locked after `timeout`
+
+    """
+    deadline = time.monotonic() + timeout
+
+    with _write_locks_lock:
+        lock = _write_locks[uri_conn]
+    if not lock.acquire(timeout=timeout):
+        raise DatabaseLocked()
+
+    try:
+        with ExitStack() as stack:
+            while True:
+                try:
+                    book = stack.enter_context(
+                        open_book(
+                            uri_conn,
+                            readonly=False,
+                            open_if_lock=open_if_lock,
+                            do_backup=False,
+                        )
+                    )
+                    break
+                except DatabaseLocked:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise
+                    time.sleep(min(backoff, remaining))
+                    backoff *= 2
+
+            yield book
+    finally:
+        lock.release()
+
+
+def transaction_version(transaction):
+    """Get a fingerprint of the contents of a transaction.
+
+    GnuCash does not keep a version number of transactions, so this is a hash of all
+    fields that can be changed. It is sent along with edits, to detect whether the
+    transaction was changed in the meantime.
+
+    :param transaction: The transaction, with its splits loaded
+    :returns: Short hexadecimal string
+
+    """
+    content = (
+        transaction.description,
+        transaction.post_date,
+        transaction.num,
+        transaction.currency_guid,
+        sorted(
+            (split.guid, split.account_guid, split.value, split.quantity)
+            for split in transaction.splits
+        ),
+    )
+    return hashlib.sha1(repr(content).encode()).hexdigest()[:16]
+
+
+def get_transaction(book, guid, for_update=False):
+    """Load a transaction and its splits.
+
+    :param book: The book containing the transaction
+    :param guid: GUID of the transaction
+    :param for_update: Lock the transaction row until the changes are committed (on
+      databases supporting this)
+    :returns: The transaction
+    :raises TransactionNotFound: If there is no such transaction
+
+    """
+    query = (
+        book.session.query(Transaction)
+        .filter(Transaction.guid == guid)
+        .options(selectinload(Transaction.splits))
+    )
+    if for_update:
+        query = query.with_for_update()
+
+    transaction = query.first()
+    if transaction is None:
+        raise TransactionNotFound(guid)
+    return transaction
+
+
+def add_transaction(book, account, contra_account, description, post_date, value):
+    """Add a transaction between two accounts.
+
+    :param book: The book, opened writable
+    :param account: Receiving account
+    :param contra_account: Contra account
+    :param description: Transaction description
+    :param post_date: Date of the transaction
+    :param value: Amount transferred from the contra account to the account, negative
+      for the opposite direction
+    :returns: The new transaction
+    :raises BadRequest: If the accounts can not be used, see `check_accounts`
+
+    """
+    check_accounts(account, contra_account)
+
+    # This can not fail, since currency is a valid commodity, description can be
+    # any string, post_date is a valid datetime.date, account and contra_account
+    # are valid non-placeholder accounts and value is a Decimal. Any other error
+    # should be considered a bug.
+    transaction = Transaction(
+        currency=account.commodity,
+        description=description,
+        post_date=post_date,
+        splits=[
+            Split(account=account, value=value),
+            Split(account=contra_account, value=-value),
+        ],
+    )
+
+    book.save()
+    return transaction
+
+
+def edit_transaction(
+    book, guid, account, contra_account, description, post_date, value, version=None
+):
+    """Change a transaction between two accounts.
+
+    The existing splits are updated in place: The split already in `account` (or the
+    first one) becomes the split of the account, the other one the split of the contra
+    account. Splits whose account or value changes are no longer reconciled, memos are
+    kept.
+
+    If `version` is given, the transaction is only changed if it still has this version
+    (see `transaction_version`).
+
+    :param book: The book, opened writable
+    :param guid: GUID of the transaction
+    :param account: Receiving account
+    :param contra_account: Contra account
+    :param description: Transaction description
+    :param post_date: Date of the transaction
+    :param value: See `add_transaction`
+    :param version: Expected version of the transaction
+    :returns: The transaction
+    :raises TransactionNotFound: If there is no such transaction
+    :raises TransactionChanged: If the transaction does not have the expected version
+    :raises BadRequest: If the transaction has more than two splits, or the accounts
+      can not be used
+
+    """
+    transaction = get_transaction(book, guid, for_update=True)
+
+    if version is not None and version != transaction_version(transaction):
+        raise TransactionChanged(guid)
+
+    if len(transaction.splits) > 2:
+        raise BadRequest("Can not edit transactions with more than 2 splits.")
+
+    check_accounts(account, contra_account)
+
+    splits = sorted(transaction.splits, key=lambda split: split.account != account)
+    while len(splits) < 2:
+        splits.append(Split(account=contra_account, value=0, transaction=transaction))
+
+    for split, split_account, split_value in [
+        (splits[0], account, value),
+        (splits[1], contra_account, -value),
+    ]:
+        if split.account != split_account or split.value != split_value:
+            split.account = split_account
+            split.value = split_value
+            split.quantity = split_value
+            split.reconcile_state = "n"
+            split.reconcile_date = None
+
+    if transaction.currency != account.commodity:
+        transaction.currency = account.commodity
+    if transaction.description != description:
+        transaction.description = description
+    if transaction.post_date != post_date:
+        transaction.post_date = post_date
+
+    book.save()
+    return transaction
+
+
+def delete_transaction(book, guid, version=None):
+    """Delete a transaction and its splits.
+
+    If `version` is given, the transaction is only deleted if it still has this version
+    (see `transaction_version`).
+
+    :param book: The book, opened writable
+    :param guid: GUID of the transaction
+    :param version: Expected version of the transaction
+    :raises TransactionNotFound: If there is no such transaction
+    :raises TransactionChanged: If the transaction does not have the expected version
+
+    """
+    transaction = get_transaction(book, guid, for_update=True)
+
+    if version is not None and version != transaction_version(transaction):
+        raise TransactionChanged(guid)
+
+    book.delete(transaction)
+    book.save()
+
+
+def check_accounts(account, contra_account):
+    """Check that a simple transaction between two accounts can be entered.
+
+    :param account: Receiving account
+    :param contra_account: Contra account
+    :raises BadRequest: If an account is a placeholder, or the accounts are in
+      different commodities
+
+    """
+    for checked in [account, contra_account]:
+        if checked.placeholder:
+            raise BadRequest(f"{checked.fullname} is a placeholder")
+
+    # TODO: Support accounts with different currencies
+    if account.commodity != contra_account.commodity:
+        raise BadRequest(
+            f"Incompatible accounts: {account.commodity} != {contra_account.commodity}"
+        )
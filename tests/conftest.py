@@ -0,0 +1,55 @@
+"""Fixtures shared by the tests: A small SQLite book and an app serving it."""
+from datetime import date
+from decimal import Decimal
+
+import piecash
+import pytest
+
+from gnucash_web import create_app
+from gnucash_web.utils.pool import engines
+
+
+@pytest.fixture
+def book_path(tmp_path):
+    """Create a book with a checking account, a food account and one transaction."""
+    path = tmp_path / "book.sqlite"
+    with piecash.create_book(sqlite_file=str(path), currency="EUR") as book:
+        eur = book.default_currency
+        assets = piecash.Account(
+            "Assets", "ASSET", eur, parent=book.root_account, placeholder=True
+        )
+        checking = piecash.Account("Checking", "BANK", eur, parent=assets)
+        food = piecash.Account("Food", "EXPENSE", eur, parent=book.root_account)
+        piecash.Transaction(
+            currency=eur,
+            description="Groceries",
+            post_date=date(2024, 1, 15),
+            splits=[
+                piecash.Split(account=checking, value=Decimal("-12.50")),
+                piecash.Split(account=food, value=Decimal("12.50")),
+            ],
+        )
+        book.save()
+    return path
+
+
+@pytest.fixture
+def app(book_path, tmp_path):
+    """Create app serving the book of `book_path`, without authentication."""
+    app = create_app(
+        {
+            "TESTING": True,
+            "DB_DRIVER": "sqlite",
+            "DB_NAME": str(book_path),
+            "CHANGE_FEED_FILE": str(tmp_path / "changes"),
+            "WRITE_LOCK_TIMEOUT": 1,
+        }
+    )
+    yield app
+    engines.dispose()
+
+
+@pytest.fixture
+def client(app):
+    """Create test client of `app`."""
+    return app.test_client()
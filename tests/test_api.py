@@ -0,0 +1,49 @@
+"""Tests of the JSON API."""
+import json
+import sqlite3
+
+
+def test_list_splits_pages_with_cursor(client):
+    first = client.get("/api/accounts/Food/splits?limit=1")
+    assert first.status_code == 200
+    assert len(first.json["splits"]) == 1
+    cursor = first.json["next_cursor"]
+
+    second = client.get(f"/api/accounts/Food/splits?limit=1&cursor={cursor}")
+    assert second.status_code == 200
+    assert second.json == {"splits": [], "next_cursor": None}
+
+
+def test_unknown_account_is_json_404(client):
+    for url in ["/api/accounts/Nope/splits", "/api/accounts/Nope/splits.ndjson"]:
+        response = client.get(url)
+        assert response.status_code == 404
+        assert response.json == {"error": "Account Nope not found"}
+
+
+def test_bad_parameters_are_json_400(client):
+    for query in ["limit=abc", "limit=0", "cursor=bogus"]:
+        response = client.get(f"/api/accounts/Food/splits?{query}")
+        assert response.status_code == 400
+        assert "error" in response.json
+
+
+def test_cursor_of_other_or_deleted_split_is_rejected(client, book_path):
+    checking = client.get("/api/accounts/Assets/Checking/splits").json["splits"][0]
+    food = client.get("/api/accounts/Food/splits").json["splits"][0]
+
+    # A split of another account
+    response = client.get(f"/api/accounts/Food/splits?cursor={checking['guid']}")
+    assert response.status_code == 400
+
+    with sqlite3.connect(book_path) as connection:
+        connection.execute("DELETE FROM splits WHERE guid = ?", (food["guid"],))
+    response = client.get(f"/api/accounts/Food/splits?cursor={food['guid']}")
+    assert response.status_code == 400
+
+
+def test_export_splits(client):
+    response = client.get("/api/accounts/Assets/Checking/splits.ndjson")
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [line["description"] for line in lines] == ["Groceries"]
@@ -0,0 +1,54 @@
+"""Tests of noticing changes made to the book by other programs."""
+import sqlite3
+import threading
+import time
+
+import pytest
+import sqlalchemy
+
+from gnucash_web.utils.cache import book_version
+from gnucash_web.utils.changes import feed
+from gnucash_web.utils.gnucash import open_book
+
+
+def version(app):
+    with open_book(app.config.DB_URI(), open_if_lock=True) as book:
+        return book_version(book)
+
+
+def wait_for_checksum():
+    for thread in threading.enumerate():
+        if thread.name == "change-feed-checksum":
+            thread.join()
+
+
+def edit_in_place(path):
+    """Change an amount without changing any row count, like GnuCash would."""
+    with sqlite3.connect(path) as connection:
+        connection.execute("UPDATE splits SET value_num = -value_num")
+
+
+def test_fingerprint_ignores_edits_in_place(app, book_path):
+    before = version(app)
+    edit_in_place(book_path)
+    assert version(app) == before
+
+
+def test_checksum_notices_edits_in_place(app, book_path):
+    feed.configure(app.config.CHANGE_FEED_FILE, 0, 0.01)
+
+    before = version(app)
+    wait_for_checksum()
+    assert version(app) == before
+
+    edit_in_place(book_path)
+    time.sleep(0.02)
+    version(app)
+    wait_for_checksum()
+    assert version(app) != before
+
+
+def test_checksum_function_is_not_global(book_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{book_path}")
+    with pytest.raises(sqlalchemy.exc.OperationalError):
+        engine.execute("SELECT gnc_crc32('x')")
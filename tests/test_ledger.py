@@ -0,0 +1,53 @@
+"""Tests of running balances in the ledger."""
+import sqlite3
+from datetime import date
+from decimal import Decimal
+
+import piecash
+import pytest
+
+from gnucash_web.utils import ledger
+from gnucash_web.utils.gnucash import open_book
+
+
+@pytest.fixture
+def checking(app, book_path):
+    """Add transactions with various denominators to the checking account."""
+    with piecash.open_book(str(book_path), readonly=False, do_backup=False) as book:
+        eur = book.default_currency
+        checking = book.accounts(fullname="Assets:Checking")
+        food = book.accounts(fullname="Food")
+        for day in range(1, 12):
+            value = Decimal(day) * Decimal("1.25")
+            piecash.Transaction(
+                currency=eur,
+                description=f"Day {day}",
+                post_date=date(2024, 2, day),
+                splits=[
+                    piecash.Split(account=checking, value=-value),
+                    piecash.Split(account=food, value=value),
+                ],
+            )
+        book.save()
+
+    with sqlite3.connect(book_path) as connection:
+        connection.execute(
+            "UPDATE splits SET quantity_num = quantity_num * 30,"
+            " quantity_denom = quantity_denom * 30 WHERE value_num % 2 = 0"
+        )
+
+    with open_book(app.config.DB_URI(), open_if_lock=True) as book:
+        yield book.accounts(fullname="Assets:Checking")
+
+
+@pytest.mark.parametrize("page_length", [1, 3, 5, 25])
+def test_checkpoints_without_window_functions(checking, monkeypatch, page_length):
+    checkpoints = ledger._load_checkpoints(checking, page_length)
+
+    monkeypatch.setattr(ledger, "_has_window_functions", lambda dialect: False)
+    assert ledger._load_checkpoints(checking, page_length) == checkpoints
+
+    total, sums = checkpoints
+    spent = sum(Decimal(day) * Decimal("1.25") for day in range(1, 12))
+    assert total == -Decimal("12.50") - spent
+    assert len(sums) == 1 + 12 // page_length
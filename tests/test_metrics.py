@@ -0,0 +1,22 @@
+"""Tests of measuring SQL statements."""
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from gnucash_web.utils.metrics import instrument_sql, start_request
+
+
+def test_failed_statements_leave_no_state(app):
+    instrument_sql()
+    engine = create_engine("sqlite://")
+
+    with app.test_request_context(), engine.connect() as connection:
+        metrics = start_request()
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                connection.execute(text("SELECT * FROM missing"))
+        connection.execute(text("SELECT 1"))
+
+        assert metrics.sql_count == 1
+        assert metrics.sql_time > 0
+        assert not connection.info
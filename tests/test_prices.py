@@ -0,0 +1,135 @@
+"""Tests of fetching prices with a quote provider."""
+import threading
+import time
+from datetime import date, timedelta
+
+import piecash
+import pytest
+
+from gnucash_web.utils.prices import (
+    QuoteProvider,
+    QuoteRequest,
+    RateLimiter,
+    StubQuoteProvider,
+    fetch_quotes,
+)
+
+STUB = "gnucash_web.utils.prices.StubQuoteProvider"
+
+
+@pytest.fixture
+def commodities(book_path):
+    """Enable quotes for a share quoted in USD, a missing currency, and for USD."""
+    with piecash.open_book(str(book_path), readonly=False, do_backup=False) as book:
+        usd = book.currencies(mnemonic="USD")
+        usd.quote_flag = 1
+        share = piecash.Commodity(
+            namespace="NASDAQ", mnemonic="GNC", fullname="GnuCash Inc", fraction=100
+        )
+        share.quote_flag = 1
+        book.add(share)
+        book.save()
+
+
+def stored_prices(book_path):
+    with piecash.open_book(str(book_path), readonly=True, open_if_lock=True) as book:
+        return sorted(
+            (price.commodity.mnemonic, price.currency.mnemonic, price.date, price.value)
+            for price in book.prices
+        )
+
+
+def test_update_prices_stores_stub_prices(app, book_path, commodities, monkeypatch):
+    # Quote the share in a currency missing from the book
+    monkeypatch.setattr(StubQuoteProvider, "currency", "CHF")
+
+    result = app.test_cli_runner().invoke(
+        args=["commodities", "update_prices", "--provider", STUB, "--workers", "2"]
+    )
+    assert result.exit_code == 0, result.output
+    assert "Added currency CHF" in result.output
+
+    start = date.today() - timedelta(days=7)
+    requests = [
+        QuoteRequest("CURRENCY", "USD", "EUR", start),
+        QuoteRequest("NASDAQ", "GNC", None, start),
+    ]
+    expected = sorted(
+        (request.mnemonic, request.base_currency or "CHF", quote.date, quote.value)
+        for request in requests
+        for quote in StubQuoteProvider().fetch(request)
+    )
+    assert len(expected) == 16
+    assert stored_prices(book_path) == expected
+
+    # Only prices after the latest known ones are fetched again, and those of the added
+    # currency (for which quotes are enabled by default)
+    result = app.test_cli_runner().invoke(
+        args=["commodities", "update_prices", "--provider", STUB]
+    )
+    assert result.exit_code == 0, result.output
+    prices = stored_prices(book_path)
+    assert [price for price in prices if price[0] != "CHF"] == expected
+    assert {price[:2] for price in prices if price[0] == "CHF"} == {("CHF", "EUR")}
+
+
+class SlowProvider(QuoteProvider):
+    """Provider recording the threads and times of its calls."""
+
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def source(self, request):
+        return request.namespace
+
+    def fetch(self, request):
+        with self.lock:
+            self.calls.append((request, threading.current_thread(), time.monotonic()))
+        time.sleep(0.05)
+        if request.mnemonic == "FAIL":
+            raise ValueError("No such symbol")
+        return [request.mnemonic]
+
+
+def test_fetch_quotes_uses_workers_and_rate_limits():
+    provider = SlowProvider()
+    requests = [
+        QuoteRequest(namespace, mnemonic, None, date.today())
+        for namespace in ["A", "B"]
+        for mnemonic in ["X", "Y", "FAIL"]
+    ]
+
+    results = fetch_quotes(provider, requests, max_workers=4, rate=20)
+
+    fetched = [results[request] for request in requests if request.mnemonic != "FAIL"]
+    assert fetched == [["X"], ["Y"], ["X"], ["Y"]]
+    assert all(
+        isinstance(results[request], ValueError)
+        for request in requests
+        if request.mnemonic == "FAIL"
+    )
+
+    assert len({thread for _, thread, _ in provider.calls}) > 1
+    for namespace in ["A", "B"]:
+        times = sorted(
+            t for request, _, t in provider.calls if request.namespace == namespace
+        )
+        # 20 calls per second per source, with some tolerance for the scheduler
+        assert all(b - a >= 0.04 for a, b in zip(times, times[1:]))
+
+
+def test_rate_limiter_spaces_calls():
+    limiter = RateLimiter(10)
+    start = time.monotonic()
+    for _ in range(4):
+        limiter.wait()
+    assert time.monotonic() - start >= 0.3
+
+
+def test_rate_limiter_without_limit():
+    limiter = RateLimiter(0)
+    start = time.monotonic()
+    for _ in range(100):
+        limiter.wait()
+    assert time.monotonic() - start < 0.1
@@ -0,0 +1,93 @@
+"""Tests of search filters and the SQLite full-text index over descriptions."""
+import sqlite3
+from decimal import Decimal
+
+import pytest
+from piecash import Transaction
+
+from gnucash_web.utils.gnucash import open_book
+from gnucash_web.utils.search import (
+    SearchFilter,
+    create_search_index,
+    filter_transactions,
+    parse_filter,
+    update_search_index,
+)
+from gnucash_web.utils.writes import writable_book
+
+
+def test_amounts_are_absolute():
+    search = parse_filter({"min": "-1.50", "max": " 20 "})
+    assert (search.min_amount, search.max_amount) == (Decimal("1.50"), Decimal(20))
+
+
+@pytest.mark.parametrize(
+    "amount", ["abc", "nan", "sNaN", "Infinity", "-inf", "1e400", "1e-400"]
+)
+def test_invalid_amounts_are_rejected(amount):
+    with pytest.raises(ValueError):
+        parse_filter({"min": amount})
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "/book/search?min=nan",
+        "/book/search?max=Infinity",
+        "/book/search?min=1e400",
+        "/book/accounts/Assets/Checking?min=nan",
+    ],
+)
+def test_invalid_amounts_are_bad_requests(client, url):
+    assert client.get(url).status_code == 400
+
+
+def search(app, text):
+    with open_book(app.config.DB_URI(), open_if_lock=True) as book:
+        query = filter_transactions(
+            book.session.query(Transaction), SearchFilter(text=text), None
+        )
+        return [transaction.description for transaction in query]
+
+
+def writable(app):
+    return writable_book(app.config.DB_URI(), open_if_lock=True)
+
+
+def test_index_follows_own_changes(app):
+    with app.test_request_context():
+        with writable(app) as book:
+            create_search_index(book.session.connection())
+            book.save()
+        assert search(app, "groc") == ["Groceries"]
+
+        with writable(app) as book:
+            book.session.query(Transaction).one().description = "Weekly market"
+            book.save()
+        assert search(app, "groc") == []
+        assert search(app, "market week") == ["Weekly market"]
+
+
+def test_index_is_updated_with_changes_by_others(app, book_path):
+    with app.test_request_context():
+        with writable(app) as book:
+            create_search_index(book.session.connection())
+            book.save()
+
+        connection = sqlite3.connect(book_path, isolation_level=None)
+        connection.execute("UPDATE transactions SET description = 'Bakery'")
+        # GnuCash's tables are not changed by the index, rows may be renumbered
+        assert connection.execute(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'trigger'"
+        ).fetchone() == (0,)
+        connection.execute("VACUUM")
+        connection.close()
+
+        # Outdated entries do not match, new ones are only found after an update
+        assert search(app, "groceries") == []
+        assert search(app, "bakery") == []
+
+        with writable(app) as book:
+            update_search_index(book.session.connection())
+            book.save()
+        assert search(app, "bakery") == ["Bakery"]
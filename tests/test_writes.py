@@ -0,0 +1,137 @@
+"""Tests of edits and deletions, and of waiting for other writers."""
+import sqlite3
+import threading
+import time
+
+import pytest
+from piecash import Transaction
+
+from gnucash_web.utils.gnucash import DatabaseLocked, open_book
+from gnucash_web.utils.writes import transaction_version, writable_book
+
+
+def current_transaction(app):
+    """Get GUID and version of the only transaction in the book."""
+    with open_book(app.config.DB_URI(), open_if_lock=True) as book:
+        transaction = book.session.query(Transaction).one()
+        return transaction.guid, transaction_version(transaction)
+
+
+def transaction_count(app):
+    with open_book(app.config.DB_URI(), open_if_lock=True) as book:
+        return book.session.query(Transaction).count()
+
+
+def edit(client, guid, version, description):
+    form = {
+        "account_name": "Assets:Checking",
+        "guid": guid,
+        "date": "2024-01-15",
+        "description": description,
+        "value": "12.50",
+        "contra_account_name": "Food",
+        "sign": "-1",
+    }
+    if version is not None:
+        form["version"] = version
+    return client.post("/book/edit_transaction", data=form)
+
+
+def delete(client, guid, version):
+    form = {"account_name": "Assets:Checking", "guid": guid}
+    if version is not None:
+        form["version"] = version
+    return client.post("/book/del_transaction", data=form)
+
+
+def test_edit_detects_concurrent_change(app, client):
+    guid, loaded = current_transaction(app)
+
+    # Fresh version
+    assert edit(client, guid, loaded, "Supermarket").status_code == 302
+
+    # Stale version: the form was loaded before the previous edit
+    response = edit(client, guid, loaded, "Bakery")
+    assert response.status_code == 409
+
+    guid, reloaded = current_transaction(app)
+    assert reloaded != loaded
+
+    # Reloaded version
+    assert edit(client, guid, reloaded, "Bakery").status_code == 302
+
+    with open_book(app.config.DB_URI(), open_if_lock=True) as book:
+        assert book.session.query(Transaction).one().description == "Bakery"
+
+
+def test_edit_requires_version(app, client):
+    guid, _ = current_transaction(app)
+    assert edit(client, guid, None, "Supermarket").status_code == 400
+
+
+def test_delete_detects_concurrent_change(app, client):
+    guid, loaded = current_transaction(app)
+    assert edit(client, guid, loaded, "Supermarket").status_code == 302
+
+    assert delete(client, guid, loaded).status_code == 409
+    assert transaction_count(app) == 1
+
+    guid, reloaded = current_transaction(app)
+    assert delete(client, guid, reloaded).status_code == 302
+    assert transaction_count(app) == 0
+
+
+def test_delete_requires_version(app, client):
+    guid, _ = current_transaction(app)
+    assert delete(client, guid, None).status_code == 400
+    assert transaction_count(app) == 1
+
+
+def lock_book(path):
+    """Lock the book like GnuCash does while it has it open."""
+    with sqlite3.connect(path) as connection:
+        connection.execute(
+            "INSERT INTO gnclock (hostname, pid) VALUES ('elsewhere', 1)"
+        )
+
+
+def unlock_book(path):
+    with sqlite3.connect(path) as connection:
+        connection.execute("DELETE FROM gnclock")
+
+
+def test_writable_book_times_out(app, book_path):
+    lock_book(book_path)
+
+    start = time.monotonic()
+    with app.test_request_context(), pytest.raises(DatabaseLocked):
+        with writable_book(app.config.DB_URI(), timeout=0.5, backoff=0.05):
+            pass
+    elapsed = time.monotonic() - start
+
+    assert 0.5 <= elapsed < 2
+
+
+def test_writable_book_retries_until_unlocked(app, book_path):
+    lock_book(book_path)
+    unlock = threading.Timer(0.3, unlock_book, (book_path,))
+    unlock.start()
+
+    start = time.monotonic()
+    try:
+        with app.test_request_context():
+            with writable_book(app.config.DB_URI(), timeout=5, backoff=0.05) as book:
+                assert book.session.query(Transaction).count() == 1
+    finally:
+        unlock.join()
+    elapsed = time.monotonic() - start
+
+    assert 0.3 <= elapsed < 5
+
+
+def test_writable_book_ignores_lock_if_asked(app, book_path):
+    lock_book(book_path)
+
+    with app.test_request_context():
+        with writable_book(app.config.DB_URI(), open_if_lock=True, timeout=0) as book:
+            assert book.session.query(Transaction).count() == 1